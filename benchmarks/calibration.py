@@ -0,0 +1,47 @@
+"""
+Time a fixed workload on the machine running the benchmarks.
+
+Benchmark times are stored and compared relative to the calibration time, so a baseline saved on one machine can be
+checked on another. The workload mixes interpreted Python and NumPy work like the benchmarked stages do.
+
+"""
+import time
+
+import numpy as np
+
+#: The number of times the workload is run. The fastest run is used.
+REPEAT = 10
+
+
+def run_workload():
+    rng = np.random.default_rng(0)
+
+    values = rng.random(1000000)
+    np.sort(values)
+    np.bincount((values * 1000).astype(np.int64), minlength=1000)
+
+    counts = dict()
+
+    for index in range(200000):
+        key = str(index % 1000)
+        counts[key] = counts.get(key, 0) + 1
+
+
+def calibrate(repeat: int = REPEAT) -> float:
+    """
+    Return the fastest wall time of :func:`run_workload` in seconds over ``repeat`` runs.
+
+    """
+    # The first run loads code and allocates memory that later runs reuse.
+    run_workload()
+
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_workload()
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
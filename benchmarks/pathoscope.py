@@ -0,0 +1,378 @@
+"""
+Benchmark the Pathoscope stages on synthetic VTA files.
+
+Each stage runs in a fresh process so that its wall time and peak RSS are not affected by earlier stages. Any input a
+stage needs, such as the matrix for EM, is prepared in the same process before the stage is timed. On Linux the peak
+RSS is reset before the stage starts, so setup memory is only counted if it is still held.
+
+Run from the repository root:
+
+.. code-block:: shell
+
+    python -m benchmarks.pathoscope --sizes 100000 1000000
+    python -m benchmarks.pathoscope --sizes 100000 1000000 --save-baseline
+
+Wall times are divided by the time of the calibration workload in :mod:`benchmarks.calibration`, run on the same
+machine, so results can be compared with a baseline saved on another machine. Peak RSS is compared as it is.
+
+Results are compared against ``benchmarks/baselines/pathoscope.json``. The command exits with status ``1`` if the
+relative wall time or peak RSS of any stage exceeds the baseline by more than ``--tolerance``.
+
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import benchmarks.calibration
+import benchmarks.synthetic
+import virtool.pathoscope
+import virtool.vtb
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "pathoscope.json")
+
+DEFAULT_SIZES = [100000, 1000000, 10000000]
+
+P_SCORE_CUTOFF = 0.01
+
+MAX_ITER = 50
+
+EPSILON = 1e-7
+
+
+def setup_vta(vta_path, ref_lengths, work_path):
+    return {}
+
+
+def setup_matrix(vta_path, ref_lengths, work_path):
+    u, nu, refs, reads = virtool.pathoscope.build_matrix(vta_path, P_SCORE_CUTOFF)
+
+    return {
+        "u": u,
+        "nu": nu,
+        "refs": refs,
+        "reads": reads
+    }
+
+
+def setup_matrix_arrays(vta_path, ref_lengths, work_path):
+    return {
+        "matrix": virtool.pathoscope.build_matrix_arrays(vta_path, P_SCORE_CUTOFF)
+    }
+
+
+def setup_reassigned(vta_path, ref_lengths, work_path):
+    matrix = virtool.pathoscope.build_matrix_arrays(vta_path, P_SCORE_CUTOFF)
+    virtool.pathoscope.em_matrix(matrix, MAX_ITER, EPSILON, 0, 0)
+
+    return {
+        "matrix": matrix
+    }
+
+
+def setup_vtb(vta_path, ref_lengths, work_path):
+    vtb_path = os.path.join(work_path, "to_isolates.vtb")
+    virtool.vtb.convert_vta(vta_path, vtb_path)
+
+    return {
+        "vtb_path": vtb_path
+    }
+
+
+def run_build_matrix(vta_path, ref_lengths, work_path):
+    virtool.pathoscope.build_matrix(vta_path, P_SCORE_CUTOFF)
+
+
+def run_em(vta_path, ref_lengths, work_path, u, nu, refs, reads):
+    virtool.pathoscope.em(u, nu, refs, MAX_ITER, EPSILON, 0, 0)
+
+
+def run_compute_best_hit(vta_path, ref_lengths, work_path, u, nu, refs, reads):
+    virtool.pathoscope.compute_best_hit(u, nu, refs, reads)
+
+
+def run_rewrite_align(vta_path, ref_lengths, work_path, u, nu, refs, reads):
+    virtool.pathoscope.rewrite_align(u, nu, vta_path, P_SCORE_CUTOFF, os.path.join(work_path, "reassigned.vta"))
+
+
+def run_calculate_coverage(vta_path, ref_lengths, work_path):
+    virtool.pathoscope.calculate_coverage(vta_path, ref_lengths)
+
+
+def run_build_matrix_arrays(vta_path, ref_lengths, work_path):
+    virtool.pathoscope.build_matrix_arrays(vta_path, P_SCORE_CUTOFF)
+
+
+def run_em_matrix(vta_path, ref_lengths, work_path, matrix):
+    virtool.pathoscope.em_matrix(matrix, MAX_ITER, EPSILON, 0, 0)
+
+
+def run_compute_best_hit_matrix(vta_path, ref_lengths, work_path, matrix):
+    virtool.pathoscope.compute_best_hit_matrix(matrix)
+
+
+def run_rewrite_align_matrix(vta_path, ref_lengths, work_path, matrix):
+    virtool.pathoscope.rewrite_align_matrix(
+        matrix,
+        vta_path,
+        P_SCORE_CUTOFF,
+        os.path.join(work_path, "reassigned.vta")
+    )
+
+
+def run_fused(vta_path, ref_lengths, work_path, vtb_path):
+    virtool.pathoscope.run_fused(vtb_path, dict(), ref_lengths, P_SCORE_CUTOFF, MAX_ITER, EPSILON)
+
+
+#: Benchmarked stages and the setup and run functions for each. Stages using the original dict-based matrix come first.
+STAGES = {
+    "build_matrix": (setup_vta, run_build_matrix),
+    "em": (setup_matrix, run_em),
+    "compute_best_hit": (setup_matrix, run_compute_best_hit),
+    "rewrite_align": (setup_matrix, run_rewrite_align),
+    "calculate_coverage": (setup_vta, run_calculate_coverage),
+    "build_matrix_arrays": (setup_vta, run_build_matrix_arrays),
+    "em_matrix": (setup_matrix_arrays, run_em_matrix),
+    "compute_best_hit_matrix": (setup_reassigned, run_compute_best_hit_matrix),
+    "rewrite_align_matrix": (setup_reassigned, run_rewrite_align_matrix),
+    "run_fused": (setup_vtb, run_fused)
+}
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak RSS of the current process to its current RSS. Only supported on Linux.
+
+    :return: ``True`` if the peak RSS was reset
+
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss() -> int:
+    """
+    Get the peak RSS of the current process in bytes.
+
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS and kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_stage(name: str, vta_path: str, ref_lengths: dict) -> dict:
+    """
+    Set up and run the stage called ``name``, returning its wall time and peak RSS. Called in a fresh process.
+
+    """
+    setup, run = STAGES[name]
+
+    with tempfile.TemporaryDirectory() as work_path:
+        inputs = setup(vta_path, ref_lengths, work_path)
+
+        reset = reset_peak_rss()
+
+        start = time.perf_counter()
+        run(vta_path, ref_lengths, work_path, **inputs)
+        wall = time.perf_counter() - start
+
+        return {
+            "wall": wall,
+            "peak_rss": get_peak_rss(),
+            "setup_included": not reset
+        }
+
+
+def benchmark_stage(name: str, vta_path: str, ref_lengths: dict, repeat: int) -> dict:
+    """
+    Run the stage called ``name`` ``repeat`` times, each in a new process, and keep the fastest wall time and the lowest
+    peak RSS.
+
+    """
+    results = list()
+
+    for _ in range(repeat):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            results.append(executor.submit(measure_stage, name, vta_path, ref_lengths).result())
+
+    return {
+        "wall": min(r["wall"] for r in results),
+        "peak_rss": min(r["peak_rss"] for r in results),
+        "setup_included": results[0]["setup_included"]
+    }
+
+
+def get_vta(data_path: str, size: int, params: dict) -> (str, dict):
+    """
+    Get the path and reference lengths for a synthetic VTA file, generating it in ``data_path`` if it does not exist.
+
+    """
+    name = "synthetic_{size}_{ref_count}_{multimapping_rate}_{seed}".format(size=size, **params)
+
+    vta_path = os.path.join(data_path, name + ".vta")
+    ref_lengths_path = os.path.join(data_path, name + ".json")
+
+    if os.path.isfile(vta_path) and os.path.isfile(ref_lengths_path):
+        with open(ref_lengths_path, "r") as f:
+            return vta_path, json.load(f)
+
+    ref_lengths = benchmarks.synthetic.generate_vta(vta_path, size, **params)
+
+    with open(ref_lengths_path, "w") as f:
+        json.dump(ref_lengths, f)
+
+    return vta_path, ref_lengths
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare ``results`` with ``baseline`` and return a list of regressions. Stages missing from the baseline are
+    ignored.
+
+    :param results: a dict of results keyed by ``<size>/<stage>``
+    :param baseline: a dict of baseline results keyed the same way
+    :param tolerance: the allowed fractional increase in relative wall time or peak RSS
+    :return: a list of ``(key, metric, ratio)`` tuples
+
+    """
+    regressions = list()
+
+    for key, result in results.items():
+        try:
+            expected = baseline[key]
+        except KeyError:
+            continue
+
+        for metric in ["relative_wall", "peak_rss"]:
+            ratio = result[metric] / expected[metric]
+
+            if ratio > 1 + tolerance:
+                regressions.append((key, metric, ratio))
+
+    return regressions
+
+
+def format_row(key: str, result: dict, expected: dict = None) -> str:
+    row = "{:<36} {:>10.3f} s {:>10.1f} MB".format(key, result["wall"], result["peak_rss"] / 1024 ** 2)
+
+    if expected:
+        row += " {:>8.2f}x {:>8.2f}x".format(
+            result["relative_wall"] / expected["relative_wall"],
+            result["peak_rss"] / expected["peak_rss"]
+        )
+
+    return row
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="alignment counts to test")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="stages to run")
+    parser.add_argument("--refs", type=int, default=100, dest="ref_count", help="the number of references")
+    parser.add_argument("--multimapping", type=float, default=0.3, dest="multimapping_rate",
+                        help="the fraction of reads that map to more than one reference")
+    parser.add_argument("--seed", type=int, default=1, help="the seed for synthetic data")
+    parser.add_argument("--repeat", type=int, default=1, help="the number of times to run each stage")
+    parser.add_argument("--data-path", default=os.path.join(tempfile.gettempdir(), "virtool_benchmarks"),
+                        help="where to keep generated VTA files between runs")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="merge the results into the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="the allowed fractional increase over the baseline")
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    params = {
+        "ref_count": args.ref_count,
+        "multimapping_rate": args.multimapping_rate,
+        "seed": args.seed
+    }
+
+    os.makedirs(args.data_path, exist_ok=True)
+
+    try:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {"params": params, "results": dict()}
+
+    if baseline["params"] != params:
+        print("Synthetic data parameters differ from the baseline. Skipping comparison.")
+        expected_results = dict()
+    elif "calibration" not in baseline:
+        print("The baseline has no calibration time. Skipping comparison.")
+        expected_results = dict()
+    else:
+        expected_results = baseline["results"]
+
+    calibration = benchmarks.calibration.calibrate()
+
+    print(f"Calibration: {calibration:.3f} s")
+
+    print("{:<36} {:>12} {:>13} {:>9} {:>9}".format("stage", "wall", "peak rss", "wall", "rss"))
+
+    results = dict()
+
+    for size in args.sizes:
+        vta_path, ref_lengths = get_vta(args.data_path, size, params)
+
+        for name in args.stages:
+            key = f"{size}/{name}"
+
+            result = benchmark_stage(name, vta_path, ref_lengths, args.repeat)
+
+            results[key] = {
+                **result,
+                "relative_wall": result["wall"] / calibration
+            }
+
+            print(format_row(key, results[key], expected_results.get(key)), flush=True)
+
+    if any(r["setup_included"] for r in results.values()):
+        print("Peak RSS could not be reset between setup and measurement. Values include setup.")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"params": params, "calibration": calibration, "results": {**expected_results, **results}},
+                f,
+                indent=4,
+                sort_keys=True
+            )
+
+        return 0
+
+    regressions = compare(results, expected_results, args.tolerance)
+
+    for key, metric, ratio in regressions:
+        print(f"Regression: {key} {metric} is {ratio:.2f}x the baseline")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
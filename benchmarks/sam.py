@@ -0,0 +1,205 @@
+"""
+Benchmark SAM parsing throughput for the mapping stages on a synthetic SAM file.
+
+The file is split into chunks of complete lines the same way :func:`virtool.jobs.job.watch_pipes` splits subprocess
+output. Each parser handles every chunk and its throughput is reported in lines per second.
+
+Run from the repository root:
+
+.. code-block:: shell
+
+    python -m benchmarks.sam --records 1000000
+
+Throughput is multiplied by the time of the calibration workload in :mod:`benchmarks.calibration`, run on the same
+machine, so results can be compared with a baseline saved on another machine.
+
+Results are compared against ``benchmarks/baselines/sam.json``. The command exits with status ``1`` if the relative
+throughput of any parser is lower than the baseline by more than ``--tolerance``.
+
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import benchmarks.calibration
+import benchmarks.synthetic
+import virtool.jobs.sam
+import virtool.pathoscope
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "sam.json")
+
+#: The fields extracted by each mapping stage.
+STAGE_FIELDS = {
+    "map_default_isolates": ("rname",),
+    "map_isolates": ("qname", "rname", "pos", "length", "score"),
+    "map_subtraction": ("qname", "score")
+}
+
+
+def parse_lines(chunk: bytes):
+    """
+    Parse a chunk one line at a time the way the mapping stage handlers did before :mod:`virtool.jobs.sam`.
+
+    """
+    for line in chunk.split(b"\n"):
+        if not line:
+            continue
+
+        line = line.decode()
+
+        if line[0] == "@":
+            continue
+
+        fields = line.split("\t")
+
+        if int(fields[1]) & 0x4 == 4 or fields[2] == "*":
+            continue
+
+        virtool.pathoscope.find_sam_align_score(fields)
+
+
+def get_parsers() -> dict:
+    parsers = {
+        "lines": parse_lines
+    }
+
+    for stage, fields in STAGE_FIELDS.items():
+        parsers[f"parse_batch/{stage}"] = lambda chunk, fields=fields: virtool.jobs.sam.parse_batch(chunk, fields)
+
+    return parsers
+
+
+def read_chunks(path: str, size: int = 65536) -> list:
+    """
+    Read the file at ``path`` into chunks of complete lines of about ``size`` bytes.
+
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    chunks = list()
+    start = 0
+
+    while start < len(data):
+        end = data.rfind(b"\n", start, start + size) + 1 or len(data)
+        chunks.append(data[start:end])
+        start = end
+
+    return chunks
+
+
+def measure(parser, chunks: list, line_count: int, repeat: int) -> float:
+    """
+    Return the best throughput of ``parser`` over ``chunks`` in lines per second.
+
+    """
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+
+        for chunk in chunks:
+            parser(chunk)
+
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return line_count / best
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+
+    parser.add_argument("--records", type=int, default=1000000, help="the number of SAM records to generate")
+    parser.add_argument("--seed", type=int, default=1, help="the seed for synthetic data")
+    parser.add_argument("--repeat", type=int, default=3, help="the number of times to run each parser")
+    parser.add_argument("--data-path", default=os.path.join(tempfile.gettempdir(), "virtool_benchmarks"),
+                        help="where to keep generated SAM files between runs")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="merge the results into the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="the allowed fractional decrease from the baseline")
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    os.makedirs(args.data_path, exist_ok=True)
+
+    sam_path = os.path.join(args.data_path, f"synthetic_{args.records}_{args.seed}.sam")
+
+    if not os.path.isfile(sam_path):
+        benchmarks.synthetic.generate_sam(sam_path, args.records, seed=args.seed)
+
+    chunks = read_chunks(sam_path)
+    line_count = sum(chunk.count(b"\n") for chunk in chunks)
+
+    try:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {"results": dict()}
+
+    if "calibration" not in baseline:
+        print("The baseline has no calibration time. Skipping comparison.")
+        baseline = {"results": dict()}
+
+    calibration = benchmarks.calibration.calibrate()
+
+    print(f"Calibration: {calibration:.3f} s")
+
+    print("{:<44} {:>14} {:>9}".format("parser", "lines/s", "baseline"))
+
+    results = dict()
+    regressions = list()
+
+    for name, parser in get_parsers().items():
+        key = f"{args.records}/{name}"
+
+        throughput = measure(parser, chunks, line_count, args.repeat)
+
+        results[key] = {
+            "throughput": throughput,
+            "relative_throughput": throughput * calibration
+        }
+
+        row = "{:<44} {:>14.0f}".format(key, throughput)
+
+        expected = baseline["results"].get(key)
+
+        if expected:
+            ratio = results[key]["relative_throughput"] / expected["relative_throughput"]
+            row += " {:>8.2f}x".format(ratio)
+
+            if ratio < 1 - args.tolerance:
+                regressions.append((key, ratio))
+
+        print(row, flush=True)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"calibration": calibration, "results": {**baseline["results"], **results}},
+                f,
+                indent=4,
+                sort_keys=True
+            )
+
+        return 0
+
+    for key, ratio in regressions:
+        print(f"Regression: {key} relative throughput is {ratio:.2f}x the baseline")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Seeded generation of synthetic Pathoscope alignment (VTA) files.
+
+References are split into groups of :data:`GROUP_SIZE` that stand in for the isolates of a single OTU. Each read is
+drawn from a reference with a log-normal abundance and aligned to it with a Bowtie2 local-mode score. A
+``multimapping_rate`` fraction of reads also align, with slightly lower scores, to other references in the same group.
+
+"""
+from typing import Iterator
+
+import numpy as np
+
+#: The number of references in each group of related isolates.
+GROUP_SIZE = 4
+
+#: The number of reads generated at a time.
+CHUNK_SIZE = 100000
+
+#: The Bowtie2 local-mode mismatch penalty.
+MISMATCH_PENALTY = 6
+
+
+def generate_ref_lengths(ref_count: int, rng: np.random.Generator) -> dict:
+    return {f"SYN_{ref_index:06d}": int(length) for ref_index, length in enumerate(
+        rng.integers(1000, 12000, ref_count)
+    )}
+
+
+def generate_alignments(alignment_count: int, ref_count: int, multimapping_rate: float, read_length: int,
+                        seed: int) -> (dict, Iterator[dict]):
+    """
+    Generate ``alignment_count`` synthetic alignments.
+
+    :param alignment_count: the number of alignments to generate
+    :param ref_count: the number of references
+    :param multimapping_rate: the fraction of reads that align to more than one reference
+    :param read_length: the length of each read
+    :param seed: the random seed
+    :return: a dict of reference IDs and lengths and an iterator of chunks of alignment columns
+
+    """
+    rng = np.random.default_rng(seed)
+
+    ref_lengths = generate_ref_lengths(ref_count, rng)
+
+    return ref_lengths, iter_alignments(rng, ref_lengths, alignment_count, multimapping_rate, read_length)
+
+
+def iter_alignments(rng: np.random.Generator, ref_lengths: dict, alignment_count: int, multimapping_rate: float,
+                    read_length: int) -> Iterator[dict]:
+    ref_count = len(ref_lengths)
+    lengths = np.array(list(ref_lengths.values()))
+
+    abundance = rng.lognormal(0, 1.5, ref_count)
+    abundance /= abundance.sum()
+
+    group_starts = np.arange(ref_count) // GROUP_SIZE * GROUP_SIZE
+    group_sizes = np.minimum(GROUP_SIZE, ref_count - group_starts)
+
+    written = 0
+    read_offset = 0
+
+    while written < alignment_count:
+        refs = rng.choice(ref_count, CHUNK_SIZE, p=abundance)
+
+        # Alignments for each read are contiguous, as they are in Bowtie2 output.
+        extra = np.where(
+            rng.random(CHUNK_SIZE) < multimapping_rate,
+            rng.integers(1, GROUP_SIZE, CHUNK_SIZE),
+            0
+        )
+
+        extra = np.minimum(extra, group_sizes[refs] - 1)
+
+        per_read = extra + 1
+
+        reads = np.repeat(np.arange(read_offset, read_offset + CHUNK_SIZE), per_read)
+        rank = np.arange(len(reads)) - np.repeat(np.cumsum(per_read) - per_read, per_read)
+
+        true_refs = np.repeat(refs, per_read)
+        starts = group_starts[true_refs]
+        sizes = group_sizes[true_refs]
+
+        # Secondary alignments rotate through the other isolates in the group so no read aligns to a reference
+        # twice.
+        line_refs = starts + (true_refs - starts + rank) % sizes
+
+        true_pos = np.repeat(rng.integers(1, lengths[refs] - read_length + 2), per_read)
+        positions = np.minimum(true_pos, lengths[line_refs] - read_length + 1)
+
+        mismatches = rng.poisson(1, len(reads)) + np.where(rank > 0, rng.poisson(2, len(reads)) + 1, 0)
+
+        scores = np.maximum(3 * read_length - MISMATCH_PENALTY * mismatches, read_length)
+
+        remaining = alignment_count - written
+
+        yield {
+            "read": reads[:remaining],
+            "ref": line_refs[:remaining],
+            "pos": positions[:remaining],
+            "score": scores[:remaining],
+            "mismatches": mismatches[:remaining],
+            "secondary": rank[:remaining] > 0
+        }
+
+        written += min(len(reads), remaining)
+        read_offset += CHUNK_SIZE
+
+
+def generate_vta(path: str, alignment_count: int, ref_count: int = 100, multimapping_rate: float = 0.3,
+                 read_length: int = 101, seed: int = 1) -> dict:
+    """
+    Write a VTA file with ``alignment_count`` alignments to ``path``. The same arguments always produce the same file.
+
+    :param path: the path to write the VTA file to
+    :param alignment_count: the number of alignments to generate
+    :param ref_count: the number of references
+    :param multimapping_rate: the fraction of reads that align to more than one reference
+    :param read_length: the length of each read
+    :param seed: the random seed
+    :return: a dict of reference IDs and lengths for the generated references
+
+    """
+    ref_lengths, chunks = generate_alignments(alignment_count, ref_count, multimapping_rate, read_length, seed)
+
+    ref_ids = list(ref_lengths)
+
+    with open(path, "w") as handle:
+        for chunk in chunks:
+            handle.write("".join(
+                f"SYN:1:{read_index},{ref_ids[ref_index]},{pos},{read_length},{score}.0\n"
+                for read_index, ref_index, pos, score in zip(
+                    chunk["read"].tolist(),
+                    chunk["ref"].tolist(),
+                    chunk["pos"].tolist(),
+                    chunk["score"].tolist()
+                )
+            ))
+
+    return ref_lengths
+
+
+def generate_sam(path: str, record_count: int, ref_count: int = 100, multimapping_rate: float = 0.3,
+                 unmapped_rate: float = 0.1, read_length: int = 101, seed: int = 1) -> dict:
+    """
+    Write Bowtie2-style SAM records to ``path``. The same arguments always produce the same file.
+
+    Mapped records are generated as in :func:`generate_vta`. Secondary alignments are flagged ``256``. An
+    ``unmapped_rate`` fraction of records are unmapped.
+
+    :param path: the path to write the SAM file to
+    :param record_count: the number of records to generate
+    :param ref_count: the number of references
+    :param multimapping_rate: the fraction of mapped reads that align to more than one reference
+    :param unmapped_rate: the fraction of records that are unmapped
+    :param read_length: the length of each read
+    :param seed: the random seed
+    :return: a dict of reference IDs and lengths for the generated references
+
+    """
+    ref_lengths, chunks = generate_alignments(record_count, ref_count, multimapping_rate, read_length, seed)
+
+    ref_ids = list(ref_lengths)
+
+    rng = np.random.default_rng(seed + 1)
+
+    sequence = "".join(rng.choice(list("ACGT"), read_length))
+    quality = "I" * read_length
+
+    with open(path, "w") as handle:
+        handle.write("@HD\tVN:1.0\tSO:unsorted\n")
+
+        for ref_id, length in ref_lengths.items():
+            handle.write(f"@SQ\tSN:{ref_id}\tLN:{length}\n")
+
+        for chunk in chunks:
+            unmapped = rng.random(len(chunk["read"])) < unmapped_rate
+
+            handle.write("".join(
+                f"SYN:1:{read_index}\t4\t*\t0\t0\t*\t*\t0\t0\t{sequence}\t{quality}\tYT:Z:UU\n" if is_unmapped else
+                f"SYN:1:{read_index}\t{256 if secondary else 0}\t{ref_ids[ref_index]}\t{pos}\t255\t{read_length}M\t*\t"
+                f"0\t0\t{sequence}\t{quality}\tAS:i:{score - read_length}\tXN:i:0\tXM:i:{mismatches}\tXO:i:0\t"
+                f"XG:i:0\tNM:i:{mismatches}\tMD:Z:{read_length}\tYT:Z:UU\n"
+                for read_index, ref_index, pos, score, mismatches, secondary, is_unmapped in zip(
+                    chunk["read"].tolist(),
+                    chunk["ref"].tolist(),
+                    chunk["pos"].tolist(),
+                    chunk["score"].tolist(),
+                    chunk["mismatches"].tolist(),
+                    chunk["secondary"].tolist(),
+                    unmapped.tolist()
+                )
+            ))
+
+    return ref_lengths
@@ -137,7 +137,7 @@ const pathoscopeBowtieDescriptions = {
     },
     pathoscope: {
         title: "Pathoscope",
-        description: "Reassign ambiguous mappings using Pathoscope 2.0."
+        description: "Subtract host reads and reassign ambiguous mappings using Pathoscope 2.0."
     },
     import_results: importResultsDescription,
     cleanup_indexes: {
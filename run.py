@@ -5,6 +5,8 @@ import sys
 import uvloop
 
 import virtool.app
+import virtool.config
+import virtool.jobs.runner
 import virtool.logs
 
 logger = logging.getLogger("aiohttp.server")
@@ -12,8 +14,14 @@ logger = logging.getLogger("aiohttp.server")
 sys.dont_write_bytecode = True
 
 if __name__ == "__main__":
-    # Set up event loop using uvloop.
-    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
-    loop = asyncio.get_event_loop()
+    config = virtool.config.resolve()
 
-    loop.run_until_complete(virtool.app.run())
+    if config["command"] == "runner":
+        virtool.logs.configure(config["dev"])
+        virtool.jobs.runner.run(config)
+    else:
+        # Set up event loop using uvloop.
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        loop = asyncio.get_event_loop()
+
+        loop.run_until_complete(virtool.app.run(config))
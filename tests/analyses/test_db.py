@@ -1,8 +1,13 @@
+import asyncio
+import os
+
 import pytest
 from aiohttp.test_utils import make_mocked_coro
 
 import virtool.analyses.db
 import virtool.analyses.format
+import virtool.analyses.utils
+import virtool.utils
 
 
 @pytest.fixture
@@ -171,3 +176,206 @@ async def test_remove_nuvs_blast(snapshot, dbi, static_time):
     )
 
     snapshot.assert_match(await dbi.analyses.find().to_list(None))
+
+
+async def create_claim_index(db):
+    await db.analyses.create_index(
+        "fingerprint",
+        name="fingerprint_claim",
+        unique=True,
+        partialFilterExpression={"ready": False, "attached": False}
+    )
+
+
+@pytest.fixture
+def new_app(dbi, mocker, tmpdir):
+    mocker.patch("virtool.indexes.db.get_current_id_and_version", make_mocked_coro(("baz", 3)))
+    mocker.patch("virtool.samples.db.recalculate_workflow_tags", make_mocked_coro())
+
+    async def run_in_thread(func, *args):
+        return func(*args)
+
+    return {
+        "db": dbi,
+        "jobs": mocker.Mock(enqueue=make_mocked_coro()),
+        "run_in_thread": run_in_thread,
+        "settings": {
+            "data_path": str(tmpdir),
+            "lg_proc": 4,
+            "lg_mem": 8,
+            "pathoscope_accelerate_em": False
+        }
+    }
+
+
+async def test_new_concurrent(new_app, dbi):
+    """
+    Test that only one job is started for identical analyses requested at the same time and that the others are
+    attached to it.
+
+    """
+    await create_claim_index(dbi)
+
+    await dbi.samples.insert_one({"_id": "foo", "name": "Foo"})
+    await dbi.references.insert_one({"_id": "bar", "name": "Bar"})
+
+    documents = await asyncio.gather(*[
+        virtool.analyses.db.new(new_app, "foo", "bar", "Arabidopsis thaliana", user_id, "pathoscope_bowtie")
+        for user_id in ["bob", "fred", "jane"]
+    ])
+
+    job_ids = await dbi.jobs.distinct("_id")
+
+    assert len(job_ids) == 1
+    assert new_app["jobs"].enqueue.call_count == 1
+
+    assert [d["job"]["id"] for d in documents] == job_ids * 3
+    assert sorted(d["attached"] for d in documents) == [False, True, True]
+
+    job = await dbi.jobs.find_one(job_ids[0])
+
+    owner = await dbi.analyses.find_one({"attached": False})
+
+    assert job["args"]["analysis_id"] == owner["_id"]
+
+
+@pytest.mark.parametrize("accelerate", [False, True])
+async def test_new_finished(accelerate, new_app, dbi, tmpdir):
+    """
+    Test that the results of a finished identical analysis are copied instead of starting a job and that an analysis
+    finished with different result settings is not reused.
+
+    """
+    await dbi.samples.insert_one({"_id": "foo", "name": "Foo"})
+    await dbi.references.insert_one({"_id": "bar", "name": "Bar"})
+
+    fingerprint = virtool.analyses.utils.get_fingerprint(
+        "foo",
+        "baz",
+        "Arabidopsis thaliana",
+        "pathoscope_bowtie",
+        {"pathoscope_accelerate_em": accelerate}
+    )
+
+    await dbi.analyses.insert_one({
+        "_id": "finished",
+        "created_at": virtool.utils.timestamp(),
+        "fingerprint": fingerprint,
+        "attached": False,
+        "job": {"id": "job"},
+        "ready": True,
+        "results": [1, 2]
+    })
+
+    document = await virtool.analyses.db.new(
+        new_app,
+        "foo",
+        "bar",
+        "Arabidopsis thaliana",
+        "bob",
+        "pathoscope_bowtie"
+    )
+
+    if accelerate:
+        assert document["ready"] is False
+        assert document["job"]["id"] != "job"
+        new_app["jobs"].enqueue.assert_called_once_with(document["job"]["id"])
+        return
+
+    assert document["ready"] is True
+
+    # The copy was not produced by a job of its own.
+    assert document["job"] == {"id": None}
+
+    new_app["jobs"].enqueue.assert_not_called()
+
+    copy = await dbi.analyses.find_one(document["_id"])
+
+    assert copy["results"] == [1, 2]
+    assert copy["attached"] is True
+    assert copy["user"] == {"id": "bob"}
+
+    assert os.path.isdir(os.path.join(str(tmpdir), "samples", "foo", "analysis", copy["_id"]))
+
+
+@pytest.mark.parametrize("installed", [None, {"id": 123, "name": "v1.0.0"}])
+async def test_get_result_parameters(installed, dbi):
+    """
+    Test that result settings are included for Pathoscope and that the installed HMM release is included for NuVs.
+
+    """
+    await dbi.status.insert_one({"_id": "hmm", "installed": installed})
+
+    settings = {
+        "pathoscope_accelerate_em": True,
+        "hmm_slug": "virtool/virtool-hmm"
+    }
+
+    assert await virtool.analyses.db.get_result_parameters(dbi, settings, "pathoscope_bowtie") == {
+        "pathoscope_accelerate_em": True
+    }
+
+    assert await virtool.analyses.db.get_result_parameters(dbi, settings, "nuvs") == {
+        "hmm": installed["id"] if installed else None
+    }
+
+    assert await virtool.analyses.db.get_result_parameters(dbi, settings, "aodp") == {}
+
+
+@pytest.mark.parametrize("owner_state", ["waiting", "ready", "gone", "handed_off"])
+async def test_attach(owner_state, mocker, new_app, dbi):
+    """
+    Test that an analysis stays attached to a running owner, gets the results of an owner that finished, and is
+    removed again if the owner is gone. It is kept if the failed job of the owner handed it to another job.
+
+    """
+    owner = {
+        "_id": "owner",
+        "attached": False,
+        "job": {"id": "job"},
+        "ready": owner_state == "ready",
+        "results": [1, 2],
+        "sample": {"id": "foo"}
+    }
+
+    if owner_state in ("waiting", "ready"):
+        await dbi.analyses.insert_one(owner)
+
+    if owner_state == "handed_off":
+        insert_one = dbi.analyses.insert_one
+
+        async def hand_off(document):
+            inserted = await insert_one(document)
+            await dbi.analyses.update_one({"_id": document["_id"]}, {"$set": {"job.id": "other"}})
+            return inserted
+
+        mocker.patch.object(dbi.analyses, "insert_one", hand_off)
+
+    document = {
+        "_id": "new",
+        "attached": False,
+        "job": {"id": None},
+        "ready": False,
+        "sample": {"id": "foo"},
+        "user": {"id": "bob"}
+    }
+
+    attached = await virtool.analyses.db.attach(new_app, document, owner)
+
+    if owner_state == "gone":
+        assert attached is None
+        assert await dbi.analyses.find_one("new") is None
+        return
+
+    if owner_state == "handed_off":
+        assert attached["job"] == {"id": "other"}
+        assert await dbi.analyses.find_one("new") == attached
+        return
+
+    assert attached["job"] == {"id": "job"}
+
+    inserted = await dbi.analyses.find_one("new")
+
+    assert inserted["attached"] is True
+    assert inserted["ready"] is (owner_state == "ready")
+    assert inserted.get("results") == ([1, 2] if owner_state == "ready" else None)
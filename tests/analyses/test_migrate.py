@@ -168,7 +168,7 @@ async def test_migrate_analyses(mocker, dbi):
     m_rename_results_field.assert_called_with(dbi)
     m_convert_pathoscope_files.assert_called_with(dbi, settings)
     m_rename_analysis_json_files.assert_called_with(settings)
-    m_delete_unready.assert_called_with(dbi.analyses)
+    m_delete_unready.assert_called_with(dbi.analyses, [])
 
 
 async def test_convert_pathoscope_file(tmpdir, dbi):
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 import virtool.analyses.utils
@@ -30,3 +32,83 @@ def test_get_json_path(name):
     """
     path = virtool.analyses.utils.join_analysis_json_path("/data", "bar", "foo")
     assert path == "/data/samples/foo/analysis/bar/results.json"
+
+
+def test_get_fingerprint():
+    """
+    Test that analyses with the same parameters get the same fingerprint and that any difference changes it.
+
+    """
+    parameters = {"a": 1, "b": 2}
+
+    fingerprint = virtool.analyses.utils.get_fingerprint("foo", "bar", "baz", "nuvs", parameters)
+
+    assert fingerprint == virtool.analyses.utils.get_fingerprint("foo", "bar", "baz", "nuvs", {"b": 2, "a": 1})
+
+    assert fingerprint != virtool.analyses.utils.get_fingerprint("foo", "bar", "baz", "pathoscope_bowtie", parameters)
+    assert fingerprint != virtool.analyses.utils.get_fingerprint("foo", "bar", "qux", "nuvs", parameters)
+    assert fingerprint != virtool.analyses.utils.get_fingerprint("foob", "ar", "baz", "nuvs", parameters)
+    assert fingerprint != virtool.analyses.utils.get_fingerprint("foo", "bar", "baz", "nuvs", {"a": 1, "b": 3})
+
+
+def test_get_result_fields():
+    document = {
+        "_id": "foo",
+        "attached": False,
+        "created_at": "2020-01-01",
+        "updated_at": "2020-01-02",
+        "user": {"id": "bob"},
+        "job": {"id": "bar"},
+        "ready": True,
+        "results": [1, 2, 3]
+    }
+
+    assert virtool.analyses.utils.get_result_fields(document) == {
+        "ready": True,
+        "results": [1, 2, 3]
+    }
+
+
+@pytest.mark.parametrize("exists", [True, False])
+def test_copy_analysis_files(exists, tmpdir):
+    """
+    Test that only result files are linked and that the directory is created even if there are no result files.
+
+    """
+    src = tmpdir.mkdir("src")
+
+    src.join("to_isolates.vtb").write("alignments")
+    src.mkdir("_reads").join("reads_1.fq.gz").write("reads")
+
+    if exists:
+        src.join("results.json").write("{}")
+
+    dest = os.path.join(str(tmpdir), "dest")
+
+    virtool.analyses.utils.copy_analysis_files(str(src), dest)
+
+    if exists:
+        assert os.listdir(dest) == ["results.json"]
+        assert os.path.samefile(os.path.join(dest, "results.json"), str(src.join("results.json")))
+    else:
+        assert os.listdir(dest) == []
+
+
+def test_copy_analysis_files_fallback(tmpdir, mocker):
+    """
+    Test that result files are copied if they can't be hard-linked.
+
+    """
+    mocker.patch("os.link", side_effect=OSError("Invalid cross-device link"))
+
+    src = tmpdir.mkdir("src")
+    src.join("results.json").write("{}")
+
+    dest = os.path.join(str(tmpdir), "dest")
+
+    virtool.analyses.utils.copy_analysis_files(str(src), dest)
+
+    with open(os.path.join(dest, "results.json")) as f:
+        assert f.read() == "{}"
+
+    assert not os.path.samefile(os.path.join(dest, "results.json"), str(src.join("results.json")))
@@ -0,0 +1,76 @@
+import filecmp
+import os
+
+import pytest
+
+import benchmarks.synthetic
+import virtool.jobs.sam
+import virtool.pathoscope
+
+
+def test_generate_vta(tmpdir):
+    """
+    Test that the generated file has the requested number of alignments, is the same for the same seed and can be
+    read by :func:`virtool.pathoscope.build_matrix`.
+
+    """
+    paths = [os.path.join(str(tmpdir), f"{name}.vta") for name in ["a", "b", "c"]]
+
+    ref_lengths = benchmarks.synthetic.generate_vta(paths[0], 5000, ref_count=20, multimapping_rate=0.5, seed=3)
+
+    assert benchmarks.synthetic.generate_vta(paths[1], 5000, ref_count=20, multimapping_rate=0.5, seed=3) == ref_lengths
+    benchmarks.synthetic.generate_vta(paths[2], 5000, ref_count=20, multimapping_rate=0.5, seed=4)
+
+    assert filecmp.cmp(paths[0], paths[1], shallow=False)
+    assert not filecmp.cmp(paths[0], paths[2], shallow=False)
+
+    with open(paths[0], "r") as f:
+        lines = [line.rstrip().split(",") for line in f]
+
+    assert len(lines) == 5000
+    assert len(ref_lengths) == 20
+
+    for _, ref_id, pos, length, _ in lines:
+        assert 1 <= int(pos) <= ref_lengths[ref_id] - int(length) + 1
+
+    u, nu, refs, reads = virtool.pathoscope.build_matrix(paths[0], 0.01)
+
+    assert len(nu) / len(reads) == pytest.approx(0.5, abs=0.05)
+
+
+def test_no_multimapping(tmpdir):
+    path = os.path.join(str(tmpdir), "test.vta")
+
+    benchmarks.synthetic.generate_vta(path, 1000, multimapping_rate=0)
+
+    u, nu, refs, reads = virtool.pathoscope.build_matrix(path, 0.01)
+
+    assert len(u) == len(reads) == 1000
+    assert not nu
+
+
+def test_generate_sam(tmpdir):
+    """
+    Test that the mapped records in a generated SAM file match the alignments generated for a VTA file with the same
+    arguments.
+
+    """
+    sam_path = os.path.join(str(tmpdir), "test.sam")
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    ref_lengths = benchmarks.synthetic.generate_sam(sam_path, 2000, ref_count=20, unmapped_rate=0.2, seed=5)
+
+    assert benchmarks.synthetic.generate_vta(vta_path, 2000, ref_count=20, seed=5) == ref_lengths
+
+    with open(sam_path, "rb") as f:
+        batch = virtool.jobs.sam.parse_batch(f.read(), ("qname", "rname", "pos", "length", "score"))
+
+    with open(vta_path, "r") as f:
+        alignments = [line.rstrip().split(",") for line in f]
+
+    mapped = [
+        (read_id, ref_id, int(pos), int(length), float(score)) for read_id, ref_id, pos, length, score in alignments
+    ]
+
+    assert 0.7 < len(batch["qname"]) / len(mapped) < 0.9
+    assert set(zip(*batch.values())) < set(mapped)
@@ -27,6 +27,22 @@ async def test_delete_unready(dbi):
     ]
 
 
+async def test_delete_unready_keep(dbi):
+    """
+    Test that unready documents created by jobs that will be recovered are not deleted.
+
+    """
+    await dbi.analyses.insert_many([
+        {"_id": 1, "ready": False, "job": {"id": "foo"}},
+        {"_id": 2, "ready": False, "job": {"id": "bar"}},
+        {"_id": 3, "ready": True, "job": {"id": "baz"}}
+    ])
+
+    await virtool.db.migrate.delete_unready(dbi.analyses, ["foo"])
+
+    assert [d["_id"] async for d in dbi.analyses.find({}, sort=[("_id", 1)])] == [1, 3]
+
+
 async def test_migrate_files(dbi):
     documents = [
         {"_id": 1},
@@ -61,3 +61,55 @@ async def test_get(error, spawn_client, test_job, resp_is):
             }
         ]
     }
+
+
+async def test_get_dispatch_metrics(mocker, spawn_client):
+    client = await spawn_client(authorize=True, administrator=True)
+
+    client.app["jobs"] = mocker.Mock()
+    client.app["jobs"].channel.metrics = {
+        "depth": 3,
+        "max_depth": 12,
+        "messages": 40,
+        "ids": 25,
+        "latency": 0.2,
+        "max_latency": 0.5
+    }
+
+    resp = await client.get("/api/jobs/dispatch")
+
+    assert resp.status == 200
+
+    assert await resp.json() == client.app["jobs"].channel.metrics
+
+
+@pytest.mark.parametrize("error", [None, "404", "422"])
+async def test_get_log(error, tmpdir, spawn_client, test_job, resp_is):
+    client = await spawn_client(authorize=True)
+
+    client.app["settings"]["data_path"] = str(tmpdir)
+
+    if error != "404":
+        await client.db.jobs.insert_one(test_job)
+
+    tmpdir.mkdir("logs").mkdir("jobs").join("4c530449.log").write("foo\nbar\nba")
+
+    resp = await client.get("/api/jobs/4c530449/log?offset={}".format(-1 if error == "422" else 4))
+
+    if error == "404":
+        assert await resp_is.not_found(resp)
+        return
+
+    if error == "422":
+        assert await resp_is.invalid_query(resp, {
+            "offset": ["min value is 0"]
+        })
+        return
+
+    assert resp.status == 200
+
+    assert await resp.json() == {
+        "id": "4c530449",
+        "log": "bar\n",
+        "offset": 8
+    }
@@ -0,0 +1,79 @@
+import queue
+
+import virtool.jobs.channel
+
+
+def test_send(mocker):
+    mocker.patch("time.time", return_value=1000.0)
+
+    q = queue.Queue()
+
+    virtool.jobs.channel.send(q, "jobs", "update", ["foo"])
+
+    assert q.get_nowait() == ("jobs", "update", ["foo"], 1000.0)
+
+
+def test_coalesce():
+    messages = [
+        ("jobs", "update", ["foo"], 1.0),
+        ("analyses", "update", ["bar", "baz"], 1.0),
+        ("jobs", "update", ["foo", "bar"], 2.0),
+        ("analyses", "delete", ["baz"], 3.0),
+        ("jobs", "update", ["foo"])
+    ]
+
+    assert virtool.jobs.channel.coalesce(messages) == {
+        ("jobs", "update"): ["foo", "bar"],
+        ("analyses", "update"): ["bar", "baz"],
+        ("analyses", "delete"): ["baz"]
+    }
+
+
+def test_drain(mocker):
+    """
+    Test that all waiting messages are drained in a single call and that metrics describe the drained batch.
+
+    """
+    q = queue.Queue()
+
+    channel = virtool.jobs.channel.Channel(q)
+
+    for sent_at in [8.0, 9.0, 9.5]:
+        q.put(("jobs", "update", ["foo"], sent_at))
+
+    q.put(("samples", "update", ["bar", "baz"], 9.8))
+
+    mocker.patch("time.time", return_value=10.0)
+
+    assert channel.drain() == {
+        ("jobs", "update"): ["foo"],
+        ("samples", "update"): ["bar", "baz"]
+    }
+
+    assert q.empty()
+
+    assert channel.metrics == {
+        "depth": 4,
+        "max_depth": 4,
+        "messages": 4,
+        "ids": 3,
+        "latency": 2.0,
+        "max_latency": 2.0
+    }
+
+    q.put(("jobs", "update", ["foo"], 10.0))
+
+    channel.drain()
+
+    assert channel.metrics == {
+        "depth": 1,
+        "max_depth": 4,
+        "messages": 5,
+        "ids": 4,
+        "latency": 0,
+        "max_latency": 2.0
+    }
+
+    # An empty queue leaves the metrics unchanged.
+    assert channel.drain() == {}
+    assert channel.metrics["depth"] == 1
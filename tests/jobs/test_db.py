@@ -134,3 +134,47 @@ async def test_delete_zombies(dbi):
         documents[3],
         documents[1]
     ]
+
+
+async def test_recover(dbi, static_time):
+    """
+    Test that waiting and running jobs are returned and that running jobs are put back into the waiting state.
+
+    """
+    await dbi.jobs.insert_many([
+        {
+            "_id": "foo",
+            "status": [
+                {"state": "waiting", "stage": None, "error": None, "progress": 0},
+                {"state": "running", "stage": "assemble", "error": None, "progress": 0.4}
+            ]
+        },
+        {
+            "_id": "bar",
+            "status": [
+                {"state": "waiting", "stage": None, "error": None, "progress": 0}
+            ]
+        },
+        {
+            "_id": "baz",
+            "status": [
+                {"state": "waiting", "stage": None, "error": None, "progress": 0},
+                {"state": "complete", "stage": None, "error": None, "progress": 1}
+            ]
+        }
+    ])
+
+    assert await virtool.jobs.db.recover(dbi) == ["foo", "bar"]
+
+    foo = await dbi.jobs.find_one("foo")
+
+    assert foo["status"][-1] == {
+        "state": "waiting",
+        "stage": "assemble",
+        "error": None,
+        "progress": 0.4,
+        "timestamp": static_time.datetime
+    }
+
+    assert len((await dbi.jobs.find_one("bar"))["status"]) == 1
+    assert len((await dbi.jobs.find_one("baz"))["status"]) == 2
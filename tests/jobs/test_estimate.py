@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+from aiohttp.test_utils import make_mocked_coro
+
+import virtool.jobs.estimate
+
+GB = virtool.jobs.estimate.GB
+
+
+def create_history(count=5, proc=4, busy=4.0):
+    """
+    Create completed jobs whose peak memory is 1 GB plus 1 GB per billion bases.
+
+    """
+    history = list()
+
+    for index in range(1, count + 1):
+        reads = index * 10000000
+
+        history.append({
+            "proc": proc,
+            "features": {
+                "reads": reads,
+                "read_length": 100,
+                "ref_size": 0
+            },
+            "resources": [
+                {
+                    "wall": 100,
+                    "cpu": 10,
+                    "children_cpu": busy * 100 - 10,
+                    "peak_rss": GB // 2,
+                    "children_peak_rss": GB // 2 + reads * 100
+                }
+            ]
+        })
+
+    return history
+
+
+def test_fit_nonnegative():
+    """
+    Test that variables that would get negative coefficients are removed from the model.
+
+    """
+    x = np.array([[1, 1, 0], [1, 2, 1], [1, 3, 0], [1, 4, 1]], dtype=float)
+    y = np.array([3, 4.5, 7, 8.5], dtype=float)
+
+    coefficients = virtool.jobs.estimate.fit_nonnegative(x, y)
+
+    assert coefficients == pytest.approx([*np.linalg.lstsq(x[:, :2], y, rcond=None)[0], 0])
+    assert (coefficients >= 0).all()
+
+
+def test_get_peak_memory():
+    resources = create_history()[0]["resources"]
+
+    assert virtool.jobs.estimate.get_peak_memory(resources) == GB + 10000000 * 100
+
+    resources.append({**resources[0], "peak_rss": None, "children_peak_rss": None})
+
+    assert virtool.jobs.estimate.get_peak_memory(resources) is None
+
+
+@pytest.mark.parametrize("reads,expected", [(1000000, 2), (40000000, 6), (200000000, 16)])
+def test_predict_mem(reads, expected):
+    features = {
+        "reads": reads,
+        "read_length": 100,
+        "ref_size": 0
+    }
+
+    assert virtool.jobs.estimate.predict_mem(create_history(), features, 16) == expected
+
+
+@pytest.mark.parametrize("busy,expected", [(1.5, 2), (3.8, 4)])
+def test_predict_proc(busy, expected):
+    """
+    Test that jobs that kept most of their cores busy are predicted to need the static limit.
+
+    """
+    assert virtool.jobs.estimate.predict_proc(create_history(busy=busy), 4) == expected
+
+
+@pytest.mark.parametrize("threads,expected", [(None, 2), (1, 4), (2, 2)])
+def test_predict_proc_threads(threads, expected):
+    """
+    Test that busy cores are compared with the threads a stage was given and that predictions are never lower than
+    ``minimum``.
+
+    A job given two cores that runs a tool with one thread keeps about one core busy. It needed more cores only if the
+    tool was given one thread.
+
+    """
+    history = create_history(proc=2, busy=1.0)
+
+    if threads:
+        for document in history:
+            document["resources"][0]["threads"] = threads
+
+    assert virtool.jobs.estimate.predict_proc(history, 4, minimum=2) == expected
+
+
+def test_get_index_size(tmpdir):
+    index_dir = tmpdir.mkdir("references").mkdir("foo").mkdir("bar")
+
+    index_dir.join("reference.1.bt2").write("a" * 100)
+    index_dir.join("reference.fa.gz").write("a" * 50)
+
+    settings = {
+        "data_path": str(tmpdir)
+    }
+
+    assert virtool.jobs.estimate.get_index_size(settings, "foo", "bar") == 150
+    assert virtool.jobs.estimate.get_index_size(settings, "foo", "baz") == 0
+    assert virtool.jobs.estimate.get_index_size(settings, None, None) == 0
+
+
+@pytest.mark.parametrize("quality", [True, False])
+async def test_get_features(quality, loop, mocker):
+    m_get_index_size = mocker.patch("virtool.jobs.estimate.get_index_size", return_value=150)
+
+    sample = {"_id": "foo"}
+
+    if quality:
+        sample["quality"] = {"count": 1000, "length": [50, 100]}
+
+    db = mocker.Mock()
+    db.samples.find_one = make_mocked_coro(sample)
+
+    settings = {
+        "data_path": "/data"
+    }
+
+    task_args = {
+        "sample_id": "foo",
+        "ref_id": "bar",
+        "index_id": "baz"
+    }
+
+    features = await virtool.jobs.estimate.get_features(db, settings, task_args)
+
+    if quality:
+        assert features == {"reads": 1000, "read_length": 100, "ref_size": 150}
+        m_get_index_size.assert_called_with(settings, "bar", "baz")
+    else:
+        assert features is None
+        m_get_index_size.assert_not_called()
@@ -0,0 +1,689 @@
+import multiprocessing
+import os
+import queue
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import virtool.config
+import virtool.jobs.job
+
+
+@pytest.fixture
+def job(tmpdir):
+    tmpdir.mkdir("logs").mkdir("jobs")
+
+    return virtool.jobs.job.Job("", "", {"data_path": str(tmpdir)}, "foobar", None)
+
+
+def read_log(job):
+    job.flush_log()
+
+    with open(job._log.path, "r") as f:
+        return f.read().splitlines()
+
+
+def python_command(code):
+    return [sys.executable, "-c", code]
+
+
+def test_run_subprocess(job):
+    """
+    Test that stdout lines are passed to the handler as bytes and that stderr lines are passed to the stderr handler and
+    the job log.
+
+    """
+    stdout = list()
+    stderr = list()
+
+    job.run_subprocess(
+        python_command(
+            "import sys\n"
+            "sys.stdout.write('foo\\nbar\\n' + 'x' * 100000 + '\\nbaz')\n"
+            "sys.stderr.write('error\\n')"
+        ),
+        stdout_handler=stdout.append,
+        stderr_handler=stderr.append
+    )
+
+    assert stdout == [b"foo\n", b"bar\n", b"x" * 100000 + b"\n", b"baz"]
+    assert stderr == [b"error\n"]
+
+    log = read_log(job)
+
+    assert any(line.endswith("b'error'") for line in log)
+    assert "Handled 3 STDOUT lines" in log[-1]
+    assert job._processes == set()
+
+
+def test_run_subprocess_buffered(job):
+    """
+    Test that the stdout handler receives chunks of complete lines in buffered mode.
+
+    """
+    chunks = list()
+
+    lines = [f"line_{i}\n".encode() for i in range(50000)]
+
+    job.run_subprocess(
+        python_command("import sys\nfor i in range(50000): sys.stdout.write(f'line_{i}\\n')"),
+        stdout_handler=chunks.append,
+        buffered=True
+    )
+
+    assert 1 < len(chunks) < len(lines)
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    assert b"".join(chunks) == b"".join(lines)
+
+    log = read_log(job)
+
+    assert "Handled 50000 STDOUT lines" in log[-1]
+    assert "buffered mode" in log[-1]
+
+
+def test_run_subprocess_error(job):
+    with pytest.raises(virtool.jobs.job.SubprocessError) as excinfo:
+        job.run_subprocess(python_command("raise SystemExit(1)"))
+
+    assert "Command failed" in str(excinfo.value)
+
+
+def test_run_subprocess_idle(job):
+    """
+    Test that no CPU time is used while waiting for a quiet subprocess.
+
+    """
+    start = time.process_time()
+
+    job.run_subprocess(python_command("import time; time.sleep(0.5); print('done')"), stdout_handler=lambda line: None)
+
+    assert time.process_time() - start < 0.2
+
+
+def test_run_subprocess_input_paths(job, tmpdir, mocker):
+    """
+    Test that progress is reported from the position of the subprocess in its input files.
+
+    """
+    mocker.patch("virtool.jobs.job.PROGRESS_INTERVAL", 0.05)
+
+    m_report_progress = mocker.patch.object(job, "report_progress")
+
+    paths = [str(tmpdir.join(name)) for name in ["reads_1.fq", "reads_2.fq"]]
+
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"A" * 1000)
+
+    job.run_subprocess(
+        python_command(
+            "import os, sys, time\n"
+            f"fd = os.open({paths[1]!r}, os.O_RDONLY)\n"
+            "os.read(fd, 500)\n"
+            "time.sleep(0.5)"
+        ),
+        input_paths=paths
+    )
+
+    assert m_report_progress.call_args_list[-1] == mocker.call(0.75)
+
+
+def test_find_input_fraction(tmpdir):
+    """
+    Test that closed files that were open before are counted as fully read.
+
+    """
+    path = str(tmpdir.join("reads.fq"))
+
+    with open(path, "wb") as f:
+        f.write(b"A" * 1000)
+
+    sizes = {os.path.realpath(path): 1000}
+    consumed = dict()
+
+    process = subprocess.Popen(python_command(
+        "import os, sys, time\n"
+        f"fd = os.open({path!r}, os.O_RDONLY)\n"
+        "os.read(fd, 250)\n"
+        "print('ready', flush=True)\n"
+        "sys.stdin.read()\n"
+        "os.close(fd)\n"
+        "print('closed', flush=True)\n"
+        "sys.stdin.read()"
+    ), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    try:
+        process.stdout.readline()
+
+        assert virtool.jobs.job.find_input_fraction(process.pid, sizes, consumed) == 0.25
+
+        process.stdin.close()
+        process.stdout.readline()
+
+        assert virtool.jobs.job.find_input_fraction(process.pid, sizes, consumed) == 1
+    finally:
+        process.kill()
+        process.wait()
+
+    assert virtool.jobs.job.find_input_fraction(process.pid, sizes, dict()) is None
+
+
+def test_report_progress(stage_job, mocker):
+    """
+    Test that progress updates are coalesced and that they update the latest status entry in place.
+
+    """
+    mocker.patch("virtool.jobs.job.PROGRESS_INTERVAL", 60)
+
+    stage_job.db = mocker.Mock()
+    stage_job.q = queue.Queue()
+
+    stage_job._status_count = 3
+    stage_job._completed = ["first"]
+    stage_job._current.stage = "second"
+    stage_job._progress_time = time.monotonic()
+
+    stage_job.report_progress(0.2)
+
+    stage_job._progress_time = 0
+
+    stage_job.report_progress(0.5)
+
+    stage_job.db.jobs.update_one.assert_called_once_with({"_id": "foobar"}, {
+        "$set": {
+            "status.2.progress": 0.5
+        }
+    })
+
+    assert stage_job.q.get_nowait()[:3] == ("jobs", "update", ["foobar"])
+
+    # The progress never decreases.
+    stage_job._progress_time = 0
+    stage_job.report_progress(0.1)
+
+    assert stage_job._progress == 0.5
+    assert stage_job.db.jobs.update_one.call_count == 1
+
+
+def test_get_resource_usage():
+    """
+    Test that CPU time used by the job process and its children is reported.
+
+    """
+    start = virtool.jobs.job.get_resource_usage()
+
+    sum(range(3000000))
+
+    subprocess.run(python_command("sum(range(3000000))"), check=True)
+
+    with open(os.devnull, "wb") as f:
+        f.write(b"x" * 100000)
+
+    delta = virtool.jobs.job.find_resource_delta(start, virtool.jobs.job.get_resource_usage())
+
+    assert delta["wall"] > 0
+    assert delta["cpu"] > 0
+    assert delta["children_cpu"] > 0
+    assert delta["peak_rss"] > 0
+    assert delta["children_peak_rss"] > 0
+    assert delta["write_bytes"] >= 100000
+
+
+@pytest.mark.parametrize("fresh", [True, False])
+def test_add_resources(fresh, job, mocker):
+    """
+    Test that peak RSS is only recorded for jobs that are the first to run in their process.
+
+    """
+    job.db = mocker.Mock()
+    job._fresh_process = fresh
+
+    job.add_resources("foo", virtool.jobs.job.get_resource_usage())
+
+    resources = job.db.jobs.update_one.call_args[0][1]["$push"]["resources"]
+
+    assert resources["stage"] == "foo"
+
+    if fresh:
+        assert resources["peak_rss"] > 0
+        assert resources["children_peak_rss"] >= 0
+        assert read_log(job)[-1].endswith("MB peak RSS")
+    else:
+        assert resources["peak_rss"] is None
+        assert resources["children_peak_rss"] is None
+        assert "peak RSS" not in read_log(job)[-1]
+
+
+@pytest.mark.parametrize("proc,expected", [(1, 1), (2, 1), (4, 3)])
+def test_get_tool_threads(proc, expected, job, mocker):
+    """
+    Test that a core is left for the job process if there is more than one and that the threads given to the tool are
+    recorded with the resources of the stage.
+
+    """
+    job.db = mocker.Mock()
+    job.proc = proc
+
+    assert job.get_tool_threads() == expected
+
+    job.add_resources("foo", virtool.jobs.job.get_resource_usage())
+
+    assert job.db.jobs.update_one.call_args[0][1]["$push"]["resources"]["threads"] == expected
+
+
+def test_find_resource_delta():
+    start = {
+        "time": 10,
+        "cpu": 1.5,
+        "children_cpu": 0.5,
+        "peak_rss": 100,
+        "children_peak_rss": 200,
+        "read_bytes": None,
+        "write_bytes": 10
+    }
+
+    end = {
+        "time": 15,
+        "cpu": 2.5,
+        "children_cpu": 4.5,
+        "peak_rss": 300,
+        "children_peak_rss": 200,
+        "read_bytes": 50,
+        "write_bytes": 60
+    }
+
+    assert virtool.jobs.job.find_resource_delta(start, end) == {
+        "wall": 5,
+        "cpu": 1.0,
+        "children_cpu": 4.0,
+        "peak_rss": 300,
+        "children_peak_rss": 200,
+        "read_bytes": None,
+        "write_bytes": 50
+    }
+
+
+@pytest.fixture
+def stage_job(job, mocker):
+    """
+    A job with four stages that record when they start and finish. Database calls are mocked.
+
+    """
+    events = list()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def create_stage(name):
+        def stage():
+            events.append(("start", name))
+
+            if name in job.concurrent:
+                barrier.wait()
+
+            if name == job.failing:
+                raise ValueError("Stage failed")
+
+            events.append(("finish", name))
+
+        stage.__name__ = name
+
+        return stage
+
+    job._stage_list = [create_stage(name) for name in ["first", "second", "third", "fourth"]]
+
+    job._stage_dependencies = {
+        "second": ["first"],
+        "third": ["first"],
+        "fourth": ["second", "third"]
+    }
+
+    job.proc = 2
+    job.get_stage_proc = lambda name: 1
+    job.concurrent = set()
+    job.failing = None
+    job.events = events
+
+    for name in ["add_status", "add_resources", "save_checkpoint"]:
+        mocker.patch.object(job, name)
+
+    return job
+
+
+def test_get_stage_dependencies(stage_job):
+    assert stage_job.get_stage_dependencies() == {
+        "first": [],
+        "second": ["first"],
+        "third": ["first"],
+        "fourth": ["second", "third"]
+    }
+
+    stage_job._stage_dependencies = None
+
+    assert stage_job.get_stage_dependencies() == {
+        "first": [],
+        "second": ["first"],
+        "third": ["second"],
+        "fourth": ["third"]
+    }
+
+
+@pytest.mark.parametrize("dependencies,message", [
+    ({"first": [], "second": ["first", "missing"]}, "Stage second depends on unknown stages: missing"),
+    ({"first": [], "second": ["third"], "third": ["second"]}, "Stage dependencies contain a cycle: second, third")
+])
+def test_check_stage_dependencies(dependencies, message):
+    virtool.jobs.job.check_stage_dependencies({"first": [], "second": ["first"]})
+
+    with pytest.raises(ValueError) as excinfo:
+        virtool.jobs.job.check_stage_dependencies(dependencies)
+
+    assert str(excinfo.value) == message
+
+
+def test_run_stages(stage_job):
+    """
+    Test that independent stages run at the same time and that checkpoints are only saved when no stage is running.
+
+    """
+    stage_job.concurrent = {"second", "third"}
+
+    checkpoints = list()
+    stage_job.save_checkpoint.side_effect = lambda completed: checkpoints.append(list(completed))
+
+    completed = list()
+
+    stage_job.run_stages(completed)
+
+    assert completed[0] == "first"
+    assert sorted(completed[1:3]) == ["second", "third"]
+    assert completed[3] == "fourth"
+
+    assert stage_job.events[:2] == [("start", "first"), ("finish", "first")]
+    assert sorted(stage_job.events[2:4]) == [("start", "second"), ("start", "third")]
+
+    assert checkpoints == [completed[:1], completed[:3], completed]
+
+
+def test_run_stages_proc(stage_job, mocker):
+    """
+    Test that stages do not run at the same time if they would use more than the job's cores.
+
+    """
+    stage_job.get_stage_proc = mocker.Mock(return_value=2)
+
+    completed = list()
+
+    stage_job.run_stages(completed)
+
+    assert completed == ["first", "second", "third", "fourth"]
+
+    assert stage_job.events == [
+        (event, name) for name in completed for event in ("start", "finish")
+    ]
+
+
+def test_run_stages_resume(stage_job):
+    completed = ["first", "third"]
+
+    stage_job.run_stages(completed)
+
+    assert completed == ["first", "third", "second", "fourth"]
+    assert stage_job.events == [("start", "second"), ("finish", "second"), ("start", "fourth"), ("finish", "fourth")]
+
+
+def test_run_stages_error(stage_job):
+    """
+    Test that an error in a concurrent stage is raised after the other running stages have finished.
+
+    """
+    stage_job.concurrent = {"second", "third"}
+    stage_job.failing = "third"
+
+    completed = list()
+
+    with pytest.raises(ValueError) as excinfo:
+        stage_job.run_stages(completed)
+
+    assert str(excinfo.value) == "Stage failed"
+
+    assert "fourth" not in completed
+    assert ("finish", "second") in stage_job.events
+    assert ("start", "fourth") not in stage_job.events
+
+
+def test_checkpoint_files(tmpdir):
+    """
+    Test that files not recorded in a checkpoint are removed from the checkpoint roots and that changed files are
+    detected.
+
+    """
+    root = tmpdir.mkdir("analysis")
+    root.join("reads.fq").write("ACGT")
+    root.mkdir("index").join("index.1.bt2").write("foo")
+
+    other = tmpdir.mkdir("other")
+
+    roots = [str(root), str(other), str(tmpdir.join("missing"))]
+
+    files = virtool.jobs.job.list_checkpoint_files(roots)
+
+    assert files == [
+        {"path": str(root), "size": None},
+        {"path": str(root.join("index")), "size": None},
+        {"path": str(root.join("reads.fq")), "size": 4},
+        {"path": str(root.join("index", "index.1.bt2")), "size": 3},
+        {"path": str(other), "size": None}
+    ]
+
+    assert virtool.jobs.job.check_checkpoint_files(files)
+
+    root.join("partial.vtb").write("bar")
+    root.mkdir("assembly").join("contigs.fa").write("baz")
+    root.join("index").join("index.2.bt2").write("baz")
+
+    virtool.jobs.job.prune_checkpoint_roots(roots, files)
+
+    assert virtool.jobs.job.list_checkpoint_files(roots) == files
+
+    root.join("reads.fq").write("ACGTACGT")
+
+    assert not virtool.jobs.job.check_checkpoint_files(files)
+
+    virtool.jobs.job.prune_checkpoint_roots(roots, [])
+
+    assert not root.check()
+    assert not other.check()
+
+
+class CheckpointJob(virtool.jobs.job.Job):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._stage_list = [
+            self.first,
+            self.second
+        ]
+
+        self.calls = list()
+        self.shutdown = False
+
+    def get_checkpoint_roots(self):
+        return [os.path.join(self.settings["data_path"], "work")]
+
+    def first(self):
+        self.calls.append("first")
+        os.mkdir(self.get_checkpoint_roots()[0])
+        self.intermediate["foo"] = {"bar", "baz"}
+
+    def second(self):
+        self.calls.append("second")
+
+        with open(os.path.join(self.get_checkpoint_roots()[0], "partial.txt"), "w") as f:
+            f.write("partial")
+
+        if self.shutdown:
+            raise virtool.jobs.job.ShutdownError
+
+        self.results["foo"] = sorted(self.intermediate["foo"])
+
+
+def test_resume(tmpdir, dbs, test_db_connection_string, test_db_name):
+    """
+    Test that a job interrupted by a shutdown resumes after its last completed stage with its intermediate state
+    restored and files written by the interrupted stage removed.
+
+    """
+    tmpdir.mkdir("logs").mkdir("jobs")
+
+    dbs.jobs.insert_one({
+        "_id": "foobar",
+        "task": "checkpoint",
+        "args": {},
+        "proc": 1,
+        "mem": 1,
+        "status": []
+    })
+
+    def create_job():
+        return CheckpointJob(
+            test_db_connection_string,
+            test_db_name,
+            {"data_path": str(tmpdir)},
+            "foobar",
+            queue.Queue()
+        )
+
+    job = create_job()
+    job.shutdown = True
+    job.run()
+
+    document = dbs.jobs.find_one("foobar")
+
+    assert document["status"][-1]["state"] == "waiting"
+    assert document["checkpoint"]["stages"] == ["first"]
+    assert os.path.isfile(os.path.join(str(tmpdir), "work", "partial.txt"))
+
+    job = create_job()
+    job.run()
+
+    assert job.calls == ["second"]
+    assert job.results == {"foo": ["bar", "baz"]}
+
+    document = dbs.jobs.find_one("foobar")
+
+    assert document["status"][-1]["state"] == "complete"
+    assert "checkpoint" not in document
+    assert not os.path.isfile(job._checkpoint_path)
+
+
+def test_limit_memory():
+    previous = virtool.jobs.job.limit_memory(64)
+
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+
+        expected = 128 * 1024 ** 3
+
+        if hard != resource.RLIM_INFINITY:
+            expected = min(expected, hard)
+
+        assert soft == expected
+        assert hard == previous[1]
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, previous)
+
+
+@pytest.mark.parametrize("task_name,mem,limited,expected", [
+    ("nuvs", 2, True, 16),
+    ("nuvs", 20, True, 20),
+    ("build_index", 1, True, 4),
+    ("checkpoint", 1, True, 1),
+    ("create_subtraction", 1, False, None)
+])
+def test_get_memory_limit(task_name, mem, limited, expected, job):
+    """
+    Test that the static memory limit for the task is used unless the memory reserved for the job is larger and that
+    jobs without :attr:`.memory_limited` are not limited.
+
+    """
+    job.memory_limited = limited
+
+    job.settings.update({
+        "lg_proc": 4,
+        "lg_mem": 16,
+        "sm_proc": 2,
+        "sm_mem": 4
+    })
+
+    job.task_name = task_name
+    job.mem = mem
+
+    assert job.get_memory_limit() == expected
+
+
+@pytest.mark.parametrize("limited", [True, False])
+def test_run_restores_memory_limit(limited, job, mocker):
+    """
+    Test that the previous address space limit is restored even if cleaning up after a failed job fails and that jobs
+    without :attr:`.memory_limited` are not limited.
+
+    """
+    mocker.patch("signal.signal")
+    mocker.patch("signal.set_wakeup_fd")
+
+    m_limit_memory = mocker.patch("virtool.jobs.job.limit_memory", return_value=(1, 2))
+    m_setrlimit = mocker.patch("resource.setrlimit")
+
+    for name in ["init_db", "check_db", "add_status", "clear_checkpoint"]:
+        mocker.patch.object(job, name)
+
+    mocker.patch.object(job, "load_checkpoint", return_value=list())
+    mocker.patch.object(job, "run_stages", side_effect=ValueError)
+    mocker.patch.object(job, "cleanup", side_effect=OSError)
+    mocker.patch.object(job, "get_memory_limit", return_value=8 if limited else None)
+
+    with pytest.raises(OSError):
+        job.run()
+
+    if limited:
+        m_limit_memory.assert_called_once_with(8)
+        m_setrlimit.assert_called_once_with(resource.RLIMIT_AS, (1, 2))
+    else:
+        assert m_limit_memory.called is False
+        assert m_setrlimit.called is False
+
+
+def run_threads_under_limit(mem, q):
+    virtool.jobs.job.limit_memory(mem)
+
+    code = (
+        "import threading\n"
+        "import numpy\n"
+        "threads = [threading.Thread(target=bytearray, args=(16 * 1024 ** 2,)) for _ in range(64)]\n"
+        "[thread.start() for thread in threads]\n"
+        "[thread.join() for thread in threads]\n"
+    )
+
+    q.put(subprocess.run(python_command(code)).returncode)
+
+
+def test_limit_memory_threaded_subprocess():
+    """
+    Test that a subprocess that imports numpy and starts many threads runs under the limit for the smallest default
+    static memory limit.
+
+    """
+    context = multiprocessing.get_context("fork")
+
+    q = context.Queue()
+
+    process = context.Process(target=run_threads_under_limit, args=(virtool.config.SCHEMA["sm_mem"]["default"], q))
+    process.start()
+
+    assert q.get(timeout=60) == 0
+
+    process.join()
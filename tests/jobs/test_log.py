@@ -0,0 +1,106 @@
+import pytest
+
+import virtool.jobs.log
+
+
+@pytest.fixture
+def log_path(tmpdir):
+    return str(tmpdir.join("foobar.log"))
+
+
+def test_writer(log_path, mocker):
+    """
+    Test that lines are buffered until the writer is flushed and that the file handle is only opened once.
+
+    """
+    m_open = mocker.patch("virtool.jobs.log.open", side_effect=open, create=True)
+
+    writer = virtool.jobs.log.Writer(log_path)
+
+    writer.write("foo")
+    writer.write("bar")
+
+    with open(log_path, "r") as f:
+        assert f.read() == ""
+
+    writer.flush()
+
+    # Flushing again must not write the same lines twice.
+    writer.flush()
+
+    writer.write("baz")
+    writer.close()
+
+    with open(log_path, "r") as f:
+        assert f.read() == "foo\nbar\nbaz\n"
+
+    assert m_open.call_count == 1
+
+
+def test_writer_size(log_path, mocker):
+    mocker.patch("virtool.jobs.log.FLUSH_SIZE", 8)
+
+    writer = virtool.jobs.log.Writer(log_path)
+
+    writer.write("foo")
+
+    with open(log_path, "r") as f:
+        assert f.read() == ""
+
+    writer.write("bar")
+
+    with open(log_path, "r") as f:
+        assert f.read() == "foo\nbar\n"
+
+    writer.close()
+
+
+def test_writer_interval(log_path, mocker):
+    mocker.patch("virtool.jobs.log.FLUSH_INTERVAL", 0.05)
+
+    writer = virtool.jobs.log.Writer(log_path)
+
+    writer.write("foo")
+
+    writer._closed.wait(0.5)
+
+    with open(log_path, "r") as f:
+        assert f.read() == "foo\n"
+
+    writer.close()
+
+
+@pytest.mark.parametrize("offset,size,expected", [
+    (0, 1024, ("foo\nbar\n", 8)),
+    (4, 1024, ("bar\n", 8)),
+    (8, 1024, ("", 8)),
+    (0, 6, ("foo\n", 4)),
+    (4, 2, ("ba", 6))
+], ids=["all", "offset", "partial", "size", "long_line"])
+def test_read(offset, size, expected, log_path):
+    """
+    Test that only complete lines are read unless a single line is longer than ``size``.
+
+    """
+    with open(log_path, "w") as f:
+        f.write("foo\nbar\nba")
+
+    assert virtool.jobs.log.read(log_path, offset, size) == expected
+
+
+def test_read_missing(log_path):
+    assert virtool.jobs.log.read(log_path, 12) == ("", 12)
+
+
+def test_find_log_path(tmpdir):
+    jobs_path = tmpdir.mkdir("logs").mkdir("jobs")
+
+    assert virtool.jobs.log.find_log_path(str(tmpdir), "foobar") is None
+
+    jobs_path.join("foobar").write("legacy")
+
+    assert virtool.jobs.log.find_log_path(str(tmpdir), "foobar") == str(jobs_path.join("foobar"))
+
+    jobs_path.join("foobar.log").write("current")
+
+    assert virtool.jobs.log.find_log_path(str(tmpdir), "foobar") == str(jobs_path.join("foobar.log"))
@@ -0,0 +1,259 @@
+import pytest
+from aiohttp.test_utils import make_mocked_coro
+
+import virtool.jobs.manager
+
+
+@pytest.fixture
+def settings():
+    return {
+        "proc": 8,
+        "mem": 16,
+        "job_policy": "priority",
+        "job_backfill_wait": 600,
+        "job_user_weights": {},
+        "job_task_weights": {},
+        "job_user_limit": 0,
+        "job_aging_rate": 0
+    }
+
+
+def create_job(proc, mem, priority=0, enqueued_at=0, started=False, user_id="bob", task_name="pathoscope_bowtie"):
+    return {
+        "process": object() if started else None,
+        "task_name": task_name,
+        "proc": proc,
+        "mem": mem,
+        "priority": priority,
+        "user_id": user_id,
+        "enqueued_at": enqueued_at,
+        "started_at": 0 if started else None
+    }
+
+
+def test_select_jobs_all(settings):
+    """
+    Test that every waiting job that fits is selected in a single pass.
+
+    """
+    jobs = {
+        "running": create_job(2, 4, started=True),
+        "foo": create_job(2, 4),
+        "bar": create_job(2, 4),
+        "baz": create_job(2, 4),
+        "qux": create_job(2, 4)
+    }
+
+    available = virtool.jobs.manager.get_available_resources(settings, jobs)
+
+    assert virtool.jobs.manager.select_jobs(jobs, available, settings, 10) == ["foo", "bar", "baz"]
+
+
+@pytest.mark.parametrize("policy,expected", [
+    ("fifo", ["nuvs", "sample"]),
+    ("priority", ["sample", "nuvs"])
+])
+def test_select_jobs_policy(policy, expected, settings):
+    settings["job_policy"] = policy
+
+    jobs = {
+        "nuvs": create_job(4, 8, priority=0),
+        "sample": create_job(2, 4, priority=2)
+    }
+
+    assert virtool.jobs.manager.select_jobs(jobs, {"proc": 8, "mem": 16}, settings, 10) == expected
+
+
+@pytest.mark.parametrize("now,expected", [(10, ["small"]), (600, [])])
+def test_select_jobs_backfill(now, expected, settings):
+    """
+    Test that smaller jobs are started ahead of a job that does not fit, until that job has waited for
+    ``job_backfill_wait`` seconds.
+
+    """
+    jobs = {
+        "large": create_job(8, 16),
+        "small": create_job(2, 4)
+    }
+
+    assert virtool.jobs.manager.select_jobs(jobs, {"proc": 4, "mem": 8}, settings, now) == expected
+
+
+def test_select_jobs_too_large(settings):
+    """
+    Test that a job that could never fit on the host does not block other jobs.
+
+    """
+    settings["job_backfill_wait"] = 0
+
+    jobs = {
+        "huge": create_job(16, 4),
+        "small": create_job(2, 4)
+    }
+
+    assert virtool.jobs.manager.select_jobs(jobs, {"proc": 8, "mem": 16}, settings, 10) == ["small"]
+
+
+def test_order_jobs_fair(settings):
+    """
+    Test that users take turns and that a user with running jobs goes after users without.
+
+    """
+    settings["job_policy"] = "fair"
+
+    jobs = {
+        "bob_running": create_job(1, 1, started=True),
+        "bob_1": create_job(1, 1),
+        "bob_2": create_job(1, 1),
+        "bob_3": create_job(1, 1),
+        "fred_1": create_job(1, 1, user_id="fred"),
+        "fred_2": create_job(1, 1, user_id="fred")
+    }
+
+    assert virtool.jobs.manager.order_jobs(jobs, settings, 10) == [
+        "fred_1",
+        "bob_1",
+        "fred_2",
+        "bob_2",
+        "bob_3"
+    ]
+
+
+def test_order_jobs_weights(settings):
+    settings.update({
+        "job_policy": "fair",
+        "job_user_weights": {
+            "bob": 3
+        },
+        "job_task_weights": {
+            "create_sample": 2
+        }
+    })
+
+    jobs = {
+        "bob_1": create_job(1, 1),
+        "bob_2": create_job(1, 1),
+        "fred_1": create_job(1, 1, user_id="fred"),
+        "fred_2": create_job(1, 1, user_id="fred", task_name="create_sample")
+    }
+
+    assert virtool.jobs.manager.order_jobs(jobs, settings, 10) == [
+        "bob_1",
+        "fred_2",
+        "bob_2",
+        "fred_1"
+    ]
+
+
+@pytest.mark.parametrize("enqueued_at,expected", [(0, ["fred", "bob"]), (580, ["bob", "fred"])])
+def test_order_jobs_aging(enqueued_at, expected, settings):
+    """
+    Test that a job from a user with a small share overtakes newer jobs once it has waited long enough.
+
+    """
+    settings.update({
+        "job_policy": "fair",
+        "job_user_weights": {
+            "fred": 0.1
+        },
+        "job_aging_rate": 0.1
+    })
+
+    jobs = {
+        "fred": create_job(1, 1, user_id="fred", enqueued_at=enqueued_at),
+        "bob": create_job(1, 1, enqueued_at=590)
+    }
+
+    assert virtool.jobs.manager.order_jobs(jobs, settings, 600) == expected
+
+
+def test_select_jobs_user_limit(settings):
+    settings.update({
+        "job_policy": "fifo",
+        "job_user_limit": 2
+    })
+
+    jobs = {
+        "bob_running": create_job(1, 1, started=True),
+        "bob_1": create_job(1, 1),
+        "bob_2": create_job(1, 1),
+        "fred_1": create_job(1, 1, user_id="fred")
+    }
+
+    assert virtool.jobs.manager.select_jobs(jobs, {"proc": 7, "mem": 15}, settings, 10) == ["bob_1", "fred_1"]
+
+
+def test_estimate_starts():
+    jobs = {
+        "running": create_job(4, 4, started=True),
+        "foo": create_job(4, 4),
+        "bar": create_job(8, 4),
+        "baz": create_job(2, 2, task_name="nuvs"),
+        "qux": create_job(8, 4)
+    }
+
+    durations = {
+        "pathoscope_bowtie": 100
+    }
+
+    estimates = virtool.jobs.manager.estimate_starts(
+        jobs,
+        ["foo", "bar", "baz", "qux"],
+        {"proc": 4, "mem": 12},
+        durations,
+        40
+    )
+
+    # The NuVs job has no known duration, so jobs that need its resources can't be estimated.
+    assert estimates == {
+        "foo": 0,
+        "bar": 100,
+        "baz": 200,
+        "qux": None
+    }
+
+
+def test_update_duration():
+    durations = dict()
+
+    virtool.jobs.manager.update_duration(durations, "nuvs", 100)
+    virtool.jobs.manager.update_duration(durations, "nuvs", 200)
+
+    assert durations == {
+        "nuvs": 130
+    }
+
+
+async def test_dispatch_pending(loop, mocker, settings):
+    """
+    Test that jobs inserted by other jobs are enqueued before messages are dispatched and that tracked jobs are not
+    enqueued again.
+
+    """
+    app = {
+        "db": mocker.Mock(),
+        "dispatcher": mocker.Mock(),
+        "process_executor": None,
+        "settings": {
+            **settings,
+            "db_connection_string": "mongodb://localhost:27017",
+            "db_name": "test"
+        }
+    }
+
+    manager = virtool.jobs.manager.IntegratedManager(app, None)
+    manager._jobs["foo"] = create_job(2, 8)
+
+    groups = {
+        ("jobs", "insert"): ["foo", "bar"],
+        ("analyses", "update"): ["baz"]
+    }
+
+    mocker.patch.object(manager.channel, "drain", return_value=groups)
+    m_enqueue = mocker.patch.object(manager, "enqueue", make_mocked_coro())
+    m_dispatch_groups = mocker.patch("virtool.jobs.manager.dispatch_groups", make_mocked_coro())
+
+    await manager.dispatch_pending()
+
+    m_enqueue.assert_called_once_with("bar")
+    m_dispatch_groups.assert_called_once_with(app["db"], app["dispatcher"].dispatch, groups)
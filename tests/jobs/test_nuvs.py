@@ -448,3 +448,14 @@ def test_import_results(mock_job, dbs):
             }
         ]
     }
+
+
+@pytest.mark.parametrize("line,expected", [
+    (b"== Running assembler: K21\n", 0),
+    (b"===== K55 started.\n", 0.5),
+    (b"===== Assembling finished. Used k-mer sizes: 21, 33, 55, 75\n", 1),
+    (b"== Running assembler: K99\n", None),
+    (b"  0:00:01.234     4M / 4M    INFO    General                 (main.cpp                  :  74)\n", None)
+])
+def test_find_spades_progress(line, expected):
+    assert virtool.jobs.nuvs.find_spades_progress(line, ["21", "33", "55", "75"]) == expected
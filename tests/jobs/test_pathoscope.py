@@ -5,6 +5,7 @@ import shutil
 import pytest
 
 import virtool.jobs.pathoscope
+import virtool.vtb
 
 TEST_FILES_PATH = os.path.join(sys.path[0], "tests", "test_files")
 PATHOSCOPE_PATH = os.path.join(TEST_FILES_PATH, "pathoscope")
@@ -233,6 +234,8 @@ def test_map_isolates(snapshot, tmpdir, dbs, mock_job):
 
     vta_path = os.path.join(mock_job.params["analysis_path"], "to_isolates.vta")
 
+    virtool.vtb.write_vta(os.path.join(mock_job.params["analysis_path"], "to_isolates.vtb"), vta_path)
+
     with open(vta_path, "r") as f:
         data = sorted([line.rstrip() for line in f])
         snapshot.assert_match(data)
@@ -253,35 +256,9 @@ def test_map_subtraction(snapshot, dbs, mock_job):
     snapshot.assert_match(mock_job.intermediate)
 
 
-def test_subtract_mapping(dbs, mock_job):
-    mock_job.check_db()
-
-    os.makedirs(mock_job.params["analysis_path"])
-
-    with open(TO_SUBTRACTION_PATH, "r") as handle:
-        mock_job.intermediate["to_subtraction"] = json.load(handle)
-
-    shutil.copyfile(VTA_PATH, os.path.join(mock_job.params["analysis_path"], "to_isolates.vta"))
-
-    mock_job.subtract_mapping()
-
-    assert mock_job.results["subtracted_count"] == 4
-
-
-def test_pathoscope(snapshot, dbs, mock_job):
-    mock_job.check_db()
-
-    os.makedirs(mock_job.params["analysis_path"])
-
-    with open(REF_LENGTHS_PATH, "r") as handle:
-        mock_job.intermediate["ref_lengths"] = json.load(handle)
-
-    shutil.copyfile(
-        VTA_PATH,
-        os.path.join(mock_job.params["analysis_path"], "to_isolates.vta")
-    )
-
-    mock_job.params["sequence_otu_map"] = {
+@pytest.fixture
+def sequence_otu_map():
+    return {
         "NC_016509": "foobar",
         "NC_001948": "foobar",
         "13TF149_Reovirus_TF1_Seg06": "reo",
@@ -309,11 +286,46 @@ def test_pathoscope(snapshot, dbs, mock_job):
         "NC_007448": "foobar"
     }
 
+
+def test_pathoscope_subtraction(dbs, mock_job, sequence_otu_map):
+    mock_job.check_db()
+
+    os.makedirs(mock_job.params["analysis_path"])
+
+    with open(REF_LENGTHS_PATH, "r") as handle:
+        mock_job.intermediate["ref_lengths"] = json.load(handle)
+
+    with open(TO_SUBTRACTION_PATH, "r") as handle:
+        mock_job.intermediate["to_subtraction"] = json.load(handle)
+
+    shutil.copyfile(VTA_PATH, os.path.join(mock_job.params["analysis_path"], "to_isolates.vta"))
+
+    mock_job.params["sequence_otu_map"] = sequence_otu_map
+
     mock_job.pathoscope()
 
-    with open(os.path.join(mock_job.params["analysis_path"], "reassigned.vta"), "r") as f:
-        data = sorted([line.rstrip() for line in f])
-        snapshot.assert_match(data)
+    assert mock_job.results["subtracted_count"] == 4
+    assert "to_subtraction" not in mock_job.intermediate
+
+
+def test_pathoscope(snapshot, dbs, mock_job, sequence_otu_map):
+    mock_job.check_db()
+
+    os.makedirs(mock_job.params["analysis_path"])
+
+    with open(REF_LENGTHS_PATH, "r") as handle:
+        mock_job.intermediate["ref_lengths"] = json.load(handle)
+
+    mock_job.intermediate["to_subtraction"] = dict()
+
+    shutil.copyfile(
+        VTA_PATH,
+        os.path.join(mock_job.params["analysis_path"], "to_isolates.vta")
+    )
+
+    mock_job.params["sequence_otu_map"] = sequence_otu_map
+
+    mock_job.pathoscope()
 
     with open(os.path.join(mock_job.params["analysis_path"], "report.tsv"), "r") as f:
         data = sorted([line.rstrip() for line in f])
@@ -335,3 +347,133 @@ def test_import_results(snapshot, dbs, mock_job):
 
     snapshot.assert_match(dbs.analyses.find_one())
     snapshot.assert_match(dbs.samples.find_one())
+
+
+def test_share_results(dbs, mock_job):
+    mock_job.check_db()
+
+    dbs.analyses.update_one({"_id": "baz"}, {
+        "$set": {
+            "job": {"id": "foobar"},
+            "results": "results will be here",
+            "read_count": 1337,
+            "ready": True
+        }
+    })
+
+    dbs.analyses.insert_many([
+        {"_id": "attached", "job": {"id": "foobar"}, "ready": False, "user": {"id": "bob"}},
+        {"_id": "other", "job": {"id": "other"}, "ready": False}
+    ])
+
+    os.makedirs(os.path.join(mock_job.params["analysis_path"], "_reads"))
+
+    with open(os.path.join(mock_job.params["analysis_path"], "report.tsv"), "w") as f:
+        f.write("report")
+
+    with open(os.path.join(mock_job.params["analysis_path"], "results.json"), "w") as f:
+        f.write("{}")
+
+    assert mock_job.share_results() == ["attached"]
+
+    attached = dbs.analyses.find_one("attached")
+
+    assert attached["ready"] is True
+    assert attached["read_count"] == 1337
+    assert attached["user"] == {"id": "bob"}
+
+    assert dbs.analyses.find_one("other")["ready"] is False
+
+    attached_path = os.path.join(mock_job.settings["data_path"], "samples", "foobar", "analysis", "attached")
+
+    assert os.listdir(attached_path) == ["results.json"]
+
+
+@pytest.mark.parametrize("claimed", [False, True], ids=["unclaimed", "claimed"])
+def test_hand_off(claimed, dbs, mocker, mock_job):
+    """
+    Test that the analyses attached to a failed job are handed to a new job for the oldest of them or to the job of an
+    analysis that claimed the fingerprint in the meantime. They are never removed.
+
+    """
+    mock_job.check_db()
+
+    m_dispatch = mocker.patch.object(mock_job, "dispatch")
+
+    dbs.analyses.create_index(
+        "fingerprint",
+        unique=True,
+        partialFilterExpression={"ready": False, "attached": False}
+    )
+
+    dbs.analyses.insert_many([
+        {
+            "_id": name,
+            "created_at": created_at,
+            "fingerprint": "abc",
+            "attached": True,
+            "job": {"id": "foobar"},
+            "ready": False,
+            "user": {"id": name}
+        } for name, created_at in [("newer", 2), ("oldest", 1)]
+    ])
+
+    if claimed:
+        dbs.analyses.insert_one({
+            "_id": "owner",
+            "created_at": 3,
+            "fingerprint": "abc",
+            "attached": False,
+            "job": {"id": "other"},
+            "ready": False
+        })
+
+    mock_job.hand_off()
+
+    oldest = dbs.analyses.find_one("oldest")
+    newer = dbs.analyses.find_one("newer")
+
+    assert oldest["ready"] is newer["ready"] is False
+    assert oldest["job"] == newer["job"]
+    assert newer["attached"] is True
+
+    if claimed:
+        assert oldest["job"] == {"id": "other"}
+        assert oldest["attached"] is True
+        assert dbs.jobs.count_documents({}) == 1
+        m_dispatch.assert_called_once_with("analyses", "update", ["oldest", "newer"])
+        return
+
+    job_id = oldest["job"]["id"]
+
+    assert job_id != "foobar"
+    assert oldest["attached"] is False
+
+    job = dbs.jobs.find_one(job_id)
+
+    assert job["task"] == "pathoscope_bowtie"
+    assert job["args"] == {**mock_job.task_args, "analysis_id": "oldest"}
+    assert job["user"] == {"id": "oldest"}
+    assert job["status"][-1]["state"] == "waiting"
+
+    assert m_dispatch.call_args_list == [
+        mocker.call("jobs", "insert", [job_id]),
+        mocker.call("analyses", "update", ["oldest", "newer"])
+    ]
+
+
+def test_cleanup_keeps_attached(dbs, mocker, mock_job):
+    """
+    Test that only the analysis of the job is removed when it fails.
+
+    """
+    mock_job.check_db()
+
+    m_hand_off = mocker.patch.object(mock_job, "hand_off")
+
+    dbs.analyses.insert_one({"_id": "attached", "job": {"id": "foobar"}, "ready": False})
+
+    mock_job.cleanup()
+
+    assert dbs.analyses.distinct("_id") == ["attached"]
+    m_hand_off.assert_called_once_with()
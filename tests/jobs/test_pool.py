@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+import virtool.jobs.job
+import virtool.jobs.pool
+
+
+class EchoWorker(virtool.jobs.pool.Worker):
+    """
+    A worker that finishes jobs straight away without using the database. The ``slow`` job runs until it is cancelled,
+    the ``error`` job raises an exception, and the ``settings`` job reports the value of its ``foo`` setting.
+
+    """
+
+    def run_job(self, db, job_id, settings):
+        if job_id == "error":
+            raise ValueError("No job document")
+
+        if job_id == "settings":
+            self.q.put(("settings", settings["foo"]))
+
+        if job_id == "slow":
+            signal.signal(signal.SIGTERM, virtool.jobs.job.handle_sigterm)
+
+            try:
+                time.sleep(10)
+            except virtool.jobs.job.TerminationError:
+                self.q.put(("cancelled", job_id))
+
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+@pytest.fixture
+def pool(mocker):
+    mocker.patch("virtool.jobs.pool.Worker", EchoWorker)
+
+    pool = virtool.jobs.pool.WorkerPool(2, "mongodb://localhost:27017", "test", {"foo": 1}, multiprocessing.Queue())
+    pool.start()
+
+    yield pool
+
+    pool.close()
+
+    for worker in pool._workers:
+        worker.join(5)
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return True
+
+        time.sleep(0.05)
+
+    return False
+
+
+def test_acquire(pool):
+    """
+    Test that jobs are only given to idle workers and that workers are reused once their jobs are finished.
+
+    """
+    slow = pool.acquire("slow")
+    slow.start()
+
+    assert slow.is_alive()
+
+    fast = pool.acquire("fast")
+
+    assert fast.worker is not slow.worker
+
+    fast.start()
+
+    assert wait_for(lambda: not fast.is_alive())
+
+    assert pool.acquire("foo").worker is fast.worker
+
+    slow.terminate()
+
+    assert wait_for(lambda: not slow.is_alive())
+
+    assert pool.q.get(timeout=5) == ("cancelled", "slow")
+
+
+def test_acquire_busy(pool):
+    for job_id in ["slow", "slow"]:
+        pool.acquire(job_id).start()
+
+    assert pool.acquire("foo") is None
+
+    workers = list(pool._workers)
+
+    for worker in workers:
+        os.kill(worker.pid, signal.SIGKILL)
+        worker.join(5)
+
+    # Workers that have exited are replaced.
+    job = pool.acquire("foo")
+
+    assert job.worker not in workers
+    assert job.worker.is_alive()
+
+
+def test_terminate_finished(pool, mocker):
+    """
+    Test that a worker is not signalled for a job it has already finished.
+
+    """
+    job = pool.acquire("fast")
+    job.start()
+
+    assert wait_for(lambda: not job.is_alive())
+
+    m_kill = mocker.patch("os.kill")
+
+    job.terminate()
+
+    m_kill.assert_not_called()
+
+
+def test_error(pool):
+    """
+    Test that a worker sends the job ID back and keeps running if a job can't be run.
+
+    """
+    job = pool.acquire("error")
+    job.start()
+
+    assert wait_for(lambda: not job.is_alive())
+
+    assert job.worker.is_alive()
+    assert pool.acquire("foo").worker is job.worker
+
+
+def test_settings(pool):
+    """
+    Test that jobs get the settings as they are when the job is started, not when the worker was started.
+
+    """
+    pool.settings["foo"] = 2
+
+    pool.acquire("settings").start()
+
+    assert pool.q.get(timeout=5) == ("settings", 2)
+
+
+@pytest.mark.parametrize("error", [None, "termination", "shutdown"])
+def test_run_job(error, mocker):
+    """
+    Test that the signal handlers installed for a job are always removed when it ends and that cancelled jobs are put
+    in the cancelled state.
+
+    """
+    class Job:
+
+        def __init__(self, *args):
+            pass
+
+        def run(self):
+            if error == "termination":
+                raise virtool.jobs.job.TerminationError
+
+            if error == "shutdown":
+                raise virtool.jobs.job.ShutdownError
+
+    mocker.patch.dict("virtool.jobs.classes.TASK_CLASSES", {"foo": Job})
+
+    m_cancel = mocker.patch("virtool.jobs.pool.cancel")
+
+    db = mocker.Mock()
+    db.jobs.find_one.return_value = {"task": "foo"}
+
+    q = mocker.Mock()
+
+    worker = virtool.jobs.pool.Worker("mongodb://localhost:27017", "test", q)
+
+    previous = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGUSR1)}
+
+    try:
+        worker.run_job(db, "bar", {})
+
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_IGN
+        assert signal.getsignal(signal.SIGUSR1) == signal.SIG_IGN
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+    if error == "termination":
+        m_cancel.assert_called_with(db, "bar")
+        assert q.put.call_args[0][0][:3] == ("jobs", "update", ["bar"])
+    else:
+        m_cancel.assert_not_called()
@@ -0,0 +1,191 @@
+import datetime
+import multiprocessing
+import os
+import signal
+import time
+
+import pymongo
+import pytest
+
+import virtool.jobs.runner
+import virtool.utils
+
+
+class EchoJob(multiprocessing.Process):
+    """
+    Records the runner process that ran it and completes.
+
+    """
+
+    def __init__(self, db_connection_string, db_name, settings, job_id, q):
+        super().__init__()
+
+        self.db_connection_string = db_connection_string
+        self.db_name = db_name
+        self.job_id = job_id
+        self.q = q
+
+    def run(self):
+        db = pymongo.MongoClient(self.db_connection_string)[self.db_name]
+
+        time.sleep(0.2)
+
+        db.jobs.update_one({"_id": self.job_id}, {
+            "$push": {
+                "status": {
+                    "state": "complete",
+                    "stage": None,
+                    "error": None,
+                    "progress": 1,
+                    "timestamp": virtool.utils.timestamp()
+                }
+            },
+            "$set": {
+                "runner": os.getppid()
+            }
+        })
+
+        self.q.put(("jobs", "update", [self.job_id], time.time()))
+
+
+def create_job(job_id, states, created_at, proc=1, mem=1):
+    return {
+        "_id": job_id,
+        "task": "echo",
+        "proc": proc,
+        "mem": mem,
+        "status": [
+            {
+                "state": state,
+                "stage": None,
+                "error": None,
+                "progress": 0,
+                "timestamp": created_at + datetime.timedelta(seconds=index)
+            } for index, state in enumerate(states)
+        ]
+    }
+
+
+@pytest.fixture
+def config(test_db_connection_string, test_db_name):
+    return {
+        "db_connection_string": test_db_connection_string,
+        "db_name": test_db_name,
+        "proc": 1,
+        "mem": 4
+    }
+
+
+def test_acquire_lease(dbs):
+    assert virtool.jobs.runner.acquire_lease(dbs, "foo", "runner_1")["runner"] == "runner_1"
+
+    # The lease is held by the first runner.
+    assert virtool.jobs.runner.acquire_lease(dbs, "foo", "runner_2") is None
+
+    dbs.job_leases.update_one({"_id": "foo"}, {
+        "$set": {
+            "expires_at": virtool.utils.timestamp() - datetime.timedelta(seconds=1)
+        }
+    })
+
+    # An expired lease can be taken over.
+    assert virtool.jobs.runner.acquire_lease(dbs, "foo", "runner_2")["runner"] == "runner_2"
+
+
+def test_find_claimable(dbs):
+    now = virtool.utils.timestamp()
+
+    dbs.jobs.insert_many([
+        create_job("waiting", ["waiting"], now + datetime.timedelta(seconds=10)),
+        create_job("recovered", ["waiting", "running", "waiting"], now),
+        create_job("abandoned", ["waiting", "running"], now + datetime.timedelta(seconds=20)),
+        create_job("leased", ["waiting", "running"], now),
+        create_job("complete", ["waiting", "running", "complete"], now)
+    ])
+
+    dbs.job_leases.insert_many([
+        {"_id": "leased", "runner": "foo", "expires_at": now + datetime.timedelta(seconds=30)},
+        {"_id": "abandoned", "runner": "foo", "expires_at": now - datetime.timedelta(seconds=30)}
+    ])
+
+    assert [d["_id"] for d in virtool.jobs.runner.find_claimable(dbs)] == ["recovered", "waiting", "abandoned"]
+
+
+def test_transport(dbs, test_db_connection_string, test_db_name):
+    transport = virtool.jobs.runner.Transport(test_db_connection_string, test_db_name)
+
+    transport.put(("samples", "update", ["foo"], 100.0))
+
+    assert dbs.job_messages.find_one({}, {"_id": False}) == {
+        "interface": "samples",
+        "operation": "update",
+        "id_list": ["foo"],
+        "sent_at": 100.0
+    }
+
+
+def test_runners(mocker, dbs, config):
+    """
+    Test that jobs are shared between several runner processes and that no job is run twice.
+
+    """
+    mocker.patch.dict("virtool.jobs.classes.TASK_CLASSES", {"echo": EchoJob})
+    mocker.patch("virtool.jobs.runner.POLL_INTERVAL", 0.05)
+
+    now = virtool.utils.timestamp()
+
+    dbs.jobs.insert_many([create_job(f"job_{index}", ["waiting"], now) for index in range(6)])
+
+    runners = [multiprocessing.Process(target=virtool.jobs.runner.run, args=(config,)) for _ in range(3)]
+
+    for runner in runners:
+        runner.start()
+
+    try:
+        deadline = time.monotonic() + 20
+
+        while dbs.jobs.count_documents({"status.state": "complete"}) < 6 and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        for runner in runners:
+            os.kill(runner.pid, signal.SIGTERM)
+            runner.join()
+
+    documents = list(dbs.jobs.find())
+
+    assert all([s["state"] for s in d["status"]] == ["waiting", "complete"] for d in documents)
+
+    # Each runner can only run one job at a time, so the jobs must have been shared.
+    assert len({d["runner"] for d in documents}) > 1
+
+    assert dbs.job_leases.count_documents({}) == 0
+    assert dbs.job_messages.count_documents({}) == 6
+
+
+async def test_cancel_waiting(mocker, dbi, static_time):
+    await dbi.jobs.insert_one(create_job("foo", ["waiting"], static_time.datetime))
+
+    manager = virtool.jobs.runner.RemoteManager({"dispatcher": mocker.Mock(), "db": dbi})
+
+    await manager.cancel("foo")
+
+    document = await dbi.jobs.find_one("foo")
+
+    assert document["status"][-1]["state"] == "cancelled"
+    assert await dbi.job_leases.count_documents({}) == 0
+
+
+async def test_cancel_running(mocker, dbi, static_time):
+    await dbi.jobs.insert_one(create_job("foo", ["waiting", "running"], static_time.datetime))
+    await dbi.job_leases.insert_one({"_id": "foo", "runner": "bar", "expires_at": static_time.datetime})
+
+    manager = virtool.jobs.runner.RemoteManager({"dispatcher": mocker.Mock(), "db": dbi})
+
+    await manager.cancel("foo")
+
+    assert await dbi.job_leases.find_one("foo") == {
+        "_id": "foo",
+        "runner": "bar",
+        "expires_at": static_time.datetime,
+        "cancel": True
+    }
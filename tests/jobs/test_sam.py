@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+import virtool.jobs.sam
+import virtool.pathoscope
+
+SAM_PATH = os.path.join(sys.path[0], "tests", "test_files", "sam_50.sam")
+
+
+@pytest.fixture
+def sam_chunk():
+    with open(SAM_PATH, "rb") as f:
+        return f.read()
+
+
+def parse_lines(chunk):
+    """
+    Parse ``chunk`` line by line the way the mapping stages did before :mod:`virtool.jobs.sam` existed.
+
+    """
+    records = list()
+
+    for line in chunk.decode().split("\n"):
+        if not line or line[0] == "@":
+            continue
+
+        fields = line.split("\t")
+
+        if int(fields[1]) & 0x4 == 4 or fields[2] == "*":
+            continue
+
+        records.append((
+            fields[0],
+            int(fields[1]),
+            fields[2],
+            int(fields[3]),
+            len(fields[9]),
+            virtool.pathoscope.find_sam_align_score(fields)
+        ))
+
+    return records
+
+
+def test_parse_batch(sam_chunk):
+    batch = virtool.jobs.sam.parse_batch(sam_chunk)
+
+    assert list(batch) == list(virtool.jobs.sam.FIELDS)
+    assert list(zip(*batch.values())) == parse_lines(sam_chunk)
+
+
+@pytest.mark.parametrize("fields", [("rname",), ("qname", "score"), ("score", "pos", "qname")])
+def test_parse_batch_fields(fields, sam_chunk):
+    """
+    Test that only the requested fields are returned, in :data:`FIELDS` order.
+
+    """
+    batch = virtool.jobs.sam.parse_batch(sam_chunk, fields)
+    full = virtool.jobs.sam.parse_batch(sam_chunk)
+
+    assert list(batch) == [field for field in virtool.jobs.sam.FIELDS if field in fields]
+
+    for field in fields:
+        assert batch[field] == full[field]
+
+
+def test_parse_batch_min_score():
+    chunk = (
+        b"@HD\tVN:1.0\n"
+        b"read_1\t0\tref_1\t10\t255\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:8\tXN:i:0\n"
+        b"read_2\t0\tref_1\t20\t255\t4M\t*\t0\t0\tACGT\tIIII\tXN:i:0\tAS:i:-2\n"
+        b"read_3\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\tYT:Z:UU\n"
+        b"read_4\t0\tref_2\t5\t255\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:2"
+    )
+
+    assert virtool.jobs.sam.parse_batch(chunk, ("qname", "score"), min_score=5) == {
+        "qname": ["read_1", "read_4"],
+        "score": [12.0, 6.0]
+    }
+
+
+def test_parse_batch_unknown_field():
+    with pytest.raises(ValueError) as excinfo:
+        virtool.jobs.sam.parse_batch(b"", ("qname", "mapq"))
+
+    assert "mapq" in str(excinfo.value)
+
+
+def test_find_score_missing():
+    with pytest.raises(ValueError) as excinfo:
+        virtool.jobs.sam.find_score(b"XN:i:0\tYT:Z:UU", 100)
+
+    assert "Could not find alignment score" in str(excinfo.value)
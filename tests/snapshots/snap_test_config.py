@@ -33,6 +33,32 @@ snapshots['test_schema 1'] = {
         'default': 'localhost',
         'type': 'string'
     },
+    'job_backfill_wait': {
+        'coerce': GenericRepr("<class 'int'>"),
+        'default': 600,
+        'min': 0,
+        'type': 'integer'
+    },
+    'job_policy': {
+        'allowed': [
+            'fair',
+            'fifo',
+            'priority'
+        ],
+        'default': 'fair',
+        'type': 'string'
+    },
+    'job_runners': {
+        'coerce': GenericRepr('<function to_bool at 0x100000000>'),
+        'default': False,
+        'type': 'boolean'
+    },
+    'job_workers': {
+        'coerce': GenericRepr("<class 'int'>"),
+        'default': 0,
+        'min': 0,
+        'type': 'integer'
+    },
     'lg_mem': {
         'coerce': GenericRepr("<class 'int'>"),
         'default': 8,
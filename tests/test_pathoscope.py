@@ -1,11 +1,15 @@
+import copy
+import json
 import os
 import sys
 import pytest
+import numpy as np
 import shutil
 import pickle
 import filecmp
 
 import virtool.pathoscope
+import virtool.vtb
 
 BASE_PATH = os.path.join(sys.path[0], "tests", "test_files", "pathoscope")
 BEST_HIT_PATH = os.path.join(BASE_PATH, "best_hit")
@@ -74,6 +78,94 @@ def test_em(tmpdir, theta_prior, pi_prior, epsilon, max_iter, expected_em):
     assert result[3] == expected_em[file_string][3]
 
 
+@pytest.mark.parametrize("theta_prior", [0, 1e-5])
+@pytest.mark.parametrize("pi_prior", [0, 1e-5])
+@pytest.mark.parametrize("epsilon", [1e-6, 1e-8])
+@pytest.mark.parametrize("max_iter", [0, 1, 10, 30])
+def test_em_sparse(tmpdir, theta_prior, pi_prior, epsilon, max_iter):
+    """
+    Test that :meth:`em_sparse` gives the same result as :meth:`em` within tolerance.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    u, nu, refs, _ = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    expected = virtool.pathoscope.em(u, copy.deepcopy(nu), refs, max_iter, epsilon, pi_prior, theta_prior)
+    actual = virtool.pathoscope.em_sparse(u, copy.deepcopy(nu), refs, max_iter, epsilon, pi_prior, theta_prior)
+
+    for i in [0, 1, 2]:
+        assert actual[i] == pytest.approx(expected[i], rel=1e-9, abs=1e-15)
+
+    assert actual[3].keys() == expected[3].keys()
+
+    for read_index, value in expected[3].items():
+        assert actual[3][read_index][0] == value[0]
+        assert actual[3][read_index][2] == pytest.approx(value[2], rel=1e-9, abs=1e-15)
+
+
+@pytest.mark.parametrize("vtb", [False, True])
+def test_em_matrix_duplicate_extremes(tmpdir, vtb):
+    """
+    Test that :meth:`em_matrix` gives the same result as :meth:`em` when the highest score only appears on a duplicate
+    read-reference line.
+
+    """
+    vta_path = os.path.join(str(tmpdir), "duplicate.vta")
+
+    with open(vta_path, "w") as f:
+        f.write("r1,A,1,10,50\nr1,B,5,10,60\nr1,A,30,10,90\nr2,A,1,10,40\n")
+
+    u, nu, refs, _ = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    expected = virtool.pathoscope.em(u, copy.deepcopy(nu), refs, 30, 1e-7, 0, 0)
+
+    if vtb:
+        vtb_path = os.path.join(str(tmpdir), "duplicate.vtb")
+        virtool.vtb.convert_vta(vta_path, vtb_path)
+        matrix = virtool.pathoscope.build_matrix_vtb(vtb_path, 0.01)
+    else:
+        matrix = virtool.pathoscope.build_matrix_arrays(vta_path, 0.01)
+
+    actual = virtool.pathoscope.em_matrix(matrix, 30, 1e-7, 0, 0)
+
+    assert matrix["refs"] == refs
+    assert actual[0] == pytest.approx(expected[0], rel=1e-9)
+    assert actual[1] == pytest.approx(expected[1], rel=1e-9)
+
+
+@pytest.mark.parametrize("accelerate", [False, True])
+def test_em_matrix_stats(accelerate):
+    matrix = virtool.pathoscope.build_matrix_arrays(VTA_PATH, 0.01)
+
+    _, _, _, stats = virtool.pathoscope.em_matrix(matrix, 50, 1e-7, 0, 0, accelerate=accelerate)
+
+    assert stats["accelerated"] is accelerate
+    assert stats["converged"] is True
+    assert stats["delta"] <= 1e-7
+    assert stats["duration"] >= 0
+    assert 0 < stats["iterations"] <= stats["evaluations"] <= 50
+
+
+@pytest.mark.parametrize("pi_prior", [0, 1e-5])
+def test_em_matrix_accelerated(pi_prior):
+    """
+    Test that SQUAREM accelerated EM converges to the same result as plain EM and has the same initial guess.
+
+    """
+    expected_matrix = virtool.pathoscope.build_matrix_arrays(VTA_PATH, 0.01)
+    actual_matrix = virtool.pathoscope.build_matrix_arrays(VTA_PATH, 0.01)
+
+    expected = virtool.pathoscope.em_matrix(expected_matrix, 1000, 1e-12, pi_prior, 0)
+    actual = virtool.pathoscope.em_matrix(actual_matrix, 1000, 1e-12, pi_prior, 0, accelerate=True)
+
+    assert actual[0] == pytest.approx(expected[0])
+    assert actual[1] == pytest.approx(expected[1], abs=1e-9)
+
+    assert actual[3]["evaluations"] <= expected[3]["evaluations"] + 2
+
+
 def test_compute_best_hit():
     """
     Test that :meth:`compute_best_hit` gives the expected result given some input data.
@@ -101,6 +193,103 @@ def test_rewrite_align(tmpdir):
     assert not filecmp.cmp(vta_path, rewrite_path)
 
 
+def test_build_matrix_arrays(tmpdir):
+    """
+    Test that :meth:`build_matrix_arrays` holds the same reads, references and scores as :meth:`build_matrix`.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    u, nu, refs, reads = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    matrix = virtool.pathoscope.build_matrix_arrays(vta_path, 0.01)
+
+    assert matrix["refs"] == refs
+    assert matrix["read_count"] == len(reads)
+
+    indptr = matrix["indptr"]
+
+    for read_index in range(len(reads)):
+        start, end = indptr[read_index], indptr[read_index + 1]
+
+        indices = matrix["indices"][start:end].tolist()
+        scores = matrix["scores"][start:end].tolist()
+        x_norm = matrix["x_norm"][start:end].tolist()
+
+        if read_index in u:
+            assert indices == [u[read_index][0]]
+            assert scores == pytest.approx([u[read_index][1]])
+            assert x_norm == [1.0]
+        else:
+            assert indices == nu[read_index][0]
+            assert scores == pytest.approx(nu[read_index][1])
+            assert x_norm == pytest.approx(nu[read_index][2])
+
+
+@pytest.mark.parametrize("max_iter", [0, 30])
+def test_matrix_stages(tmpdir, max_iter):
+    """
+    Test that EM, best hit calculation and alignment rewriting give the same results for matrices built by
+    :meth:`build_matrix_arrays` and :meth:`build_matrix`.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    u, nu, refs, reads = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    matrix = virtool.pathoscope.build_matrix_arrays(vta_path, 0.01)
+
+    for actual, expected in zip(
+        virtool.pathoscope.compute_best_hit_matrix(matrix),
+        virtool.pathoscope.compute_best_hit(u, nu, refs, reads)
+    ):
+        assert actual == pytest.approx(expected)
+
+    expected = virtool.pathoscope.em(u, nu, refs, max_iter, 1e-7, 0, 0)
+    actual = virtool.pathoscope.em_matrix(matrix, max_iter, 1e-7, 0, 0)
+
+    for i in [0, 1, 2]:
+        assert actual[i] == pytest.approx(expected[i], rel=1e-9, abs=1e-15)
+
+    for actual, expected in zip(
+        virtool.pathoscope.compute_best_hit_matrix(matrix),
+        virtool.pathoscope.compute_best_hit(u, nu, refs, reads)
+    ):
+        assert actual == pytest.approx(expected)
+
+    expected_path = os.path.join(str(tmpdir), "expected.vta")
+    actual_path = os.path.join(str(tmpdir), "actual.vta")
+
+    virtool.pathoscope.rewrite_align(u, nu, vta_path, 0.01, expected_path)
+    virtool.pathoscope.rewrite_align_matrix(matrix, vta_path, 0.01, actual_path)
+
+    assert filecmp.cmp(expected_path, actual_path)
+
+
+def test_collapse_profiles():
+    """
+    Test that :meth:`collapse_profiles` groups rows with the same references and scores in the same order.
+
+    """
+    indptr = np.array([0, 2, 4, 6, 9, 11])
+    indices = np.array([0, 1, 0, 1, 1, 0, 0, 1, 2, 0, 1])
+    scores = np.array([1.0, 2.0, 1.0, 2.0, 2.0, 1.0, 1.0, 2.0, 3.0, 1.0, 3.0])
+
+    class_indptr, class_indices, class_scores, counts, read_classes = virtool.pathoscope.collapse_profiles(
+        indptr,
+        indices,
+        scores
+    )
+
+    assert class_indptr.tolist() == [0, 2, 4, 7, 9]
+    assert class_indices.tolist() == [0, 1, 1, 0, 0, 1, 2, 0, 1]
+    assert class_scores.tolist() == [1.0, 2.0, 2.0, 1.0, 1.0, 2.0, 3.0, 1.0, 3.0]
+    assert counts.tolist() == [2, 1, 1, 1]
+    assert read_classes.tolist() == [0, 0, 1, 2, 3]
+
+
 def test_calculate_coverage(tmpdir, test_sam_path):
     ref_lengths = dict()
 
@@ -166,4 +355,206 @@ def test_write_report(tmpdir):
     assert filecmp.cmp(report_path, TSV_PATH)
 
 
+def test_find_report_refs():
+    """
+    Test that references are ordered by descending pi and reference ID and that the report stops at the first
+    reference with a low pi and no high or low confidence hits.
+
+    """
+    refs = ["a", "b", "c", "d", "e", "f", "g"]
+    pi = [0.5, 0.0, 0.005, 0.0, 0.5, 0.0, 0.2]
+    level_1_final = [1, 0, 0, 1, 1, 0, 0]
+    level_2_final = [0, 0, 2, 0, 0, 0, 0]
+
+    indexes = virtool.pathoscope.find_report_refs(pi, refs, level_1_final, level_2_final)
+
+    assert [refs[i] for i in indexes] == ["e", "a", "g", "c"]
+
+
+def test_find_report_refs_all():
+    indexes = virtool.pathoscope.find_report_refs([0.1, 0.9], ["a", "b"], [1, 1], [0, 0])
+    assert indexes.tolist() == [1, 0]
+
+
+
+
+
+@pytest.mark.parametrize("p_score_cutoff", [0.01, 120])
+def test_build_matrix_vtb(tmpdir, p_score_cutoff):
+    """
+    Test that :meth:`build_matrix_vtb` gives the same matrix as :meth:`build_matrix_arrays` for an equivalent VTA file.
+
+    """
+    vtb_path = os.path.join(str(tmpdir), "test.vtb")
+    virtool.vtb.convert_vta(VTA_PATH, vtb_path)
+
+    expected = virtool.pathoscope.build_matrix_arrays(VTA_PATH, p_score_cutoff)
+    actual = virtool.pathoscope.build_matrix_vtb(vtb_path, p_score_cutoff)
+
+    assert actual["refs"] == expected["refs"]
+    assert actual["read_count"] == expected["read_count"]
+
+    for key in ["indptr", "indices", "scores", "x_norm", "line_entries"]:
+        assert actual[key].tolist() == expected[key].tolist()
+
+
+def test_rewrite_align_vtb(tmpdir):
+    vtb_path = os.path.join(str(tmpdir), "test.vtb")
+    virtool.vtb.convert_vta(VTA_PATH, vtb_path)
+
+    matrix = virtool.pathoscope.build_matrix_vtb(vtb_path, 0.01)
+    virtool.pathoscope.em_matrix(matrix, 30, 1e-7, 0, 0)
+
+    expected_path = os.path.join(str(tmpdir), "expected.vta")
+    virtool.pathoscope.rewrite_align_matrix(matrix, VTA_PATH, 0.01, expected_path)
+
+    rewrite_path = os.path.join(str(tmpdir), "rewrite.vtb")
+    virtool.pathoscope.rewrite_align_vtb(matrix, vtb_path, 0.01, rewrite_path)
+
+    actual_path = os.path.join(str(tmpdir), "actual.vta")
+    virtool.vtb.write_vta(rewrite_path, actual_path)
+
+    assert filecmp.cmp(expected_path, actual_path, shallow=False)
+
+
+def test_calculate_coverage_vtb(tmpdir):
+    with open(os.path.join(BASE_PATH, "ref_lengths.json"), "r") as handle:
+        ref_lengths = json.load(handle)
+
+    vtb_path = os.path.join(str(tmpdir), "test.vtb")
+    virtool.vtb.convert_vta(VTA_PATH, vtb_path)
+
+    expected = virtool.pathoscope.calculate_coverage(VTA_PATH, ref_lengths)
+    actual = virtool.pathoscope.calculate_coverage_vtb(vtb_path, ref_lengths)
+
+    assert actual.keys() == expected.keys()
+
+    for ref_id, coverage in expected.items():
+        assert actual[ref_id].tolist() == coverage.tolist()
+
+
+def test_calculate_pileups():
+    """
+    Test that :meth:`calculate_pileups` matches per-base counting, including alignments that overhang the end of a
+    reference.
+
+    """
+    ref_names = ["foo", "bar", "baz"]
+    ref_lengths = {"foo": 10, "bar": 6, "baz": 8}
+
+    alignments = [
+        (0, 1, 4),
+        (0, 3, 4),
+        (0, 8, 5),
+        (1, 1, 6),
+        (1, 6, 3),
+        (1, 9, 2),
+        (0, 10, 1)
+    ]
+
+    ref_indexes, positions, lengths = (np.array(column) for column in zip(*alignments))
+
+    expected = {ref_id: [0] * ref_lengths[ref_id] for ref_id in ["foo", "bar"]}
+
+    for ref_index, pos, length in alignments:
+        coverage = expected[ref_names[ref_index]]
+
+        for i in range(pos - 1, pos - 1 + length):
+            if i < len(coverage):
+                coverage[i] += 1
+
+    actual = virtool.pathoscope.calculate_pileups(ref_indexes, positions, lengths, ref_names, ref_lengths)
+
+    assert {ref_id: coverage.tolist() for ref_id, coverage in actual.items()} == expected
+
+
+def test_subtract_vtb(tmpdir):
+    with open(os.path.join(BASE_PATH, "to_subtraction.json"), "r") as handle:
+        host_scores = json.load(handle)
+
+    expected_path = str(tmpdir.mkdir("expected"))
+    actual_path = str(tmpdir.mkdir("actual"))
+
+    shutil.copyfile(VTA_PATH, os.path.join(expected_path, "to_isolates.vta"))
+    shutil.copyfile(VTA_PATH, os.path.join(actual_path, "to_isolates.vta"))
+
+    expected_count = virtool.pathoscope.subtract(expected_path, host_scores)
+    actual_count = virtool.pathoscope.subtract_vtb(actual_path, host_scores)
+
+    assert actual_count == expected_count
+
+    vta_path = os.path.join(actual_path, "subtracted.vta")
+    virtool.vtb.write_vta(os.path.join(actual_path, "to_isolates.vtb"), vta_path)
+
+    assert filecmp.cmp(os.path.join(expected_path, "to_isolates.vta"), vta_path, shallow=False)
+
+
+def test_run_fused(tmpdir):
+    """
+    Test that :meth:`run_fused` gives the same subtracted read count, report and coverage as running subtraction,
+    matrix building, EM, reassignment and coverage calculation as separate stages.
+
+    """
+    with open(os.path.join(BASE_PATH, "to_subtraction.json"), "r") as handle:
+        host_scores = json.load(handle)
+
+    with open(os.path.join(BASE_PATH, "ref_lengths.json"), "r") as handle:
+        ref_lengths = json.load(handle)
+
+    expected_path = str(tmpdir.mkdir("expected"))
+    actual_path = str(tmpdir.mkdir("actual"))
+
+    shutil.copyfile(VTA_PATH, os.path.join(expected_path, "to_isolates.vta"))
+    shutil.copyfile(VTA_PATH, os.path.join(actual_path, "to_isolates.vta"))
+
+    subtracted_count = virtool.pathoscope.subtract_vtb(expected_path, host_scores)
+
+    vtb_path = os.path.join(expected_path, "to_isolates.vtb")
+    reassigned_path = os.path.join(expected_path, "reassigned.vtb")
+
+    matrix = virtool.pathoscope.build_matrix_vtb(vtb_path, 0.01)
+    best_hit_initial = virtool.pathoscope.compute_best_hit_matrix(matrix)
+    init_pi, pi, _, _ = virtool.pathoscope.em_matrix(matrix, 50, 1e-7, 0, 0)
+    best_hit_final = virtool.pathoscope.compute_best_hit_matrix(matrix)
+
+    virtool.pathoscope.rewrite_align_vtb(matrix, vtb_path, 0.01, reassigned_path)
+
+    fused = virtool.pathoscope.run_fused(
+        virtool.vtb.ensure_vtb(actual_path, "to_isolates"),
+        host_scores,
+        ref_lengths
+    )
+
+    assert fused["subtracted_count"] == subtracted_count == 4
+    assert fused["refs"] == matrix["refs"]
+    assert fused["read_count"] == matrix["read_count"]
+    assert fused["init_pi"] == init_pi
+    assert fused["pi"] == pi
+
+    assert (
+        fused["best_hit_initial_reads"],
+        fused["best_hit_initial"],
+        fused["level_1_initial"],
+        fused["level_2_initial"]
+    ) == best_hit_initial
+
+    assert (
+        fused["best_hit_final_reads"],
+        fused["best_hit_final"],
+        fused["level_1_final"],
+        fused["level_2_final"]
+    ) == best_hit_final
+
+    expected_coverage = virtool.pathoscope.calculate_coverage_vtb(reassigned_path, ref_lengths)
+
+    assert fused["coverage"].keys() == expected_coverage.keys()
+
+    for ref_id, coverage in expected_coverage.items():
+        assert fused["coverage"][ref_id].tolist() == coverage.tolist()
+
+    row_size = sum(np.dtype(dtype).itemsize for dtype in virtool.vtb.COLUMNS.values())
 
+    assert fused["estimated_bytes"] == {
+        "read": len(virtool.vtb.read_columns(os.path.join(actual_path, "to_isolates.vtb"))["read"]) * row_size,
+        "written": 0
+    }
@@ -0,0 +1,119 @@
+import filecmp
+import os
+import sys
+
+import virtool.vtb
+
+VTA_PATH = os.path.join(sys.path[0], "tests", "test_files", "pathoscope", "test.vta")
+
+
+def test_writer(tmpdir):
+    path = os.path.join(str(tmpdir), "test.vtb")
+
+    with virtool.vtb.Writer(path) as writer:
+        writer.write("foo", "NC_001836", 12, 100, 187.0)
+        writer.write("bar", "NC_001836", 5, 98, 150.5)
+        writer.write("foo", "KX109927", 40, 100, 160.0)
+
+    assert virtool.vtb.read_meta(path) == {
+        "version": 1,
+        "count": 3,
+        "reads": 2,
+        "refs": 2
+    }
+
+    columns = virtool.vtb.read_columns(path)
+
+    assert columns["read"].tolist() == [0, 1, 0]
+    assert columns["ref"].tolist() == [0, 0, 1]
+    assert columns["pos"].tolist() == [12, 5, 40]
+    assert columns["length"].tolist() == [100, 98, 100]
+    assert columns["score"].tolist() == [187.0, 150.5, 160.0]
+
+    assert virtool.vtb.read_ids(path, "reads") == ["foo", "bar"]
+    assert virtool.vtb.read_ids(path, "refs") == ["NC_001836", "KX109927"]
+
+
+def test_write_batch(tmpdir):
+    """
+    Test that writing a batch gives the same VTB as writing its alignments one at a time.
+
+    """
+    expected_path = os.path.join(str(tmpdir), "expected.vtb")
+    actual_path = os.path.join(str(tmpdir), "actual.vtb")
+
+    alignments = [
+        ("foo", "NC_001836", 12, 100, 187.0),
+        ("bar", "NC_001836", 5, 98, 150.5),
+        ("foo", "KX109927", 40, 100, 160.0)
+    ]
+
+    with virtool.vtb.Writer(expected_path) as writer:
+        for alignment in alignments:
+            writer.write(*alignment)
+
+    with virtool.vtb.Writer(actual_path) as writer:
+        writer.write_batch(*(list(column) for column in zip(*alignments[:2])))
+        writer.write_batch(*(list(column) for column in zip(*alignments[2:])))
+
+    assert virtool.vtb.read_meta(actual_path) == virtool.vtb.read_meta(expected_path)
+
+    for name in os.listdir(expected_path):
+        assert filecmp.cmp(os.path.join(expected_path, name), os.path.join(actual_path, name), shallow=False)
+
+
+def test_empty(tmpdir):
+    path = os.path.join(str(tmpdir), "test.vtb")
+
+    with virtool.vtb.Writer(path):
+        pass
+
+    columns = virtool.vtb.read_columns(path)
+
+    assert all(len(column) == 0 for column in columns.values())
+
+
+def test_convert_vta(tmpdir):
+    """
+    Test that a legacy VTA file survives conversion to a VTB and back.
+
+    """
+    path = os.path.join(str(tmpdir), "test.vtb")
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    virtool.vtb.convert_vta(VTA_PATH, path)
+    virtool.vtb.write_vta(path, vta_path)
+
+    assert filecmp.cmp(VTA_PATH, vta_path, shallow=False)
+
+
+def test_write_subset(tmpdir):
+    path = os.path.join(str(tmpdir), "test.vtb")
+    target = os.path.join(str(tmpdir), "subset.vtb")
+
+    virtool.vtb.convert_vta(VTA_PATH, path)
+
+    columns = virtool.vtb.read_columns(path)
+
+    mask = columns["score"] > 150
+
+    virtool.vtb.write_subset(path, target, mask)
+
+    subset = virtool.vtb.read_columns(target)
+
+    for name, column in columns.items():
+        assert subset[name].tolist() == column[mask].tolist()
+
+    assert virtool.vtb.read_ids(target, "reads") == virtool.vtb.read_ids(path, "reads")
+
+
+def test_ensure_vtb(tmpdir):
+    analysis_path = str(tmpdir)
+
+    with open(VTA_PATH, "r") as src, open(os.path.join(analysis_path, "to_isolates.vta"), "w") as dst:
+        dst.write(src.read())
+
+    path = virtool.vtb.ensure_vtb(analysis_path, "to_isolates")
+
+    assert path == os.path.join(analysis_path, "to_isolates.vtb")
+    assert virtool.vtb.read_meta(path)["count"] == sum(1 for _ in open(VTA_PATH))
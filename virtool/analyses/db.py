@@ -1,6 +1,8 @@
 import asyncio
 import os
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
+
+import pymongo.errors
 
 import virtool.analyses.utils
 import virtool.bio
@@ -99,6 +101,13 @@ async def new(app, sample_id, ref_id, subtraction_id, user_id, workflow):
     Creates a new analysis. Ensures that a valid subtraction host was the submitted. Configures read and write
     permissions on the sample document and assigns it a creator username based on the requesting connection.
 
+    Identical analyses are not run twice. Analyses are identical if they have the same sample, index, subtraction,
+    workflow and result parameters from :func:`get_result_parameters`. If an analysis with the same fingerprint has
+    finished, its results are copied to the new analysis. Otherwise, the new analysis tries to claim its fingerprint by
+    being inserted as the only unfinished analysis with that fingerprint that is not ``attached``. This is enforced by
+    a unique partial index, so only one of several identical requests made at the same time wins the claim and starts
+    a job. The others are attached to its job with :func:`attach`.
+
     """
     db = app["db"]
     settings = app["settings"]
@@ -110,17 +119,23 @@ async def new(app, sample_id, ref_id, subtraction_id, user_id, workflow):
 
     analysis_id = await virtool.db.utils.get_new_id(db.analyses)
 
-    job_id = await virtool.db.utils.get_new_id(db.jobs)
-
     created_at = virtool.utils.timestamp()
 
+    fingerprint = virtool.analyses.utils.get_fingerprint(
+        sample_id,
+        index_id,
+        subtraction_id,
+        workflow,
+        await get_result_parameters(db, settings, workflow)
+    )
+
     document = {
         "_id": analysis_id,
         "ready": False,
         "created_at": created_at,
         "updated_at": created_at,
         "job": {
-            "id": job_id
+            "id": None
         },
         "workflow": workflow,
         "sample": {
@@ -139,9 +154,41 @@ async def new(app, sample_id, ref_id, subtraction_id, user_id, workflow):
         },
         "user": {
             "id": user_id,
-        }
+        },
+        "fingerprint": fingerprint,
+        "attached": False
     }
 
+    finished = await db.analyses.find_one({"fingerprint": fingerprint, "ready": True}, sort=[("created_at", -1)])
+
+    if finished:
+        document = await copy_results(app, finished, {**document, "attached": True})
+        await virtool.samples.db.recalculate_workflow_tags(db, sample_id)
+        return document
+
+    while True:
+        job_id = await virtool.db.utils.get_new_id(db.jobs)
+
+        document["job"]["id"] = job_id
+
+        try:
+            await db.analyses.insert_one(document)
+            break
+        except pymongo.errors.DuplicateKeyError:
+            pass
+
+        owner = await find_owner(db, fingerprint)
+
+        # The owner finished or failed since the claim was attempted.
+        if owner is None:
+            continue
+
+        attached = await attach(app, document, owner)
+
+        if attached:
+            await virtool.samples.db.recalculate_workflow_tags(db, sample_id)
+            return attached
+
     task_args = {
         "analysis_id": analysis_id,
         "ref_id": ref_id,
@@ -150,15 +197,14 @@ async def new(app, sample_id, ref_id, subtraction_id, user_id, workflow):
         "index_id": index_id
     }
 
-    await db.analyses.insert_one(document)
-
     # Create job document.
     job = await virtool.jobs.db.create(
         db,
         settings,
         document["workflow"],
         task_args,
-        user_id
+        user_id,
+        job_id=job_id
     )
 
     await app["jobs"].enqueue(job["_id"])
@@ -168,6 +214,116 @@ async def new(app, sample_id, ref_id, subtraction_id, user_id, workflow):
     return document
 
 
+async def get_result_parameters(db, settings: dict, workflow: str) -> dict:
+    """
+    Get the values other than the sample, index and subtraction that change the results of ``workflow``. These are the
+    settings in :data:`virtool.analyses.utils.RESULT_SETTINGS` and, for NuVs, the installed HMM release.
+
+    :param db: the application database object
+    :param settings: the application settings
+    :param workflow: the name of the workflow
+    :return: the parameters for :func:`virtool.analyses.utils.get_fingerprint`
+
+    """
+    parameters = {key: settings.get(key) for key in virtool.analyses.utils.RESULT_SETTINGS.get(workflow, ())}
+
+    if workflow == "nuvs":
+        installed = await virtool.db.utils.get_one_field(db.status, "installed", "hmm")
+        parameters["hmm"] = installed.get("id") if installed else None
+
+    return parameters
+
+
+async def find_owner(db, fingerprint: str) -> Optional[dict]:
+    """
+    Find the unfinished analysis that holds the claim on ``fingerprint``. Its job produces the results for every
+    analysis attached to it.
+
+    :param db: the application database object
+    :param fingerprint: the fingerprint from :func:`virtool.analyses.utils.get_fingerprint`
+    :return: the analysis document with only its ``job`` field or ``None``
+
+    """
+    return await db.analyses.find_one({"fingerprint": fingerprint, "ready": False, "attached": False}, ["job"])
+
+
+async def attach(app, document: dict, owner: dict) -> Optional[dict]:
+    """
+    Insert the analysis ``document`` attached to the job of the identical analysis ``owner``. The job copies its
+    results to attached analyses when it completes.
+
+    The owner is checked again after the insert. If it has finished, the job may have copied its results before the
+    analysis was inserted, so they are copied here. If it is gone, its job failed or was cancelled. The analysis is
+    removed again so it can claim the fingerprint itself, unless the job already handed it to another job. See
+    :meth:`virtool.jobs.analysis.Job.hand_off`.
+
+    :param app: the application object
+    :param document: the new analysis document
+    :param owner: the analysis holding the claim on the fingerprint
+    :return: the attached analysis document or ``None`` if the owner is gone
+
+    """
+    db = app["db"]
+
+    document = {
+        **document,
+        "attached": True,
+        "job": {
+            "id": owner["job"]["id"]
+        }
+    }
+
+    await db.analyses.insert_one(document)
+
+    owner = await db.analyses.find_one(owner["_id"])
+
+    if owner is None:
+        result = await db.analyses.delete_one({"_id": document["_id"], "job.id": document["job"]["id"]})
+
+        # The failed job handed the analysis to another job before it could be removed.
+        if not result.deleted_count:
+            return await db.analyses.find_one(document["_id"])
+
+        return None
+
+    if owner["ready"]:
+        return await copy_results(app, owner, document)
+
+    return document
+
+
+async def copy_results(app, source: dict, document: dict) -> dict:
+    """
+    Make the analysis ``document`` a finished copy of the identical analysis ``source``. The result files of the source
+    are linked into the analysis directory and the document is inserted or updated.
+
+    :param app: the application object
+    :param source: the finished analysis document
+    :param document: the new analysis document
+    :return: the finished analysis document without its results
+
+    """
+    data_path = app["settings"]["data_path"]
+    sample_id = document["sample"]["id"]
+
+    await app["run_in_thread"](
+        virtool.analyses.utils.copy_analysis_files,
+        virtool.analyses.utils.join_analysis_path(data_path, source["_id"], sample_id),
+        virtool.analyses.utils.join_analysis_path(data_path, document["_id"], sample_id)
+    )
+
+    fields = {
+        **document,
+        **virtool.analyses.utils.get_result_fields(source)
+    }
+
+    del fields["_id"]
+
+    await app["db"].analyses.update_one({"_id": document["_id"]}, {"$set": fields}, upsert=True)
+
+    return virtool.db.utils.apply_projection({"_id": document["_id"], **fields}, PROJECTION)
+
+
 async def update_nuvs_blast(
         db,
         settings: dict,
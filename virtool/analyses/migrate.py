@@ -11,6 +11,7 @@ import virtool.analyses.utils
 import virtool.api.utils
 import virtool.db.core
 import virtool.db.migrate
+import virtool.jobs.db
 
 RE_JSON_FILENAME = re.compile("(pathoscope.json|nuvs.json)$")
 
@@ -34,7 +35,7 @@ async def migrate_analyses(app):
     await rename_analysis_json_files(settings)
     await add_subtractions_to_analyses(db)
     await add_updated_at(db)
-    await virtool.db.migrate.delete_unready(db.analyses)
+    await virtool.db.migrate.delete_unready(db.analyses, await virtool.jobs.db.get_waiting_and_running_ids(db))
 
 
 async def add_subtractions_to_analyses(db):
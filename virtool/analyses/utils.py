@@ -1,4 +1,7 @@
+import hashlib
+import json
 import os
+import shutil
 from typing import Union
 
 import visvalingamwyatt as vw
@@ -9,6 +12,29 @@ WORKFLOW_NAMES = (
     "pathoscope_bowtie"
 )
 
+#: Fields that identify an analysis rather than describe its results. They are not copied between analyses.
+IDENTITY_FIELDS = (
+    "_id",
+    "attached",
+    "created_at",
+    "job",
+    "updated_at",
+    "user"
+)
+
+#: Settings that change the results of each workflow. Their values are part of the fingerprint of an analysis.
+RESULT_SETTINGS = {
+    "pathoscope_bowtie": (
+        "pathoscope_accelerate_em",
+    )
+}
+
+#: The files in an analysis directory that are read after the analysis has finished. Results that are too large to
+#: store in the analysis document are written to ``results.json``.
+RESULT_FILES = (
+    "results.json",
+)
+
 
 def transform_coverage_to_coordinates(coverage_list: list) -> list:
     """
@@ -87,3 +113,56 @@ def join_analysis_json_path(data_path, analysis_id, sample_id):
         join_analysis_path(data_path, analysis_id, sample_id),
         "results.json"
     )
+
+
+def get_fingerprint(sample_id: str, index_id: str, subtraction_id: str, workflow: str, parameters: dict) -> str:
+    """
+    Get a fingerprint for the parameters of an analysis. Analyses with the same fingerprint produce the same results.
+
+    :param sample_id: the id of the sample being analyzed
+    :param index_id: the id of the index the sample is analyzed against
+    :param subtraction_id: the id of the subtraction
+    :param workflow: the name of the workflow
+    :param parameters: other values that change the results of the workflow, such as :data:`RESULT_SETTINGS`
+    :return: a hex digest
+
+    """
+    parameters = json.dumps([sample_id, index_id, subtraction_id, workflow, parameters], sort_keys=True)
+    return hashlib.sha256(parameters.encode()).hexdigest()
+
+
+def get_result_fields(document: dict) -> dict:
+    """
+    Get the fields of a finished analysis document that can be copied to an identical analysis.
+
+    :param document: the finished analysis document
+    :return: the fields to copy
+
+    """
+    return {key: value for key, value in document.items() if key not in IDENTITY_FIELDS}
+
+
+def copy_analysis_files(src: str, dest: str):
+    """
+    Give an identical analysis the files of a finished analysis. Only the files in :data:`RESULT_FILES` are needed.
+    Intermediate files, such as reads and alignments, are not.
+
+    Files are hard-linked where possible and copied otherwise. Files that already exist in ``dest`` are kept.
+
+    :param src: the path of the finished analysis directory
+    :param dest: the path of the directory to copy to
+
+    """
+    os.makedirs(dest, exist_ok=True)
+
+    for name in RESULT_FILES:
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+
+        if not os.path.isfile(src_path) or os.path.exists(dest_path):
+            continue
+
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            shutil.copyfile(src_path, dest_path)
@@ -27,6 +27,7 @@ import virtool.http.errors
 import virtool.http.proxy
 import virtool.http.query
 import virtool.jobs.manager
+import virtool.jobs.runner
 import virtool.logs
 import virtool.references.db
 import virtool.resources
@@ -234,6 +235,16 @@ async def init_check_db(app):
     logger.info("Creating database indexes...")
     await db.analyses.create_index("sample.id")
     await db.analyses.create_index([("created_at", -1)])
+    await db.analyses.create_index([("fingerprint", 1), ("created_at", -1)])
+
+    # Only one unfinished analysis with a given fingerprint can run its own job. See virtool.analyses.db.new.
+    await db.analyses.create_index(
+        "fingerprint",
+        name="fingerprint_claim",
+        unique=True,
+        partialFilterExpression={"ready": False, "attached": False}
+    )
+
     await db.history.create_index("otu.id")
     await db.history.create_index("index.id")
     await db.history.create_index("created_at")
@@ -297,7 +308,10 @@ async def init_job_manager(app):
     if "sentry" in app:
         capture_exception = app["sentry"].captureException
 
-    app["jobs"] = virtool.jobs.manager.IntegratedManager(app, capture_exception)
+    if app["settings"]["job_runners"]:
+        app["jobs"] = virtool.jobs.runner.RemoteManager(app)
+    else:
+        app["jobs"] = virtool.jobs.manager.IntegratedManager(app, capture_exception)
 
     scheduler = aiojobs.aiohttp.get_scheduler_from_app(app)
 
@@ -541,9 +555,7 @@ async def create_app_runner(app: web.Application, host: str, port: int) -> web.A
     return runner
 
 
-async def run():
-    config = virtool.config.resolve()
-
+async def run(config: dict):
     virtool.logs.configure(config["dev"])
 
     app = create_app(config)
@@ -69,6 +69,37 @@ SCHEMA = {
         "default": 4
     },
 
+    # The number of pre-forked worker processes for small jobs. Zero starts a new process for each job.
+    "job_workers": {
+        "type": "integer",
+        "coerce": int,
+        "default": 0,
+        "min": 0
+    },
+
+    # The order in which waiting jobs are started: in the order they were created (fifo), by task priority, or by fair
+    # share between users (fair). Fair sharing is configured in the application settings.
+    "job_policy": {
+        "type": "string",
+        "allowed": ["fair", "fifo", "priority"],
+        "default": "fair"
+    },
+
+    # The number of seconds a job that does not fit in the available resources can be overtaken by jobs that do.
+    "job_backfill_wait": {
+        "type": "integer",
+        "coerce": int,
+        "default": 600,
+        "min": 0
+    },
+
+    # Leave jobs to standalone runners started with the runner command instead of running them in the server.
+    "job_runners": {
+        "type": "boolean",
+        "coerce": virtool.utils.to_bool,
+        "default": False
+    },
+
     # MongoDB
     "db_connection_string": {
         "type": "string",
@@ -131,6 +162,14 @@ def get_defaults():
 def get_from_args():
     parser = argparse.ArgumentParser()
 
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["server", "runner"],
+        default="server",
+        help="run the API server or a standalone job runner"
+    )
+
     parser.add_argument(
         "-H", "--host",
         dest="host",
@@ -221,6 +260,38 @@ def get_from_args():
         metavar="MEM"
     )
 
+    parser.add_argument(
+        "--job-workers",
+        dest="job_workers",
+        default=None,
+        help="the number of pre-forked worker processes for small jobs",
+        metavar="WORKERS"
+    )
+
+    parser.add_argument(
+        "--job-policy",
+        dest="job_policy",
+        default=None,
+        help="the order in which waiting jobs are started (fair, fifo or priority)",
+        metavar="POLICY"
+    )
+
+    parser.add_argument(
+        "--job-backfill-wait",
+        dest="job_backfill_wait",
+        default=None,
+        help="the number of seconds a blocked job can be overtaken by jobs that fit",
+        metavar="SECONDS"
+    )
+
+    parser.add_argument(
+        "--job-runners",
+        action="store_true",
+        dest="job_runners",
+        default=None,
+        help="leave jobs to standalone runners"
+    )
+
     parser.add_argument(
         "--no-client",
         action="store_true",
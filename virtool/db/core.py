@@ -298,6 +298,16 @@ class DB:
             processor=virtool.jobs.db.processor
         )
 
+        self.job_leases = self.bind_collection(
+            "job_leases",
+            silent=True
+        )
+
+        self.job_messages = self.bind_collection(
+            "job_messages",
+            silent=True
+        )
+
         self.keys = self.bind_collection(
             "keys",
             silent=True
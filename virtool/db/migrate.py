@@ -17,8 +17,16 @@ import virtool.utils
 logger = logging.getLogger(__name__)
 
 
-async def delete_unready(collection):
-    await collection.delete_many({"ready": False})
+async def delete_unready(collection, keep_job_ids=()):
+    """
+    Delete unready documents from ``collection``. Documents created by the jobs in ``keep_job_ids`` are kept, so jobs
+    that are recovered by the job manager can still complete them.
+
+    :param collection: the collection to delete unready documents from
+    :param keep_job_ids: the IDs of jobs whose documents should be kept
+
+    """
+    await collection.delete_many({"ready": False, "job.id": {"$nin": list(keep_job_ids)}})
 
 
 async def migrate(app):
@@ -77,8 +85,12 @@ async def migrate_groups(db):
 
 
 async def migrate_jobs(db):
+    """
+    Jobs that were waiting or running when the server stopped are no longer deleted here. They are recovered by the job
+    manager when it starts. See :meth:`virtool.jobs.manager.IntegratedManager.recover`.
+
+    """
     logger.info(" • jobs")
-    await virtool.jobs.db.delete_zombies(db)
 
 
 async def migrate_sessions(db):
@@ -5,9 +5,11 @@ import shutil
 
 import pymongo.errors
 
+import virtool.analyses.utils
 import virtool.caches.db
 import virtool.db
 import virtool.db.sync
+import virtool.jobs.db
 import virtool.jobs.fastqc
 import virtool.jobs.job
 import virtool.jobs.utils
@@ -31,6 +33,8 @@ class Job(virtool.jobs.job.Job):
     - constructing paths used by all subclasses
 
     """
+    memory_limited = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -100,6 +104,9 @@ class Job(virtool.jobs.job.Job):
 
         self.params["read_paths"] = read_paths
 
+    def get_checkpoint_roots(self) -> list:
+        return [self.params["analysis_path"]]
+
     def make_analysis_dir(self):
         """
         Make a directory for the analysis in the sample/analysis directory.
@@ -140,6 +147,117 @@ class Job(virtool.jobs.job.Job):
 
         return self._create_cache(parameters)
 
+    def share_results(self) -> list:
+        """
+        Copy the results of the analysis to the identical analyses that were attached to the job while it was waiting
+        or running. See :func:`virtool.analyses.db.new`.
+
+        :return: the ids of the attached analyses
+
+        """
+        analysis_id = self.params["analysis_id"]
+        sample_id = self.params["sample_id"]
+
+        attached = self.db.analyses.find({
+            "_id": {"$ne": analysis_id},
+            "job.id": self.id,
+            "ready": False
+        }, ["_id"])
+
+        attached_ids = [document["_id"] for document in attached]
+
+        if not attached_ids:
+            return attached_ids
+
+        fields = virtool.analyses.utils.get_result_fields(self.db.analyses.find_one(analysis_id))
+
+        for attached_id in attached_ids:
+            virtool.analyses.utils.copy_analysis_files(
+                self.params["analysis_path"],
+                virtool.analyses.utils.join_analysis_path(self.settings["data_path"], attached_id, sample_id)
+            )
+
+            self.db.analyses.update_one({"_id": attached_id}, {"$set": fields})
+
+        return attached_ids
+
+    def hand_off(self):
+        """
+        Hand the identical analyses attached to the job to another job when the job fails. They belong to other
+        requests, so they are never removed with the analysis of the job.
+
+        The oldest attached analysis claims the fingerprint and a new job is created for it. The other attached
+        analyses are attached to the new job. If another analysis claimed the fingerprint after the analysis of this job
+        was removed, all of them are attached to its job instead. See :func:`virtool.analyses.db.new`.
+
+        """
+        attached = list(self.db.analyses.find(
+            {"job.id": self.id, "ready": False},
+            ["fingerprint", "user"],
+            sort=[("created_at", 1)]
+        ))
+
+        if not attached:
+            return
+
+        ids = [document["_id"] for document in attached]
+
+        features = self.db.jobs.find_one(self.id, ["features"]).get("features")
+
+        while attached:
+            oldest = attached[0]
+
+            job_id = virtool.utils.random_alphanumeric(8, excluded=self.db.jobs.distinct("_id"))
+
+            try:
+                result = self.db.analyses.update_one({"_id": oldest["_id"], "job.id": self.id}, {
+                    "$set": {
+                        "attached": False,
+                        "job.id": job_id
+                    }
+                })
+            except pymongo.errors.DuplicateKeyError:
+                owner = self.db.analyses.find_one({
+                    "fingerprint": oldest["fingerprint"],
+                    "ready": False,
+                    "attached": False
+                }, ["job"])
+
+                if owner is None:
+                    continue
+
+                job_id = owner["job"]["id"]
+                break
+
+            # The analysis was removed after it was found.
+            if not result.matched_count:
+                attached.pop(0)
+                continue
+
+            self.db.jobs.insert_one(virtool.jobs.db.compose(
+                self.task_name,
+                {**self.task_args, "analysis_id": oldest["_id"]},
+                self.proc,
+                self.mem,
+                oldest["user"]["id"],
+                features,
+                job_id
+            ))
+
+            self.dispatch("jobs", "insert", [job_id])
+            break
+
+        if not attached:
+            return
+
+        self.db.analyses.update_many({"job.id": self.id, "ready": False}, {
+            "$set": {
+                "job.id": job_id
+            }
+        })
+
+        self.dispatch("analyses", "update", ids)
+
     def cleanup(self):
         cache_id = self.intermediate.get("cache_id")
 
@@ -156,6 +274,8 @@ class Job(virtool.jobs.job.Job):
 
         self.db.analyses.delete_one({"_id": self.params["analysis_id"]})
 
+        self.hand_off()
+
         try:
             shutil.rmtree(self.params["analysis_path"], ignore_errors=True)
         except FileNotFoundError:
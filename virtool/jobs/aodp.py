@@ -29,6 +29,16 @@ class Job(virtool.jobs.analysis.Job):
             self.import_results
         ]
 
+        # The reference and reads are prepared independently.
+        self._stage_dependencies = {
+            "prepare_index": ["make_analysis_dir"],
+            "prepare_reads": ["make_analysis_dir"],
+            "join_reads": ["prepare_reads"],
+            "deduplicate_reads": ["join_reads"],
+            "aodp": ["prepare_index", "deduplicate_reads"],
+            "import_results": ["aodp"]
+        }
+
         self.results = dict()
 
     def check_db(self):
@@ -45,6 +55,13 @@ class Job(virtool.jobs.analysis.Job):
             "ref.fa"
         )
 
+    def get_stage_proc(self, name: str) -> int:
+        # Copying the index only waits on I/O, so it can run alongside read preparation.
+        if name == "prepare_index":
+            return 0
+
+        return self.proc
+
     def prepare_index(self):
         shutil.copy(
             self.params["index_path"],
@@ -59,7 +76,7 @@ class Job(virtool.jobs.analysis.Job):
             "flash",
             "--max-overlap", str(max_overlap),
             "-o", output_prefix,
-            "-t", str(self.proc - 1),
+            "-t", str(self.get_tool_threads()),
             *self.params["read_paths"]
         ]
 
@@ -175,7 +192,9 @@ class Job(virtool.jobs.analysis.Job):
             }
         })
 
-        self.dispatch("analyses", "update", [analysis_id])
+        attached_ids = self.share_results()
+
+        self.dispatch("analyses", "update", [analysis_id, *attached_ids])
         self.dispatch("samples", "update", [sample_id])
 
 
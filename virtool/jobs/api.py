@@ -1,20 +1,51 @@
-import os
+from cerberus import Validator
 
 import virtool.api.utils
 import virtool.http.routes
 import virtool.jobs.db
+import virtool.jobs.log
 import virtool.resources
 import virtool.users.db
 import virtool.utils
-from virtool.api.response import conflict, json_response, no_content, not_found
+from virtool.api.response import conflict, invalid_query, json_response, no_content, not_found
 
 routes = virtool.http.routes.Routes()
 
+LOG_QUERY_SCHEMA = {
+    "offset": {
+        "type": "integer",
+        "coerce": int,
+        "default": 0,
+        "min": 0
+    }
+}
+
+
+def attach_queue(app, documents: list):
+    """
+    Add a ``queue`` field containing the queue position and estimated start time to each document for a waiting job.
+
+    :param app: the application object
+    :param documents: the job documents
+
+    """
+    manager = app.get("jobs")
+
+    if manager is None:
+        return
+
+    queue = manager.get_queue()
+
+    for document in documents:
+        if document["id"] in queue:
+            document["queue"] = queue[document["id"]]
+
 
 @routes.get("/api/jobs")
 async def find(req):
     """
-    Return a list of job documents.
+    Return a list of job documents. Waiting jobs have a ``queue`` field containing their position in the queue and an
+    estimated start time.
 
     """
     db = req.app["db"]
@@ -35,14 +66,30 @@ async def find(req):
 
     data["documents"].sort(key=lambda d: d["created_at"])
 
+    attach_queue(req.app, data["documents"])
+
     return json_response(data)
 
 
+@routes.get("/api/jobs/dispatch", admin=True)
+async def get_dispatch_metrics(req):
+    """
+    Get the depth and latency of the queue that carries dispatch messages from running jobs to the server.
+
+    """
+    return json_response(req.app["jobs"].channel.metrics)
+
+
 @routes.get("/api/jobs/{job_id}")
 async def get(req):
     """
     Return the complete document for a given job.
 
+    The ``resources`` field lists the wall time, CPU time, peak RSS and bytes read and written for each stage that has
+    run.
+
+    Waiting jobs have a ``queue`` field containing their position in the queue and an estimated start time.
+
     """
     job_id = req.match_info["job_id"]
 
@@ -51,7 +98,49 @@ async def get(req):
     if not document:
         return not_found()
 
-    return json_response(virtool.utils.base_processor(document))
+    document = virtool.utils.base_processor(document)
+
+    attach_queue(req.app, [document])
+
+    return json_response(document)
+
+
+@routes.get("/api/jobs/{job_id}/log")
+async def get_log(req):
+    """
+    Return the lines written to the log of a job starting at the byte ``offset`` given in the query.
+
+    Up to :data:`virtool.jobs.log.READ_SIZE` bytes of complete lines are returned. The ``offset`` in the response
+    should be passed in the next request to get only the lines written since. This allows the log of a running job to
+    be tailed without reading the whole file again.
+
+    """
+    db = req.app["db"]
+
+    job_id = req.match_info["job_id"]
+
+    v = Validator(LOG_QUERY_SCHEMA, allow_unknown=True)
+
+    if not v.validate(dict(req.query)):
+        return invalid_query(v.errors)
+
+    offset = v.document["offset"]
+
+    if not await db.jobs.count_documents({"_id": job_id}):
+        return not_found()
+
+    path = virtool.jobs.log.find_log_path(req.app["settings"]["data_path"], job_id)
+
+    if path:
+        log, offset = await req.app["run_in_thread"](virtool.jobs.log.read, path, offset)
+    else:
+        log = ""
+
+    return json_response({
+        "id": job_id,
+        "log": log,
+        "offset": offset
+    })
 
 
 @routes.put("/api/jobs/{job_id}/cancel", permission="cancel_job")
@@ -119,12 +208,13 @@ async def remove(req):
     # Removed the documents associated with the job ids from the database.
     await db.jobs.delete_one({"_id": job_id})
 
-    try:
-        # Calculate the log path and remove the log file. If it exists, return True.
-        path = os.path.join(req.app["settings"]["data_path"], "logs", "jobs", job_id + ".log")
-        await req.app["run_in_thread"](virtool.utils.rm, path)
-    except OSError:
-        pass
+    path = virtool.jobs.log.find_log_path(req.app["settings"]["data_path"], job_id)
+
+    if path:
+        try:
+            await req.app["run_in_thread"](virtool.utils.rm, path)
+        except OSError:
+            pass
 
     return no_content()
 
@@ -0,0 +1,121 @@
+"""
+Carrying dispatch messages from job processes to the API server.
+
+Jobs put messages on a shared :class:`multiprocessing.Queue` with :func:`send`. Each message names an interface, an
+operation and a list of document IDs. The job manager calls :meth:`Channel.drain` once per tick to take every waiting
+message off the queue at once.
+
+Jobs often update the same documents many times in quick succession. Drained messages are merged so that each ID is only
+dispatched once per interface and operation, no matter how many messages mention it.
+
+"""
+import queue
+import time
+
+#: The metrics reported for a new :class:`Channel`.
+EMPTY_METRICS = {
+    "depth": 0,
+    "max_depth": 0,
+    "messages": 0,
+    "ids": 0,
+    "latency": 0,
+    "max_latency": 0
+}
+
+
+def send(q, interface: str, operation: str, id_list: list):
+    """
+    Put a dispatch message on the queue ``q``. The time the message was sent is included for measuring latency.
+
+    :param q: the dispatch queue
+    :param interface: the interface (ie. database collection) the message applies to
+    :param operation: the operation to perform on the interface
+    :param id_list: a list of ids whose documents should be dispatched
+
+    """
+    q.put((interface, operation, id_list, time.time()))
+
+
+def coalesce(messages: list) -> dict:
+    """
+    Merge the ID lists of ``messages`` that share an interface and operation. The order in which interfaces, operations
+    and IDs were first seen is kept.
+
+    :param messages: a list of dispatch messages
+    :return: a dict of ``(interface, operation)`` keys and lists of unique IDs
+
+    """
+    groups = dict()
+
+    for interface, operation, id_list, *_ in messages:
+        groups.setdefault((interface, operation), dict()).update(dict.fromkeys(id_list))
+
+    return {key: list(ids) for key, ids in groups.items()}
+
+
+class Channel:
+    """
+    The receiving end of the dispatch queue used by jobs.
+
+    :param q: the queue jobs put dispatch messages on or ``None`` if messages are passed to :meth:`.receive`
+
+    """
+
+    def __init__(self, q):
+        self.q = q
+
+        #: Queue depth and latency measured over the lifetime of the channel. ``depth`` and ``latency`` describe the
+        #: last tick in which messages were received. Latencies are in seconds.
+        self.metrics = dict(EMPTY_METRICS)
+
+    def drain(self) -> dict:
+        """
+        Take all waiting messages off the queue and merge them with :func:`coalesce`.
+
+        :return: a dict of ``(interface, operation)`` keys and lists of unique IDs
+
+        """
+        messages = list()
+
+        while True:
+            try:
+                messages.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+
+        return self.receive(messages)
+
+    def receive(self, messages: list) -> dict:
+        """
+        Merge ``messages`` with :func:`coalesce` and update :attr:`.metrics`. Used by :meth:`.drain` and for messages
+        that arrive by other means, such as from standalone job runners.
+
+        :param messages: a list of dispatch messages
+        :return: a dict of ``(interface, operation)`` keys and lists of unique IDs
+
+        """
+        if not messages:
+            return dict()
+
+        groups = coalesce(messages)
+
+        self.update_metrics(messages, groups)
+
+        return groups
+
+    def update_metrics(self, messages: list, groups: dict):
+        now = time.time()
+
+        # Messages put on the queue by older code do not include the time they were sent.
+        latencies = [now - message[3] for message in messages if len(message) > 3]
+
+        metrics = self.metrics
+
+        metrics["depth"] = len(messages)
+        metrics["max_depth"] = max(metrics["max_depth"], len(messages))
+        metrics["messages"] += len(messages)
+        metrics["ids"] += sum(len(id_list) for id_list in groups.values())
+
+        if latencies:
+            metrics["latency"] = max(latencies)
+            metrics["max_latency"] = max(metrics["max_latency"], metrics["latency"])
@@ -23,9 +23,19 @@ class Job(virtool.jobs.job.Job):
             self.unpack,
             self.set_stats,
             self.bowtie_build,
-            self.compress
+            self.compress,
+            self.remove_fasta
         ]
 
+        # Stats, the Bowtie2 index, and the compressed FASTA are all derived from the unpacked FASTA file.
+        self._stage_dependencies = {
+            "unpack": ["make_subtraction_dir"],
+            "set_stats": ["unpack"],
+            "bowtie_build": ["unpack"],
+            "compress": ["unpack"],
+            "remove_fasta": ["set_stats", "bowtie_build", "compress"]
+        }
+
     def check_db(self):
         self.params = dict(self.task_args)
 
@@ -57,6 +67,19 @@ class Job(virtool.jobs.job.Job):
             )
         })
 
+    def get_stage_proc(self, name: str) -> int:
+        """
+        Leave a core free while building the Bowtie2 index so the FASTA file can be compressed at the same time.
+
+        """
+        if name in ("set_stats", "compress"):
+            return 1
+
+        if name == "bowtie_build":
+            return max(self.proc - 1, 1)
+
+        return self.proc
+
     def make_subtraction_dir(self):
         """
         Make a directory for the host index files at ``<vt_data_path>/reference/hosts/<host_id>``.
@@ -100,7 +123,7 @@ class Job(virtool.jobs.job.Job):
         command = [
             "bowtie2-build",
             "-f",
-            "--threads", str(self.proc),
+            "--threads", str(self.get_stage_proc("bowtie_build")),
             self.params["fasta_path"],
             self.params["index_path"]
         ]
@@ -117,15 +140,20 @@ class Job(virtool.jobs.job.Job):
 
     def compress(self):
         """
-        Compress the subtraction FASTA file for long-term storage and download. Remove the uncompressed file afterwards.
+        Compress the subtraction FASTA file for long-term storage and download.
 
         """
         virtool.utils.compress_file(
             self.params["fasta_path"],
             self.params["fasta_path"] + ".gz",
-            self.proc
+            self.get_stage_proc("compress")
         )
 
+    def remove_fasta(self):
+        """
+        Remove the uncompressed FASTA file once the stages that read it are complete.
+
+        """
         virtool.utils.rm(self.params["fasta_path"])
 
     def cleanup(self):
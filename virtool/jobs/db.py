@@ -2,6 +2,9 @@
 Globals and utility functions for interacting with the jobs collection in the application database.
 
 """
+from collections import defaultdict
+
+import virtool.jobs.estimate
 import virtool.jobs.manager
 import virtool.utils
 
@@ -66,8 +69,25 @@ async def clear(db, complete=False, failed=False):
 
 
 async def create(db, settings, task_name, task_args, user_id, job_id=None):
-    proc, mem = virtool.jobs.manager.get_task_limits(settings, task_name)
+    proc, mem, features = await virtool.jobs.estimate.estimate(db, settings, task_name, task_args)
+
+    return await db.jobs.insert_one(compose(task_name, task_args, proc, mem, user_id, features, job_id))
 
+
+def compose(task_name, task_args, proc, mem, user_id, features=None, job_id=None) -> dict:
+    """
+    Compose a new job document in the `waiting` state. Used by :func:`create` and by jobs that create jobs.
+
+    :param task_name: the name of the task
+    :param task_args: the arguments for the task
+    :param proc: the number of cores for the job
+    :param mem: the memory in GB for the job
+    :param user_id: the ID of the user the job belongs to
+    :param features: the job features from :func:`virtool.jobs.estimate.get_features`
+    :param job_id: an optional ID for the job
+    :return: the job document
+
+    """
     document = {
         "task": task_name,
         "args": task_args,
@@ -87,10 +107,37 @@ async def create(db, settings, task_name, task_args, user_id, job_id=None):
         ]
     }
 
+    if features:
+        document["features"] = features
+
     if job_id:
         document["_id"] = job_id
 
-    return await db.jobs.insert_one(document)
+    return document
+
+
+async def get_durations(db, limit: int = 200) -> dict:
+    """
+    Get the mean time between starting and completing recent jobs for each task.
+
+    :param db: the application database object
+    :param limit: the maximum number of completed jobs to consider
+    :return: a dict of task names and mean durations in seconds
+
+    """
+    durations = defaultdict(list)
+
+    cursor = db.jobs.find({"status.state": "complete"}, ["task", "status"]).sort("status.timestamp", -1).limit(limit)
+
+    async for document in cursor:
+        status = document["status"]
+
+        started_at = next((s["timestamp"] for s in status if s["state"] == "running"), None)
+
+        if started_at:
+            durations[document["task"]].append((status[-1]["timestamp"] - started_at).total_seconds())
+
+    return {task_name: sum(values) / len(values) for task_name, values in durations.items()}
 
 
 async def delete_zombies(db):
@@ -105,6 +152,38 @@ async def delete_zombies(db):
     })
 
 
+async def recover(db) -> list:
+    """
+    Find jobs that were waiting or running when the server stopped and put them back in the waiting state so they can
+    be enqueued again.
+
+    :param db: the application database object
+    :return: the IDs of the interrupted jobs
+
+    """
+    job_ids = await get_waiting_and_running_ids(db)
+
+    for job_id in job_ids:
+        document = await db.jobs.find_one(job_id, ["status"])
+
+        latest = document["status"][-1]
+
+        if latest["state"] == "running":
+            await db.jobs.update_one({"_id": job_id}, {
+                "$push": {
+                    "status": {
+                        "state": "waiting",
+                        "stage": latest["stage"],
+                        "error": None,
+                        "progress": latest["progress"],
+                        "timestamp": virtool.utils.timestamp()
+                    }
+                }
+            })
+
+    return job_ids
+
+
 async def get_waiting_and_running_ids(db):
     cursor = db.jobs.aggregate([
         {"$project": {
@@ -0,0 +1,246 @@
+"""
+Predicting the resources a job needs from the resources used by past jobs of the same task.
+
+Static limits from :func:`virtool.jobs.manager.get_task_limits` are used for jobs that don't work with sample data and
+until enough jobs of a task have completed. Otherwise:
+
+- Memory is modelled as a non-negative linear function of the number of sequenced bases in the sample and the size of
+  the reference index. The model is fitted to the recorded peak memory of recent jobs. Jobs that ran in a pooled worker
+  after another job have no recorded peak memory and are left out.
+- Cores are predicted from the most cores recent jobs kept busy. Jobs with a stage that kept nearly all of the threads
+  it was given busy could have used more, so they count as needing the static limit.
+
+Predictions never exceed the static limits.
+
+"""
+import asyncio
+import math
+import os
+from typing import Optional
+
+import numpy as np
+
+import virtool.jobs.manager
+
+#: The number of recently completed jobs used to make predictions.
+HISTORY_SIZE = 50
+
+#: The number of completed jobs of a task needed before predictions are made.
+MIN_HISTORY = 5
+
+#: Predicted memory is multiplied by this value.
+MEMORY_MARGIN = 1.25
+
+#: The fraction of the threads given to a stage a job must keep busy to count as needing the static limit.
+BUSY_THRESHOLD = 0.9
+
+#: The fewest cores predicted for tasks that leave a core for the job process while their tools run. See
+#: :meth:`virtool.jobs.job.Job.get_tool_threads`.
+MIN_PROC = {
+    "aodp": 2,
+    "nuvs": 2,
+    "pathoscope_bowtie": 2
+}
+
+GB = 1024 ** 3
+
+
+async def get_features(db, settings: dict, task_args: dict) -> Optional[dict]:
+    """
+    Get the properties of a job's input that its resource use depends on. Only jobs with a sample that has quality
+    data have features.
+
+    :param db: the application database object
+    :param settings: the application settings
+    :param task_args: the arguments for the job
+    :return: the number of reads, the maximum read length, and the reference index size in bytes
+
+    """
+    sample_id = task_args.get("sample_id")
+
+    if not sample_id:
+        return None
+
+    sample = await db.samples.find_one(sample_id, ["quality"])
+
+    quality = sample and sample.get("quality")
+
+    if not quality:
+        return None
+
+    loop = asyncio.get_event_loop()
+
+    # Index directories hold many files, so they are not scanned on the event loop.
+    ref_size = await loop.run_in_executor(
+        None,
+        get_index_size,
+        settings,
+        task_args.get("ref_id"),
+        task_args.get("index_id")
+    )
+
+    return {
+        "reads": quality["count"],
+        "read_length": quality["length"][1],
+        "ref_size": ref_size
+    }
+
+
+def get_index_size(settings: dict, ref_id: Optional[str], index_id: Optional[str]) -> int:
+    """
+    Get the combined size of the files in an index directory. Returns ``0`` if there is no index.
+
+    """
+    if not ref_id or not index_id:
+        return 0
+
+    try:
+        with os.scandir(os.path.join(settings["data_path"], "references", ref_id, index_id)) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+def get_peak_memory(resources: list) -> Optional[int]:
+    """
+    Get the peak memory used by a job in bytes from its ``resources`` entries. The job process and its largest
+    subprocess are assumed to have peaked at the same time.
+
+    Returns ``None`` if peak memory was not recorded. This is the case for jobs that ran after another job in the same
+    pooled worker process.
+
+    """
+    if any(entry.get("peak_rss") is None or entry.get("children_peak_rss") is None for entry in resources):
+        return None
+
+    return max(entry["peak_rss"] + entry["children_peak_rss"] for entry in resources)
+
+
+def get_needed_cores(document: dict, limit: int) -> float:
+    """
+    Get the most cores a job needed during any stage that ran for at least a second. A stage that kept nearly all of the
+    threads it was given busy could have used more, so the job counts as needing ``limit``. Stages recorded without a
+    thread count are compared with the cores of the job.
+
+    """
+    needed = 0
+
+    for entry in document["resources"]:
+        if entry["wall"] < 1:
+            continue
+
+        busy = (entry["cpu"] + entry["children_cpu"]) / entry["wall"]
+        threads = entry.get("threads", document["proc"])
+
+        if threads and busy >= BUSY_THRESHOLD * threads:
+            return limit
+
+        needed = max(needed, busy)
+
+    return needed
+
+
+def get_variables(features: dict) -> list:
+    return [1, features["reads"] * features["read_length"], features["ref_size"]]
+
+
+def fit_nonnegative(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Fit ``y = x @ coefficients`` by least squares with no negative coefficients. Variables with negative coefficients
+    are removed from the model one at a time until none are left.
+
+    """
+    coefficients = np.zeros(x.shape[1])
+    used = np.ones(x.shape[1], dtype=bool)
+
+    while used.any():
+        coefficients[:] = 0
+        coefficients[used] = np.linalg.lstsq(x[:, used], y, rcond=None)[0]
+
+        if (coefficients >= 0).all():
+            break
+
+        used[np.argmin(coefficients)] = False
+
+    return coefficients
+
+
+def predict_mem(history: list, features: dict, limit: int) -> int:
+    """
+    Predict the memory needed by a job in GB.
+
+    The prediction is scaled up so every job in the ``history`` would have fit, then by :data:`MEMORY_MARGIN`.
+
+    :param history: recently completed job documents of the same task with ``features`` and ``resources`` that
+        include peak memory
+    :param features: the features of the new job
+    :param limit: the static memory limit for the task in GB
+    :return: the predicted memory in GB
+
+    """
+    x = np.array([get_variables(document["features"]) for document in history], dtype=float)
+    y = np.array([get_peak_memory(document["resources"]) for document in history], dtype=float)
+
+    coefficients = fit_nonnegative(x, y)
+
+    fitted = x @ coefficients
+
+    if (fitted <= 0).any():
+        return limit
+
+    scale = max(1, np.max(y / fitted))
+
+    predicted = float(np.dot(get_variables(features), coefficients)) * scale * MEMORY_MARGIN
+
+    return max(1, min(limit, math.ceil(predicted / GB)))
+
+
+def predict_proc(history: list, limit: int, minimum: int = 1) -> int:
+    """
+    Predict the number of cores needed by a job.
+
+    :param history: recently completed job documents of the same task with ``proc`` and ``resources``
+    :param limit: the static core limit for the task
+    :param minimum: the fewest cores the task can run with
+    :return: the predicted number of cores
+
+    """
+    needed = [get_needed_cores(document, limit) for document in history]
+
+    return max(1, min(limit, max(minimum, math.ceil(np.percentile(needed, 90)))))
+
+
+async def estimate(db, settings: dict, task_name: str, task_args: dict) -> (int, int, Optional[dict]):
+    """
+    Estimate the cores and memory needed by a new job.
+
+    :param db: the application database object
+    :param settings: the application settings
+    :param task_name: the name of the task
+    :param task_args: the arguments for the job
+    :return: the cores, memory in GB, and the job features from :func:`get_features`
+
+    """
+    proc, mem = virtool.jobs.manager.get_task_limits(settings, task_name)
+
+    features = await get_features(db, settings, task_args)
+
+    if features is None:
+        return proc, mem, None
+
+    cursor = db.jobs.find(
+        {"task": task_name, "status.state": "complete", "features": {"$ne": None}},
+        ["proc", "features", "resources"]
+    )
+
+    history = [d async for d in cursor.sort("status.timestamp", -1).limit(HISTORY_SIZE) if d.get("resources")]
+
+    if len(history) < MIN_HISTORY:
+        return proc, mem, features
+
+    mem_history = [d for d in history if get_peak_memory(d["resources"]) is not None]
+
+    if len(mem_history) >= MIN_HISTORY:
+        mem = predict_mem(mem_history, features, mem)
+
+    return predict_proc(history, proc, MIN_PROC.get(task_name, 1)), mem, features
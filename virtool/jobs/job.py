@@ -2,22 +2,47 @@
 Classes, exceptions, and utilities for creating Virtool jobs.
 
 """
-import io
+import concurrent.futures
 import multiprocessing
 import os
-import queue
+import pickle
+import resource
+import selectors
+import shutil
 import signal
 import subprocess
 import sys
 import threading
+import time
 import traceback
 from typing import Optional
 
+import psutil
 import pymongo
 
+import virtool.jobs.channel
 import virtool.jobs.db
+import virtool.jobs.log
+import virtool.jobs.manager
 import virtool.utils
 
+#: The maximum number of bytes read from a subprocess pipe at once.
+PIPE_CHUNK_SIZE = 65536
+
+#: The minimum number of seconds between progress updates reported with :meth:`.Job.report_progress`.
+PROGRESS_INTERVAL = 5
+
+#: The address space of a job process is limited to this multiple of the static memory limit for its task. Address
+#: space includes memory that is mapped but never used, so it is larger than the resident memory recorded for past
+#: jobs. See :meth:`.Job.get_memory_limit`.
+MEMORY_LIMIT_FACTOR = 2
+
+#: Database clients created in this process keyed by connection string. See :func:`get_db_client`.
+_db_clients = dict()
+
+#: The number of jobs started in this process. Pooled workers run many jobs in one process. See :meth:`.Job.run`.
+_job_count = 0
+
 
 class Job(multiprocessing.Process):
     """
@@ -31,6 +56,11 @@ class Job(multiprocessing.Process):
 
     """
 
+    #: Limit the address space of the job while it runs. Only set for tasks whose memory use is predicted from the size
+    #: of their input. Tools run by other tasks, such as ``bowtie2-build`` on a large host genome, are left to use as
+    #: much memory as they need. See :meth:`.get_memory_limit`.
+    memory_limited = False
+
     def __init__(self, db_connection_string: str, db_name: str, settings: dict, job_id: str, q):
         super().__init__()
 
@@ -93,22 +123,39 @@ class Job(multiprocessing.Process):
         self._state = "waiting"
         self._stage = None
         self._error = None
-        self._process = None
+        self._processes = set()
         self._stage_list = None
-        self._log_path = os.path.join(self.settings["data_path"], "logs", "jobs", self.id)
-        self._log_buffer = list()
+        self._completed = list()
+        self._fractions = dict()
+        self._status_count = 0
+        self._progress_time = 0
+        self._current = threading.local()
+        self._lock = threading.RLock()
+
+        #: Peak RSS is a high-water mark over the life of a process. It only describes the job if no other job ran in
+        #: the process before it. Otherwise, peak RSS is not recorded. Set in :meth:`.run`.
+        self._fresh_process = True
+
+        #: A :class:`dict` of stage names and the names of the stages each one depends on. Stages whose dependencies
+        #: are complete can run at the same time. See :meth:`.run_stages`.
+        #:
+        #: If ``None``, each stage depends on the one before it in :attr:`._stage_list`.
+        self._stage_dependencies = None
+        self._log = virtool.jobs.log.Writer(virtool.jobs.log.join_log_path(self.settings["data_path"], self.id))
+        self._checkpoint_path = os.path.join(self.settings["data_path"], "jobs", "checkpoints", f"{self.id}.pickle")
 
     def init_db(self):
         """
         Called in the :meth:`.run` method when the job starts.
 
-        Initializes a database client using the :attr:`~db_connection_string` and :attr:`~db_name` attributes.
+        Initializes a database client using the :attr:`~db_connection_string` and :attr:`~db_name` attributes. An
+        existing client in the process is reused. See :func:`.get_db_client`.
 
         The job document is fetched and used to set the :attr:`.task_name`, :attr:`.task_args`, :attr:`.proc`, and
         :attr:`.mem` attributes.
 
         """
-        self.db = pymongo.MongoClient(self.db_connection_string, serverSelectionTimeoutMS=6000)[self.db_name]
+        self.db = get_db_client(self.db_connection_string)[self.db_name]
 
         document = self.db.jobs.find_one(self.id)
 
@@ -117,6 +164,8 @@ class Job(multiprocessing.Process):
         self.proc = document["proc"]
         self.mem = document["mem"]
 
+        self._status_count = len(document["status"])
+
     def check_db(self):
         """
         Intended to be redefined in subclasses of :class:`.Job`.
@@ -132,16 +181,27 @@ class Job(multiprocessing.Process):
 
     def run(self):
         """
-        The main job execution method. Methods in :attr:`.Job.stage_list` are executed sequentially.
+        The main job execution method. Methods in :attr:`.Job.stage_list` are executed by :meth:`.run_stages` in an
+        order allowed by their dependencies. The resources used by each stage method are recorded with
+        :meth:`.add_resources`, even if the stage fails.
+
+        A checkpoint is saved with :meth:`.save_checkpoint` whenever no stage is running. If the job was interrupted
+        before, stages completed before the last checkpoint are skipped. See :meth:`.load_checkpoint`.
 
         If ``SIGTERM`` is received, execution of stage methods is stopped and the job is put into the `cancelled` state
         by calling :meth:`.add_status`.
 
+        If ``SIGUSR1`` is received, the server is shutting down. Execution of stage methods is stopped and the job is
+        put back into the `waiting` state without calling :meth:`.cleanup`, so it can be resumed from its checkpoint.
+
         If an error is encountered in a stage method or a subprocess, execution of stage methods is stopped. The error
         is recorded in :attr:`.Job._error` and the job is put into the `error` state by calling :meth:`.add_status`.
 
         Any dangling subprocess is killed and :meth:`.cleanup` is called if the job fails.
 
+        The address space of jobs with :attr:`.memory_limited` set is limited by :func:`.limit_memory` while they run.
+        The limit is based on :meth:`.get_memory_limit`. The previous limit is always restored.
+
         """
         # Prevent the signal from propagating to the main server process.
         # See: https://stackoverflow.com/questions/50781181/os-kill-vs-process-terminate-within-aiohttp
@@ -153,51 +213,238 @@ class Job(multiprocessing.Process):
         # When the manager terminates jobs, run the handle_sigterm method.
         signal.signal(signal.SIGTERM, handle_sigterm)
 
+        # When the manager shuts down, run the handle_shutdown method.
+        signal.signal(signal.SIGUSR1, handle_shutdown)
+
+        global _job_count
+
+        self._fresh_process = _job_count == 0
+
+        _job_count += 1
+
         self.init_db()
         self.check_db()
 
+        memory_limit = self.get_memory_limit()
+
+        previous_limit = None if memory_limit is None else limit_memory(memory_limit)
+
         try:
-            for method in self._stage_list:
-                name = method.__name__
+            try:
+                self._completed = self.load_checkpoint()
+                self.run_stages(self._completed)
 
-                self.add_status(stage=name, state="running")
-                self.add_log(f"Stage: {name}")
+                self._progress = 1
+                self.add_status(state="complete")
+                self.clear_checkpoint()
 
-                method()
+            except ShutdownError:
+                self.kill_processes()
 
-            self._progress = 1
-            self.add_status(state="complete")
+                self.add_log("Interrupted by shutdown")
+                self.add_status(state="waiting")
 
-        except TerminationError:
-            self.add_status(state="cancelled")
+            except TerminationError:
+                self.add_status(state="cancelled")
 
-            if self._process:
-                self._process.kill()
+                self.kill_processes()
 
-            self.cleanup()
+                self.cleanup()
+                self.clear_checkpoint()
 
-        except:
-            self._error = handle_exception()
-            self.add_status(state="error")
+            except:
+                self._error = handle_exception()
+                self.add_status(state="error")
+
+                self.kill_processes()
+
+                self.cleanup()
+                self.clear_checkpoint()
+
+            self._log.close()
+
+        finally:
+            # Pooled workers run more jobs in the same process.
+            if previous_limit is not None:
+                resource.setrlimit(resource.RLIMIT_AS, previous_limit)
+
+    def run_stages(self, completed: list):
+        """
+        Run the stages in :attr:`._stage_list` that are not in ``completed``. Names are appended to ``completed`` as
+        stages finish.
+
+        A stage is ready when all of its dependencies in :attr:`._stage_dependencies` are complete. Ready stages are
+        started in :attr:`._stage_list` order as long as the cores they need, as returned by :meth:`.get_stage_proc`,
+        are available. A later ready stage can start before an earlier one if only the later one fits.
+
+        A stage runs in the job's main thread if it is the only stage running. Otherwise, each running stage gets its
+        own thread. The job process only handles signals in its main thread, so running subprocesses are killed if the
+        wait for concurrent stages is interrupted or a stage fails. Threads are always joined before this method
+        returns or raises.
+
+        :param completed: the names of the stages that have already been completed
+
+        """
+        dependencies = self.get_stage_dependencies()
+
+        check_stage_dependencies(dependencies)
+
+        methods = {method.__name__: method for method in self._stage_list}
+        costs = {name: min(max(self.get_stage_proc(name), 0), self.proc) for name in methods}
+
+        pending = [name for name in methods if name not in completed]
+        running = dict()
+        free = self.proc
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(methods)) as executor:
+            try:
+                while pending or running:
+                    starting = list()
+
+                    for name in pending:
+                        if costs[name] <= free and all(d in completed for d in dependencies[name]):
+                            starting.append(name)
+                            free -= costs[name]
+
+                    for name in starting:
+                        pending.remove(name)
+
+                    if not running and len(starting) == 1:
+                        name = starting[0]
+
+                        self.run_stage(methods[name])
+
+                        free += costs[name]
+                        completed.append(name)
+                        self.save_checkpoint(completed)
+
+                        continue
+
+                    for name in starting:
+                        running[executor.submit(self.run_stage, methods[name])] = name
+
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                    for future in done:
+                        name = running.pop(future)
+                        free += costs[name]
+
+                        # Raises any error from the stage.
+                        future.result()
+
+                        completed.append(name)
+
+                    if not running:
+                        self.save_checkpoint(completed)
+            except BaseException:
+                self.kill_processes()
+                raise
+
+    def run_stage(self, method):
+        """
+        Run a single stage ``method``, reporting its status and recording the resources it used.
+
+        Resource usage is measured for the whole job process. The usage recorded for stages that run at the same time
+        overlaps.
+
+        :param method: the stage method
+
+        """
+        name = method.__name__
+
+        self._current.stage = name
+        self._current.threads = self.get_stage_proc(name)
+
+        self.add_status(stage=name, state="running")
+        self.add_log(f"Stage: {name}")
+
+        start = get_resource_usage()
+
+        try:
+            method()
+        finally:
+            with self._lock:
+                self._fractions.pop(name, None)
+
+            self.add_resources(name, start)
+
+    def get_stage_dependencies(self) -> dict:
+        """
+        Get the names of the stages each stage in :attr:`._stage_list` depends on.
+
+        :return: a dict of stage names and lists of the stage names they depend on
+
+        """
+        names = [method.__name__ for method in self._stage_list]
+
+        if self._stage_dependencies is None:
+            return {name: names[index - 1:index] for index, name in enumerate(names)}
+
+        return {name: list(self._stage_dependencies.get(name, [])) for name in names}
+
+    def get_stage_proc(self, name: str) -> int:
+        """
+        Intended to be redefined in subclasses of :class:`.Job`.
+
+        Return the number of cores the stage called ``name`` uses. The cores used by stages running at the same time
+        never add up to more than :attr:`.proc`. Stages that mostly wait on I/O can return ``0``.
+
+        By default, a stage uses all of the job's cores and runs alone.
+
+        :param name: the stage name
+        :return: the number of cores
+
+        """
+        return self.proc
+
+    def get_tool_threads(self) -> int:
+        """
+        Get the number of threads for a tool whose output is processed by the job process while it runs. A core is left
+        for the job process, but a tool always gets at least one thread.
+
+        The thread count is recorded with the resources used by the current stage, so busy cores can be compared with
+        the threads the stage was given. See :func:`virtool.jobs.estimate.predict_proc`.
+
+        :return: the number of threads
+
+        """
+        threads = max(self.proc - 1, 1)
+
+        self._current.threads = threads
 
-            if self._process:
-                self._process.kill()
+        return threads
 
-            self.cleanup()
+    def kill_processes(self):
+        """
+        Kill any subprocesses started with :meth:`.run_subprocess` that are still running.
 
-        self.flush_log()
+        """
+        for process in list(self._processes):
+            process.kill()
 
-    def run_subprocess(self, command: list, stdout_handler=None, stderr_handler=None, env: Optional[dict] = None, cwd: Optional[str] = None):
+    def run_subprocess(self, command: list, stdout_handler=None, stderr_handler=None, env: Optional[dict] = None,
+                       cwd: Optional[str] = None, buffered: bool = False, input_paths: Optional[list] = None):
         """
         A utility method for running a the passed `subprocess` command.
 
         It takes care of running a command and handling STDOUT and STDERR.
 
+        By default, ``stdout_handler`` is called once for each line. If ``buffered`` is ``True``, it is instead called
+        with :class:`bytes` chunks containing many complete lines. This avoids a Python call for every line of
+        high-volume output such as SAM.
+
+        The number of STDOUT lines handled per second is written to the job log.
+
+        If ``input_paths`` are given, the progress of the stage is reported with :meth:`.report_progress` based on how
+        far the subprocess has read through them. See :func:`.find_input_fraction`.
+
         :param command: the command to run in a subprocess
         :param stdout_handler: a function for handling STDOUT lines
         :param stderr_handler: a function for handling STDERR lines
         :param env: environmental variables to
         :param cwd: working directory to use for process
+        :param buffered: pass chunks of lines to ``stdout_handler`` instead of single lines
+        :param input_paths: paths of the files the subprocess reads from start to end
         :return:
         """
         self.add_log(f"Command: {' '.join(command)}")
@@ -215,53 +462,57 @@ class Job(multiprocessing.Process):
             def _stderr_handler(line):
                 self.add_log(line, indent=1)
 
-        self._process = subprocess.Popen(command, stdout=stdout, stderr=subprocess.PIPE, env=env, cwd=cwd)
+        process = subprocess.Popen(command, stdout=stdout, stderr=subprocess.PIPE, env=env, cwd=cwd)
 
-        stdout_queue = None
-        stdout_thread = None
+        self._processes.add(process)
+
+        handlers = {
+            process.stderr: handle_lines(_stderr_handler)
+        }
+
+        line_count = 0
 
         if stdout_handler:
-            stdout_queue = queue.Queue()
+            _stdout_handler = stdout_handler if buffered else handle_lines(stdout_handler)
 
-            stdout_thread = threading.Thread(
-                target=watch_pipe,
-                args=(self._process.stdout, stdout_queue),
-                daemon=True
-            )
+            def _counting_stdout_handler(chunk):
+                nonlocal line_count
+                line_count += chunk.count(b"\n")
+                _stdout_handler(chunk)
 
-            stdout_thread.start()
+            handlers[process.stdout] = _counting_stdout_handler
 
-        stderr_queue = queue.Queue()
+        tick = None
 
-        stderr_thread = threading.Thread(
-            target=watch_pipe,
-            args=(self._process.stderr, stderr_queue),
-            daemon=True
-        )
+        if input_paths:
+            sizes = {os.path.realpath(path): os.path.getsize(path) for path in input_paths}
+            consumed = dict()
 
-        stderr_thread.start()
+            def tick():
+                fraction = find_input_fraction(process.pid, sizes, consumed)
 
-        while True:
-            if stdout_queue:
-                while not stdout_queue.empty():
-                    out = stdout_queue.get()
-                    stdout_handler(out)
+                if fraction is not None:
+                    self.report_progress(fraction)
 
-            while not stderr_queue.empty():
-                err = stderr_queue.get()
-                _stderr_handler(err)
+        start = time.monotonic()
 
-            alive = (stdout_thread and stdout_thread.is_alive()) or stderr_thread.is_alive()
+        watch_pipes(handlers, tick)
 
-            stdout_empty = not stdout_queue or stdout_queue.empty()
+        process.wait()
 
-            if not alive and stderr_queue.empty() and stdout_empty and self._process.poll() is not None:
-                break
+        self._processes.discard(process)
 
-        if self._process.returncode != 0:
+        if process.returncode != 0:
             raise SubprocessError(f"Command failed: {' '.join(command)}. Check job log.")
 
-        self._process = None
+        if stdout_handler:
+            elapsed = time.monotonic() - start
+            mode = "buffered" if buffered else "line"
+
+            self.add_log(
+                f"Handled {line_count} STDOUT lines in {elapsed:.1f} s "
+                f"({line_count / max(elapsed, 1e-6):.0f} lines/s, {mode} mode)"
+            )
 
     def add_status(self, state=None, stage=None):
         """
@@ -272,27 +523,125 @@ class Job(multiprocessing.Process):
         :return:
         """
 
-        self._state = state or self._state
-        self._stage = stage or self._stage
+        with self._lock:
+            self._state = state or self._state
+            self._stage = stage or self._stage
+
+            if self._stage and self._progress != 1:
+                self._progress = self._find_progress()
+
+            self._status_count += 1
+            self._progress_time = time.monotonic()
+
+            self.db.jobs.update_one({"_id": self.id}, {
+                "$push": {
+                    "status": {
+                        "state": self._state,
+                        "stage": self._stage,
+                        "error": self._error,
+                        "progress": self._progress,
+                        "timestamp": virtool.utils.timestamp()
+                    }
+                }
+            })
+
+        self.dispatch("jobs", "update", [self.id])
+
+    def report_progress(self, fraction: float):
+        """
+        Report that the stage running in the calling thread is ``fraction`` complete.
+
+        Updates are coalesced. The progress of the latest status entry is updated in place, so reporting progress does
+        not grow the ``status`` list of the job document. Nothing is written if less than :data:`PROGRESS_INTERVAL`
+        seconds have passed since the last update or the rounded progress has not changed. Later status entries include
+        the most recent fraction reported for each running stage.
+
+        :param fraction: the fraction of the stage that is complete, between ``0`` and ``1``
+
+        """
+        with self._lock:
+            self._fractions[getattr(self._current, "stage", self._stage)] = min(max(fraction, 0), 1)
+
+            if time.monotonic() - self._progress_time < PROGRESS_INTERVAL:
+                return
+
+            progress = self._find_progress()
+
+            if progress == self._progress:
+                return
+
+            self._progress = progress
+            self._progress_time = time.monotonic()
+
+            self.db.jobs.update_one({"_id": self.id}, {
+                "$set": {
+                    f"status.{self._status_count - 1}.progress": progress
+                }
+            })
+
+        self.dispatch("jobs", "update", [self.id])
+
+    def _find_progress(self) -> float:
+        # Each stage covers an equal share of the overall progress. Stages can run at the same time, so progress is
+        # based on the number of completed stages plus the fractions reported by running stages. It never decreases.
+        share = len(self._completed) + 1 + sum(self._fractions.values())
+
+        return max(self._progress, round(share / (len(self._stage_list) + 1), 2))
+
+    def get_memory_limit(self) -> Optional[int]:
+        """
+        Get the memory in GB used to size the address space limit of the job. See :func:`.limit_memory`.
+
+        The memory reserved in :attr:`.mem` may be predicted from the resident memory of past jobs. Address space is
+        much larger than resident memory, so the static memory limit for the task is used unless :attr:`.mem` is
+        larger.
+
+        :return: the memory in GB or ``None`` if :attr:`.memory_limited` is not set
+
+        """
+        if not self.memory_limited:
+            return None
+
+        if self.task_name not in virtool.jobs.manager.TASK_SIZES:
+            return self.mem
 
-        if self._stage and self._progress != 1:
-            stage_index = [m.__name__ for m in self._stage_list].index(self._stage)
-            self._progress = round((stage_index + 1) / (len(self._stage_list) + 1), 2)
+        _, mem = virtool.jobs.manager.get_task_limits(self.settings, self.task_name)
+
+        return max(self.mem, mem)
+
+    def add_resources(self, stage: str, start: dict):
+        """
+        Record the resources used by ``stage`` since the ``start`` usage returned by :func:`.get_resource_usage`.
+
+        An entry is pushed to the ``resources`` list of the job document and summarized in the job log. Peak RSS values
+        are ``None`` if another job ran in the process first.
+
+        :param stage: the name of the stage method
+        :param start: the resource usage when the stage started
+
+        """
+        resources = {
+            "stage": stage,
+            "threads": getattr(self._current, "threads", self.proc),
+            **find_resource_delta(start, get_resource_usage())
+        }
+
+        summary = f"Resources: {resources['wall']:.1f} s wall, {resources['cpu'] + resources['children_cpu']:.1f} s CPU"
+
+        if self._fresh_process:
+            summary += f", {resources['peak_rss'] // 1024 ** 2} MB peak RSS"
+        else:
+            resources["peak_rss"] = None
+            resources["children_peak_rss"] = None
+
+        self.add_log(summary)
 
         self.db.jobs.update_one({"_id": self.id}, {
             "$push": {
-                "status": {
-                    "state": self._state,
-                    "stage": self._stage,
-                    "error": self._error,
-                    "progress": self._progress,
-                    "timestamp": virtool.utils.timestamp()
-                }
+                "resources": resources
             }
         })
 
-        self.dispatch("jobs", "update", [self.id])
-
     def dispatch(self, interface: str, operation: str, id_list: list):
         """
         Using the job's messaging interface (:class:`multiprocessing.Queue` or Redis), send an instruction to the API
@@ -323,28 +672,141 @@ class Job(multiprocessing.Process):
         :param id_list: a list of ids whose documents should be dispatched
 
         """
-        message = (
-            interface,
-            operation,
-            id_list
-        )
-
-        self.q.put(message)
+        virtool.jobs.channel.send(self.q, interface, operation, id_list)
 
     def add_log(self, line: str, indent=0):
         timestamp = virtool.utils.timestamp().isoformat()
 
         indent_string = " " * indent * 4
 
-        self._log_buffer.append(f"{timestamp}{indent_string}    {line.rstrip()}")
-
-        if len(self._log_buffer) == 15:
-            self.flush_log()
-            del self._log_buffer[:]
+        self._log.write(f"{timestamp}{indent_string}    {line.rstrip()}")
 
     def flush_log(self):
-        with open(self._log_path, "a") as f:
-            f.write("\n".join(self._log_buffer))
+        """
+        Write any buffered log lines to the job log file. Lines are also flushed periodically by
+        :class:`virtool.jobs.log.Writer`.
+
+        """
+        self._log.flush()
+
+    def get_checkpoint_roots(self) -> list:
+        """
+        Intended to be redefined in subclasses of :class:`.Job`.
+
+        Return the directories the job writes its files to. The contents of these directories are recorded in each
+        checkpoint. When the job resumes, anything in them that was not recorded is removed, as it was written by an
+        incomplete stage.
+
+        Only directories that are created and owned by the job should be returned.
+
+        """
+        return []
+
+    def save_checkpoint(self, completed: list):
+        """
+        Save a checkpoint after the stages in ``completed`` have run.
+
+        :attr:`.intermediate` and :attr:`.results` are pickled to a file. The completed stage names and the files in
+        the directories returned by :meth:`.get_checkpoint_roots` are recorded in the ``checkpoint`` field of the job
+        document.
+
+        :param completed: the names of the completed stages
+
+        """
+        os.makedirs(os.path.dirname(self._checkpoint_path), exist_ok=True)
+
+        partial_path = self._checkpoint_path + ".partial"
+
+        with open(partial_path, "wb") as f:
+            pickle.dump({
+                "stages": completed,
+                "intermediate": self.intermediate,
+                "results": self.results
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(partial_path, self._checkpoint_path)
+
+        self.db.jobs.update_one({"_id": self.id}, {
+            "$set": {
+                "checkpoint": {
+                    "stages": completed,
+                    "files": list_checkpoint_files(self.get_checkpoint_roots()),
+                    "timestamp": virtool.utils.timestamp()
+                }
+            }
+        })
+
+    def load_checkpoint(self) -> list:
+        """
+        Restore the job from its last checkpoint and return the names of the stages that were completed.
+
+        Files and directories in the checkpoint roots that were not recorded in the checkpoint are removed first. If
+        there is no checkpoint, the roots are cleared.
+
+        The job is run from the beginning if the checkpoint does not match the stage dependencies or any recorded file
+        is missing or has changed size.
+
+        :return: the names of the completed stages
+
+        """
+        checkpoint = self.db.jobs.find_one(self.id, ["checkpoint"]).get("checkpoint")
+
+        roots = self.get_checkpoint_roots()
+
+        if not checkpoint:
+            prune_checkpoint_roots(roots, [])
+            return []
+
+        stages = checkpoint["stages"]
+
+        dependencies = self.get_stage_dependencies()
+
+        valid = (
+            all(name in dependencies and all(d in stages for d in dependencies[name]) for name in stages) and
+            os.path.isfile(self._checkpoint_path) and
+            check_checkpoint_files(checkpoint["files"])
+        )
+
+        if not valid:
+            self.add_log("Checkpoint is invalid. Starting from the first stage.")
+            self.clear_checkpoint()
+            prune_checkpoint_roots(roots, [])
+            return []
+
+        with open(self._checkpoint_path, "rb") as f:
+            state = pickle.load(f)
+
+        # The job may have been interrupted between writing the checkpoint file and updating the job document.
+        if state["stages"] != stages:
+            self.add_log("Checkpoint is invalid. Starting from the first stage.")
+            self.clear_checkpoint()
+            prune_checkpoint_roots(roots, [])
+            return []
+
+        prune_checkpoint_roots(roots, checkpoint["files"])
+
+        self.intermediate = state["intermediate"]
+        self.results = state["results"]
+
+        self.add_log(f"Resuming after stages: {', '.join(stages)}")
+
+        return stages
+
+    def clear_checkpoint(self):
+        """
+        Remove the checkpoint file and the ``checkpoint`` field of the job document.
+
+        """
+        try:
+            os.remove(self._checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+        self.db.jobs.update_one({"_id": self.id}, {
+            "$unset": {
+                "checkpoint": ""
+            }
+        })
 
     def cleanup(self):
         """
@@ -366,6 +828,18 @@ class SubprocessError(Exception):
     pass
 
 
+class ShutdownError(Exception):
+    """
+    This exception is raised when ``SIGUSR1`` is handled in the job process. The job manager sends ``SIGUSR1`` to
+    running jobs when the server shuts down.
+
+    The exception is handled in the :meth:`.run` method. It stops execution and puts the job back in the waiting state
+    without cleaning up, so the job can resume from its last checkpoint.
+
+    """
+    pass
+
+
 class TerminationError(Exception):
     """
     This exception is raised when ``SIGTERM`` is handled in the job process. ``SIGTERM`` usually represents an attempt
@@ -377,6 +851,26 @@ class TerminationError(Exception):
     pass
 
 
+def get_db_client(db_connection_string: str) -> pymongo.MongoClient:
+    """
+    Get a database client for ``db_connection_string``. The client is created the first time it is requested in the
+    current process and reused after that, so jobs run one after another in a pooled worker share a warm connection.
+
+    :param db_connection_string: the MongoDB connection string
+    :return: the client
+
+    """
+    try:
+        return _db_clients[db_connection_string]
+    except KeyError:
+        client = _db_clients[db_connection_string] = pymongo.MongoClient(
+            db_connection_string,
+            serverSelectionTimeoutMS=6000
+        )
+
+        return client
+
+
 def handle_exception(max_tb: Optional[int] = 50) -> dict:
     """
     Transforms an exception into a :class:`dict` describing the error. The dict can be stored in MongoDB and used to
@@ -404,6 +898,93 @@ def handle_exception(max_tb: Optional[int] = 50) -> dict:
     }
 
 
+def limit_memory(mem: int) -> tuple:
+    """
+    Limit the address space of the current process and any subprocesses it starts to :data:`MEMORY_LIMIT_FACTOR` times
+    ``mem``. Allocations beyond the limit fail, causing the job to error instead of exhausting memory on the host.
+
+    :param mem: the memory reserved for the job in GB
+    :return: the previous soft and hard limits
+
+    """
+    previous = resource.getrlimit(resource.RLIMIT_AS)
+
+    soft, hard = previous
+
+    limit = int(mem * MEMORY_LIMIT_FACTOR * 1024 ** 3)
+
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+    return previous
+
+
+def get_resource_usage() -> dict:
+    """
+    Get the resources used by the current process and its waited-for child processes so far.
+
+    CPU times are in seconds. Peak RSS values are in bytes. Bytes read and written include I/O by child processes that
+    have been waited for. They are ``None`` where the platform does not report process I/O.
+
+    :return: the resource usage
+
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    # Reported in bytes on macOS and kilobytes elsewhere.
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+
+    try:
+        io = psutil.Process().io_counters()
+        read_bytes = getattr(io, "read_chars", io.read_bytes)
+        write_bytes = getattr(io, "write_chars", io.write_bytes)
+    except (AttributeError, psutil.Error):
+        read_bytes = None
+        write_bytes = None
+
+    return {
+        "time": time.monotonic(),
+        "cpu": usage.ru_utime + usage.ru_stime,
+        "children_cpu": children.ru_utime + children.ru_stime,
+        "peak_rss": usage.ru_maxrss * rss_unit,
+        "children_peak_rss": children.ru_maxrss * rss_unit,
+        "read_bytes": read_bytes,
+        "write_bytes": write_bytes
+    }
+
+
+def find_resource_delta(start: dict, end: dict) -> dict:
+    """
+    Find the resources used between two calls to :func:`.get_resource_usage`.
+
+    Peak RSS values cannot be reset, so the values at ``end`` are used. They are the largest RSS of the job process and
+    of any single child process since the job started.
+
+    :param start: the earlier resource usage
+    :param end: the later resource usage
+    :return: the resources used
+
+    """
+    def delta(key):
+        if start[key] is None or end[key] is None:
+            return None
+
+        return end[key] - start[key]
+
+    return {
+        "wall": end["time"] - start["time"],
+        "cpu": delta("cpu"),
+        "children_cpu": delta("children_cpu"),
+        "peak_rss": end["peak_rss"],
+        "children_peak_rss": end["children_peak_rss"],
+        "read_bytes": delta("read_bytes"),
+        "write_bytes": delta("write_bytes")
+    }
+
+
 def handle_sigterm(*args):
     """
     A handler for SIGTERM signals. Raises a TerminationError in :meth:`.Job.run` that allows the job to clean-up after
@@ -415,21 +996,228 @@ def handle_sigterm(*args):
     raise TerminationError
 
 
-def watch_pipe(stream: io.TextIOWrapper, q: queue.Queue):
+def handle_shutdown(*args):
+    """
+    A handler for SIGUSR1 signals. Raises a :class:`.ShutdownError` in :meth:`.Job.run`.
+
+    """
+    raise ShutdownError
+
+
+def check_stage_dependencies(dependencies: dict):
+    """
+    Check that every stage in ``dependencies`` can eventually run.
+
+    :param dependencies: a dict of stage names and lists of the stage names they depend on
+    :raises ValueError: if a stage depends on an unknown stage or the dependencies contain a cycle
+
+    """
+    for name, required in dependencies.items():
+        unknown = [d for d in required if d not in dependencies]
+
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stages: {', '.join(unknown)}")
+
+    resolved = set()
+    remaining = list(dependencies)
+
+    while remaining:
+        ready = [name for name in remaining if all(d in resolved for d in dependencies[name])]
+
+        if not ready:
+            raise ValueError(f"Stage dependencies contain a cycle: {', '.join(remaining)}")
+
+        resolved.update(ready)
+        remaining = [name for name in remaining if name not in resolved]
+
+
+def list_checkpoint_files(roots: list) -> list:
+    """
+    List the files and directories in the checkpoint ``roots``, including the roots themselves. Directories have a
+    ``size`` of ``None``.
+
+    :param roots: the checkpoint root directories
+    :return: a list of dicts with ``path`` and ``size`` keys
+
+    """
+    files = list()
+
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+
+        files.append({"path": root, "size": None})
+
+        for dir_path, dir_names, file_names in os.walk(root):
+            for name in sorted(dir_names):
+                files.append({"path": os.path.join(dir_path, name), "size": None})
+
+            for name in sorted(file_names):
+                path = os.path.join(dir_path, name)
+                files.append({"path": path, "size": os.path.getsize(path)})
+
+    return files
+
+
+def check_checkpoint_files(files: list) -> bool:
+    """
+    Check that the ``files`` recorded in a checkpoint still exist and have the same size.
+
+    :param files: the files returned by :func:`.list_checkpoint_files`
+    :return: ``True`` if all files are unchanged
+
+    """
+    for file in files:
+        if file["size"] is None:
+            if not os.path.isdir(file["path"]):
+                return False
+        elif not os.path.isfile(file["path"]) or os.path.getsize(file["path"]) != file["size"]:
+            return False
+
+    return True
+
+
+def prune_checkpoint_roots(roots: list, files: list):
+    """
+    Remove any file or directory in the checkpoint ``roots`` that is not in ``files``. A root is removed entirely if it
+    is not in ``files``.
+
+    :param roots: the checkpoint root directories
+    :param files: the files returned by :func:`.list_checkpoint_files`
+
+    """
+    recorded = {file["path"] for file in files}
+
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+
+        if root not in recorded:
+            shutil.rmtree(root)
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(root):
+            for name in list(dir_names):
+                path = os.path.join(dir_path, name)
+
+                if path not in recorded:
+                    shutil.rmtree(path)
+                    dir_names.remove(name)
+
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+
+                if path not in recorded:
+                    os.remove(path)
+
+
+def watch_pipes(handlers: dict, tick=None):
     """
-    A function for watching stdout and stderr pipes on subprocesses. Lines are read and pushed into the `q`. Queued
-    lines are handled in :meth:`.Job.run`.
+    Watch the stdout and stderr pipes of a subprocess until they are all closed. Output read from a pipe is passed to
+    the handler for that pipe as :class:`bytes` chunks of complete lines, including their trailing newlines. Any partial
+    last line is passed when the pipe closes.
 
-    This function is intended to be run in a separate thread.
+    If a ``tick`` function is given, it is called about every :data:`PROGRESS_INTERVAL` seconds while the pipes are
+    open.
 
-    :param stream: a stdout or stderr file object
-    :param q: a queue to push lines into
+    The calling thread blocks in a :mod:`selectors` selector while it waits for output, so no CPU time is used while the
+    subprocess is quiet. Signal handlers still run, so a :class:`.TerminationError` raised on ``SIGTERM`` interrupts the
+    wait.
+
+    :param handlers: a dict of pipe file objects and the functions that should handle their output
+    :param tick: a function to call periodically
 
     """
-    while True:
-        line = stream.readline()
+    buffers = dict()
+
+    timeout = PROGRESS_INTERVAL if tick else None
+    last_tick = time.monotonic()
+
+    with selectors.DefaultSelector() as selector:
+        for stream, handler in handlers.items():
+            selector.register(stream, selectors.EVENT_READ, handler)
+            buffers[stream] = bytearray()
+
+        while selector.get_map():
+            if tick and time.monotonic() - last_tick >= PROGRESS_INTERVAL:
+                tick()
+                last_tick = time.monotonic()
+
+            for key, _ in selector.select(timeout):
+                buffer = buffers[key.fileobj]
+                chunk = os.read(key.fd, PIPE_CHUNK_SIZE)
+
+                if not chunk:
+                    selector.unregister(key.fileobj)
+
+                    if buffer:
+                        key.data(bytes(buffer))
+
+                    continue
+
+                buffer += chunk
+
+                end = buffer.rfind(b"\n") + 1
+
+                if end:
+                    key.data(bytes(buffer[:end]))
+                    del buffer[:end]
+
+
+def find_input_fraction(pid: int, sizes: dict, consumed: dict) -> Optional[float]:
+    """
+    Estimate the fraction of its input files that the process with ``pid`` has read.
+
+    The read position of each input file the process has open is found with :mod:`psutil`. Input files are assumed to
+    be read in order. Files before an open file and files that were seen open earlier but have since been closed are
+    counted as fully read.
+
+    :param pid: the process ID
+    :param sizes: a dict of real input file paths and their sizes in bytes
+    :param consumed: a dict of the bytes read from each input file, updated by each call
+    :return: the fraction of input read or ``None`` if the open files of the process could not be read
+
+    """
+    try:
+        positions = {f.path: f.position for f in psutil.Process(pid).open_files() if f.path in sizes}
+    except (AttributeError, psutil.Error):
+        return None
+
+    paths = list(sizes)
+
+    last_open = max((paths.index(path) for path in positions), default=-1)
+
+    for index, path in enumerate(paths):
+        if path in positions:
+            consumed[path] = max(consumed.get(path, 0), positions[path])
+        elif index < last_open or path in consumed:
+            consumed[path] = sizes[path]
+
+    total = sum(sizes.values())
+
+    if not total:
+        return None
+
+    return sum(consumed.values()) / total
+
+
+def handle_lines(handler):
+    """
+    Wrap a line ``handler`` so it can be passed chunks of lines by :func:`watch_pipes`. The wrapped handler is called
+    once for each line in a chunk.
+
+    :param handler: a function that handles a single line
+    :return: a function that handles a chunk of lines
+
+    """
+    def _handle_lines(chunk: bytes):
+        lines = chunk.split(b"\n")
+        last = lines.pop()
+
+        for line in lines:
+            handler(line + b"\n")
 
-        if not line:
-            return
+        if last:
+            handler(last)
 
-        q.put(line)
+    return _handle_lines
@@ -0,0 +1,171 @@
+"""
+Writing and tailing job log files.
+
+Each job writes its log to ``<data_path>/logs/jobs/<job_id>.log`` through a :class:`Writer`. The file is opened once
+and lines are buffered in memory until enough have accumulated or a short interval has passed. Buffers always end on a
+line boundary, so a reader never sees a partial line.
+
+Running jobs can be tailed with :func:`read`, which only reads the bytes after a given offset.
+
+"""
+import os
+import threading
+from typing import Optional
+
+#: The number of buffered bytes that causes the log to be flushed.
+FLUSH_SIZE = 65536
+
+#: The maximum number of seconds a line stays in the buffer.
+FLUSH_INTERVAL = 2
+
+#: The maximum number of bytes returned by a single call to :func:`read`.
+READ_SIZE = 1048576
+
+
+def join_log_path(data_path: str, job_id: str) -> str:
+    """
+    Get the path to the log file for a job.
+
+    :param data_path: the application data path
+    :param job_id: the job ID
+    :return: the log path
+
+    """
+    return os.path.join(data_path, "logs", "jobs", f"{job_id}.log")
+
+
+def find_log_path(data_path: str, job_id: str) -> Optional[str]:
+    """
+    Find the log file for a job. Logs written by older versions of Virtool are named with the job ID only.
+
+    :param data_path: the application data path
+    :param job_id: the job ID
+    :return: the log path or ``None`` if there is no log file
+
+    """
+    path = join_log_path(data_path, job_id)
+
+    if os.path.isfile(path):
+        return path
+
+    legacy_path = os.path.join(data_path, "logs", "jobs", job_id)
+
+    if os.path.isfile(legacy_path):
+        return legacy_path
+
+    return None
+
+
+class Writer:
+    """
+    Appends lines to a log file through a single open handle.
+
+    Lines are flushed to the file when :data:`FLUSH_SIZE` bytes are buffered. A background thread also flushes the
+    buffer every :data:`FLUSH_INTERVAL` seconds, so the log of a quiet job stays current. The file is opened with the
+    first line, which allows a :class:`Writer` to be created before a job process is forked.
+
+    Writing and flushing are thread-safe.
+
+    :param path: the path of the log file
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._buffer = list()
+        self._buffer_size = 0
+        self._handle = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def write(self, line: str):
+        """
+        Buffer a single ``line``. A newline is added to the end of the line.
+
+        :param line: the line to write
+
+        """
+        data = (line + "\n").encode()
+
+        with self._lock:
+            if self._handle is None:
+                self._open()
+
+            self._buffer.append(data)
+            self._buffer_size += len(data)
+
+            if self._buffer_size >= FLUSH_SIZE:
+                self._flush()
+
+    def flush(self):
+        """
+        Write all buffered lines to the log file.
+
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        Flush the buffer, stop the background thread, and close the log file.
+
+        """
+        self._closed.set()
+
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            self._flush()
+
+            if self._handle:
+                self._handle.close()
+                self._handle = None
+
+    def _open(self):
+        self._handle = open(self.path, "ab")
+        self._closed.clear()
+
+        self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._thread.start()
+
+    def _flush(self):
+        if self._buffer and self._handle:
+            self._handle.write(b"".join(self._buffer))
+            self._handle.flush()
+
+            self._buffer.clear()
+            self._buffer_size = 0
+
+    def _flush_periodically(self):
+        while not self._closed.wait(FLUSH_INTERVAL):
+            self.flush()
+
+
+def read(path: str, offset: int = 0, size: int = READ_SIZE) -> (str, int):
+    """
+    Read up to ``size`` bytes of complete lines from the log file at ``path``, starting at ``offset``.
+
+    The returned offset should be passed in the next call to continue reading from where this one stopped. If the
+    file does not exist, no lines and the same ``offset`` are returned.
+
+    :param path: the log path
+    :param offset: the offset to start reading from in bytes
+    :param size: the maximum number of bytes to read
+    :return: the lines that were read and the offset of the first unread byte
+
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+    except FileNotFoundError:
+        return "", offset
+
+    # Only return complete lines. A partial line is read again in the next call unless it fills the whole read.
+    end = data.rfind(b"\n") + 1 or (len(data) if len(data) == size else 0)
+
+    return data[:end].decode(errors="replace"), offset + end
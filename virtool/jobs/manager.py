@@ -1,9 +1,16 @@
 import asyncio
+import datetime
+import heapq
 import logging
 import multiprocessing
+import os
+import signal
+import time
+from collections import defaultdict, deque
 
 import virtool.db.core
 import virtool.indexes.db
+import virtool.jobs.channel
 import virtool.jobs.db
 import virtool.otus.db
 import virtool.samples.db
@@ -11,6 +18,7 @@ import virtool.db.utils
 import virtool.dispatcher
 import virtool.errors
 import virtool.jobs.classes
+import virtool.jobs.pool
 import virtool.utils
 
 TASK_LG = "lg"
@@ -27,6 +35,25 @@ TASK_SIZES = {
 }
 
 
+#: The order in which waiting jobs are started with the ``priority`` job policy. Higher priority jobs start first.
+#: Small jobs that users are usually waiting on are started before analyses.
+TASK_PRIORITIES = {
+    "build_index": 1,
+    "create_sample": 2,
+    "create_subtraction": 1,
+    "aodp": 0,
+    "nuvs": 0,
+    "pathoscope_bowtie": 0,
+    "update_sample": 2
+}
+
+#: The longest time in seconds between scheduling passes and dispatches.
+TICK = 0.1
+
+#: The weight given to the latest run when updating the mean duration of a task.
+DURATION_SMOOTHING = 0.3
+
+
 class IntegratedManager:
     """
     A job manager that can be integrated into a monolithic Virtool process.
@@ -42,6 +69,9 @@ class IntegratedManager:
         #: A :class:`multiprocess.Queue` used to receive dispatch information from job processes.
         self.queue = multiprocessing.Queue()
 
+        #: Drains and merges the messages in :attr:`.queue` and measures queue depth and latency.
+        self.channel = virtool.jobs.channel.Channel(self.queue)
+
         #: The application database interface.
         self.db = app["db"]
 
@@ -60,42 +90,48 @@ class IntegratedManager:
         #: A dict to store all the tracked job objects in.
         self._jobs = dict()
 
-    async def run(self):
-        logging.debug("Started job manager")
+        #: Set to run a scheduling pass before the next tick.
+        self._wake = asyncio.Event()
 
-        try:
-            while True:
-                to_delete = list()
+        #: The mean duration in seconds of recent jobs for each task. Used to estimate when waiting jobs will start.
+        self._durations = dict()
 
-                if len(self._jobs):
-                    available = get_available_resources(self.settings, self._jobs)
+        #: A pool of pre-forked workers for small jobs. Every job gets a new process if ``job_workers`` is ``0``.
+        self.pool = None
 
-                    for job_id, job in self._jobs.items():
-                        if not job["process"]:
-                            if job["proc"] <= available["proc"] and job["mem"] <= available["mem"]:
-                                job["process"] = job["class"](
-                                    self.db_connection_string,
-                                    self.db_name,
-                                    self.settings,
-                                    job_id,
-                                    self.queue
-                                )
+        if self.settings.get("job_workers"):
+            self.pool = virtool.jobs.pool.WorkerPool(
+                self.settings["job_workers"],
+                self.db_connection_string,
+                self.db_name,
+                self.settings,
+                self.queue
+            )
 
-                                job["process"].start()
+    async def run(self):
+        logging.debug("Started job manager")
+
+        await self.recover()
+
+        if self.pool:
+            self.pool.start()
 
-                                break
+        try:
+            while True:
+                self.reap()
 
-                        elif not job["process"].is_alive():
-                            to_delete.append(job_id)
+                await self.schedule()
 
-                for job_id in to_delete:
-                    del self._jobs[job_id]
+                await self.dispatch_pending()
 
-                if not self.queue.empty():
-                    msg = self.queue.get()
-                    await self.dispatch(*msg)
+                # Enqueued, cancelled and exiting jobs wake the manager early. Dispatch messages are drained at least
+                # every tick.
+                try:
+                    await asyncio.wait_for(self._wake.wait(), TICK)
+                except asyncio.TimeoutError:
+                    pass
 
-                await asyncio.sleep(0.1)
+                self._wake.clear()
 
         except asyncio.CancelledError:
             logging.debug("Cancelling running jobs")
@@ -103,13 +139,110 @@ class IntegratedManager:
             for job_id in self._jobs:
                 job_process = self._jobs[job_id]["process"]
 
-                if job_process.is_alive():
-                    job_process.terminate()
+                # Jobs stopped with SIGUSR1 keep their checkpoints and are recovered when the manager next starts.
+                if job_process and job_process.is_alive():
+                    asyncio.get_event_loop().remove_reader(job_process.sentinel)
+                    os.kill(job_process.pid, signal.SIGUSR1)
+
+            if self.pool:
+                self.pool.close()
 
         logging.debug("Closed job manager")
 
+    def reap(self):
+        """
+        Stop tracking jobs whose processes have exited.
+
+        """
+        loop = asyncio.get_event_loop()
+
+        for job_id in [job_id for job_id, job in self._jobs.items() if job["process"]]:
+            process = self._jobs[job_id]["process"]
+
+            if not process.is_alive():
+                loop.remove_reader(process.sentinel)
+
+                job = self._jobs.pop(job_id)
+
+                update_duration(self._durations, job["task_name"], time.monotonic() - job["started_at"])
+
+    async def schedule(self):
+        """
+        Start every waiting job chosen by :func:`select_jobs`. The time each job spent waiting is recorded in its
+        document as ``wait`` in seconds.
+
+        """
+        if not self._jobs:
+            return
+
+        loop = asyncio.get_event_loop()
+
+        now = time.monotonic()
+
+        selected = select_jobs(
+            self._jobs,
+            get_available_resources(self.settings, self._jobs),
+            self.settings,
+            now
+        )
+
+        for job_id in selected:
+            job = self._jobs[job_id]
+
+            job["process"] = self.create_process(job_id, job)
+            job["process"].start()
+            job["started_at"] = now
+
+            loop.add_reader(job["process"].sentinel, self._wake.set)
+
+            wait = round(now - job["enqueued_at"], 3)
+
+            logging.debug(f"Started job {job_id} after waiting {wait} s")
+
+            await self.db.jobs.update_one({"_id": job_id}, {
+                "$set": {
+                    "wait": wait
+                }
+            })
+
+    def create_process(self, job_id: str, job: dict):
+        """
+        Create a process for running a job. Small jobs are run on an idle worker from :attr:`.pool` if there is one.
+        Otherwise, a new process is created for the job.
+
+        :param job_id: the job ID
+        :param job: the tracked job
+        :return: a :class:`~virtool.jobs.job.Job` or :class:`~virtool.jobs.pool.PooledJob` that has not been started
+
+        """
+        if self.pool and TASK_SIZES[job["task_name"]] == TASK_SM:
+            pooled = self.pool.acquire(job_id)
+
+            if pooled:
+                return pooled
+
+        return job["class"](
+            self.db_connection_string,
+            self.db_name,
+            self.settings,
+            job_id,
+            self.queue
+        )
+
+    async def recover(self):
+        """
+        Enqueue jobs that were waiting or running when the server last stopped. Jobs with checkpoints resume after their
+        last completed stage.
+
+        """
+        self._durations.update(await virtool.jobs.db.get_durations(self.db))
+
+        for job_id in await virtool.jobs.db.recover(self.db):
+            logging.info(f"Recovering job {job_id}")
+            await self.enqueue(job_id)
+
     async def enqueue(self, job_id):
-        document = await self.db.jobs.find_one(job_id, ["task", "args", "proc", "mem"])
+        document = await self.db.jobs.find_one(job_id, ["task", "args", "proc", "mem", "user"])
 
         task_name = document["task"]
 
@@ -119,21 +252,64 @@ class IntegratedManager:
             "task_name": task_name,
             "task_args": document["args"],
             "proc": document["proc"],
-            "mem": document["mem"]
+            "mem": document["mem"],
+            "priority": TASK_PRIORITIES[task_name],
+            "user_id": document["user"]["id"],
+            "enqueued_at": time.monotonic(),
+            "started_at": None
         }
 
-    async def dispatch(self, interface, operation, id_list):
+        self._wake.set()
 
-        if operation == "delete":
-            await self._dispatch(interface, operation, id_list)
+    def get_queue(self) -> dict:
+        """
+        Get the position of each waiting job in the queue and an estimate of when it will start. Estimates are ``None``
+        if they can't be made yet.
 
-        collection = getattr(self.db, interface)
+        :return: a dict of job IDs and dicts containing ``position`` and ``estimated_start``
 
-        projection = self.db.get_projection(interface)
-        apply_processor = self.db.get_processor(interface)
+        """
+        now = time.monotonic()
+        timestamp = virtool.utils.timestamp()
 
-        async for document in collection.find({"_id": {"$in": id_list}}, projection=projection):
-            await self._dispatch(interface, operation, await apply_processor(document))
+        order = [job_id for job_id in order_jobs(self._jobs, self.settings, now) if all(
+            self._jobs[job_id][key] <= self.settings[key] for key in ("proc", "mem")
+        )]
+
+        estimates = estimate_starts(
+            self._jobs,
+            order,
+            get_available_resources(self.settings, self._jobs),
+            self._durations,
+            now
+        )
+
+        queue = dict()
+
+        for position, job_id in enumerate(order, 1):
+            estimate = estimates[job_id]
+
+            queue[job_id] = {
+                "position": position,
+                "estimated_start": None if estimate is None else timestamp + datetime.timedelta(seconds=estimate)
+            }
+
+        return queue
+
+    async def dispatch_pending(self):
+        """
+        Dispatch all messages waiting in :attr:`.queue`. Messages are merged by :class:`~virtool.jobs.channel.Channel`.
+
+        Jobs inserted by other jobs are enqueued. See :meth:`virtool.jobs.analysis.Job.hand_off`.
+
+        """
+        groups = self.channel.drain()
+
+        for job_id in groups.get(("jobs", "insert"), list()):
+            if job_id not in self._jobs:
+                await self.enqueue(job_id)
+
+        await dispatch_groups(self.db, self._dispatch, groups)
 
     async def cancel(self, job_id):
         """
@@ -151,6 +327,253 @@ class IntegratedManager:
             else:
                 await virtool.jobs.db.cancel(self.db, job_id)
                 del self._jobs[job_id]
+                self._wake.set()
+
+
+async def dispatch_groups(db, dispatch, groups: dict):
+    """
+    Dispatch the documents for merged dispatch messages. The documents for each interface are fetched with a single
+    query. The ID lists of ``delete`` operations are also dispatched as they are.
+
+    :param db: the application database interface
+    :param dispatch: the application dispatcher's :meth:`.dispatch` method
+    :param groups: ID lists keyed by interface and operation as returned by :func:`virtool.jobs.channel.coalesce`
+
+    """
+    interfaces = dict()
+
+    for (interface, operation), id_list in groups.items():
+        if operation == "delete":
+            await dispatch(interface, operation, id_list)
+
+        interfaces.setdefault(interface, dict())[operation] = id_list
+
+    for interface, operations in interfaces.items():
+        collection = getattr(db, interface)
+
+        projection = db.get_projection(interface)
+        apply_processor = db.get_processor(interface)
+
+        id_list = list({id_: None for ids in operations.values() for id_ in ids})
+
+        documents = dict()
+
+        async for document in collection.find({"_id": {"$in": id_list}}, projection=projection):
+            document_id = document["_id"]
+            documents[document_id] = await apply_processor(document)
+
+        for operation, ids in operations.items():
+            for id_ in ids:
+                if id_ in documents:
+                    await dispatch(interface, operation, documents[id_])
+
+
+def get_share(user_id: str, running: dict, settings: dict) -> float:
+    """
+    Get the share of the host a user is entitled to at the moment. A user's share shrinks with each of their running
+    jobs.
+
+    :param user_id: the user ID
+    :param running: the number of running jobs for each user
+    :param settings: the application settings
+    :return: the share
+
+    """
+    return settings["job_user_weights"].get(user_id, 1) / (1 + running.get(user_id, 0))
+
+
+def get_running_counts(jobs: dict) -> dict:
+    running = defaultdict(int)
+
+    for job in jobs.values():
+        if job["process"]:
+            running[job["user_id"]] += 1
+
+    return running
+
+
+def order_jobs(jobs: dict, settings: dict, now: float) -> list:
+    """
+    Get the IDs of the waiting jobs in the order they should be started according to the ``job_policy`` setting.
+
+    ``fifo`` orders jobs by the time they were enqueued and ``priority`` orders them by :data:`TASK_PRIORITIES`.
+
+    ``fair`` takes jobs from users in turn. Each job is scored by the share of its user, weighted by the
+    ``job_task_weights`` setting for its task. The highest scoring job is taken next and its user's share shrinks as if
+    the job had started. Waiting jobs gain ``job_aging_rate`` points for every minute they have waited, so jobs from
+    users with small shares are not starved.
+
+    :param jobs: the tracked jobs
+    :param settings: the application settings
+    :param now: the current :func:`time.monotonic` time
+    :return: the ordered job IDs
+
+    """
+    waiting = [(job_id, job) for job_id, job in jobs.items() if not job["process"]]
+
+    policy = settings["job_policy"]
+
+    if policy == "fifo":
+        return [job_id for job_id, _ in waiting]
+
+    if policy == "priority":
+        return [job_id for job_id, _ in sorted(waiting, key=lambda item: -item[1]["priority"])]
+
+    task_weights = settings["job_task_weights"]
+    aging_rate = settings["job_aging_rate"]
+
+    running = get_running_counts(jobs)
+
+    def get_score(job, share):
+        return share * task_weights.get(job["task_name"], 1) + aging_rate * (now - job["enqueued_at"]) / 60
+
+    # The order of each user's jobs is fixed using their share at the start of the pass. This only needs to compare
+    # the next job of each user as the order is built.
+    by_user = defaultdict(list)
+
+    for job_id, job in waiting:
+        by_user[job["user_id"]].append((job_id, job))
+
+    for user_id, user_jobs in by_user.items():
+        share = get_share(user_id, running, settings)
+        by_user[user_id] = deque(sorted(user_jobs, key=lambda item: -get_score(item[1], share)))
+
+    ordered = list()
+
+    while by_user:
+        user_id = max(by_user, key=lambda u: get_score(by_user[u][0][1], get_share(u, running, settings)))
+
+        ordered.append(by_user[user_id].popleft()[0])
+
+        running[user_id] += 1
+
+        if not by_user[user_id]:
+            del by_user[user_id]
+
+    return ordered
+
+
+def select_jobs(jobs: dict, available: dict, settings: dict, now: float) -> list:
+    """
+    Choose the waiting jobs to start given the ``available`` resources.
+
+    Waiting jobs are considered in the order returned by :func:`order_jobs`. Every job that fits in the remaining
+    resources is selected. Jobs from users that already have ``job_user_limit`` running jobs are passed over. A limit of
+    ``0`` allows any number of jobs.
+
+    Jobs that fit are allowed to start ahead of the first job that does not fit, but only until that job has waited for
+    ``job_backfill_wait`` seconds. After that, no more jobs are selected until the blocked job has started, so it can't
+    be starved by a stream of smaller jobs. Jobs that could never fit on the host are skipped.
+
+    :param jobs: the tracked jobs
+    :param available: the available ``proc`` and ``mem``
+    :param settings: the application settings
+    :param now: the current :func:`time.monotonic` time
+    :return: the IDs of the jobs to start
+
+    """
+    user_limit = settings["job_user_limit"]
+
+    running = get_running_counts(jobs)
+
+    remaining = dict(available)
+    selected = list()
+
+    for job_id in order_jobs(jobs, settings, now):
+        job = jobs[job_id]
+
+        if any(job[key] > settings[key] for key in ("proc", "mem")):
+            continue
+
+        if user_limit and running[job["user_id"]] >= user_limit:
+            continue
+
+        if all(job[key] <= remaining[key] for key in ("proc", "mem")):
+            selected.append(job_id)
+
+            running[job["user_id"]] += 1
+
+            for key in ("proc", "mem"):
+                remaining[key] -= job[key]
+
+            continue
+
+        if now - job["enqueued_at"] >= settings["job_backfill_wait"]:
+            break
+
+    return selected
+
+
+def estimate_starts(jobs: dict, order: list, available: dict, durations: dict, now: float) -> dict:
+    """
+    Estimate how many seconds from ``now`` each waiting job will start by simulating the queue. Running jobs are
+    expected to take the mean duration of their task in ``durations``.
+
+    Estimates are ``None`` for jobs that are waiting on a job with no known duration. Per-user limits and backfilling
+    are not taken into account.
+
+    :param jobs: the tracked jobs
+    :param order: the order waiting jobs will start in
+    :param available: the available ``proc`` and ``mem``
+    :param durations: the mean duration of each task in seconds
+    :param now: the current :func:`time.monotonic` time
+    :return: the estimated seconds until each job in ``order`` starts
+
+    """
+    free = dict(available)
+
+    # The expected end time and resources of each running or simulated job.
+    ends = list()
+
+    for job in jobs.values():
+        duration = durations.get(job["task_name"])
+
+        if job["process"] and duration is not None:
+            heapq.heappush(ends, (max(job["started_at"] + duration - now, 0), job["proc"], job["mem"]))
+
+    estimates = dict()
+
+    elapsed = 0
+
+    for job_id in order:
+        job = jobs[job_id]
+
+        while ends and any(job[key] > free[key] for key in ("proc", "mem")):
+            end, proc, mem = heapq.heappop(ends)
+
+            elapsed = max(elapsed, end)
+
+            free["proc"] += proc
+            free["mem"] += mem
+
+        if any(job[key] > free[key] for key in ("proc", "mem")):
+            estimates.update(dict.fromkeys(order[len(estimates):]))
+            break
+
+        estimates[job_id] = elapsed
+
+        free["proc"] -= job["proc"]
+        free["mem"] -= job["mem"]
+
+        duration = durations.get(job["task_name"])
+
+        if duration is not None:
+            heapq.heappush(ends, (elapsed + duration, job["proc"], job["mem"]))
+
+    return estimates
+
+
+def update_duration(durations: dict, task_name: str, duration: float):
+    """
+    Update the mean duration of ``task_name`` with the duration of a finished job. Recent jobs are given more weight.
+
+    """
+    previous = durations.get(task_name)
+
+    if previous is None:
+        durations[task_name] = duration
+    else:
+        durations[task_name] = previous + DURATION_SMOOTHING * (duration - previous)
 
 
 def get_available_resources(settings, jobs):
@@ -4,14 +4,19 @@ Job class and functions for NuVs.
 """
 import collections
 import os
+import re
 import shlex
 import shutil
 import tempfile
+from typing import Optional
 
 import virtool.bio
 import virtool.db.sync
 import virtool.jobs.analysis
 
+#: Matches the SPAdes output line written when the assembler starts for a k-mer size.
+SPADES_K_PATTERN = re.compile(rb"(?:Running assembler: |===== )K(\d+)")
+
 
 class SubprocessError(Exception):
     pass
@@ -67,7 +72,7 @@ class Job(virtool.jobs.analysis.Job):
             "-U", ",".join(self.params["read_paths"])
         ]
 
-        self.run_subprocess(command)
+        self.run_subprocess(command, input_paths=self.params["read_paths"])
 
     def eliminate_subtraction(self):
         """
@@ -86,7 +91,7 @@ class Job(virtool.jobs.analysis.Job):
             "-U", os.path.join(self.params["analysis_path"], "unmapped_otus.fq"),
         ]
 
-        self.run_subprocess(command)
+        self.run_subprocess(command, input_paths=[os.path.join(self.params["analysis_path"], "unmapped_otus.fq")])
 
     def reunite_pairs(self):
         if self.params["paired"]:
@@ -113,7 +118,7 @@ class Job(virtool.jobs.analysis.Job):
         """
         command = [
             "spades.py",
-            "-t", str(self.proc - 1),
+            "-t", str(self.get_tool_threads()),
             "-m", str(self.mem)
         ]
 
@@ -141,9 +146,16 @@ class Job(virtool.jobs.analysis.Job):
             "-k", k
         ]
 
+        k_values = k.split(",")
+
         def stdout_handler(line):
             self.add_log(line.rstrip(), indent=4)
 
+            fraction = find_spades_progress(line, k_values)
+
+            if fraction is not None:
+                self.report_progress(fraction)
+
         try:
             self.run_subprocess(command, stdout_handler=stdout_handler)
         except SubprocessError:
@@ -242,7 +254,7 @@ class Job(virtool.jobs.analysis.Job):
             "hmmscan",
             "--tblout", tsv_path,
             "--noali",
-            "--cpu", str(self.proc - 1),
+            "--cpu", str(self.get_tool_threads()),
             os.path.join(self.params["analysis_path"], "profiles.hmm"),
             os.path.join(self.params["analysis_path"], "orfs.fa")
         ]
@@ -300,9 +312,11 @@ class Job(virtool.jobs.analysis.Job):
             self.results
         )
 
+        attached_ids = self.share_results()
+
         virtool.db.sync.recalculate_workflow_tags(self.db, sample_id)
 
-        self.dispatch("analyses", "update", [analysis_id])
+        self.dispatch("analyses", "update", [analysis_id, *attached_ids])
         self.dispatch("samples", "update", [sample_id])
 
     def cleanup(self):
@@ -312,3 +326,27 @@ class Job(virtool.jobs.analysis.Job):
             self.temp_dir.cleanup()
         except AttributeError:
             pass
+
+
+def find_spades_progress(line: bytes, k_values: list) -> Optional[float]:
+    """
+    Find the fraction of the assembly that is complete from a line of SPAdes output. SPAdes runs the assembler once for
+    each k-mer size in ``k_values``. The fraction increases as each one starts.
+
+    :param line: a line of SPAdes output
+    :param k_values: the k-mer sizes passed to SPAdes as strings
+    :return: the fraction complete or ``None`` if the line does not indicate progress
+
+    """
+    if line.startswith(b"===== Assembling finished"):
+        return 1
+
+    match = SPADES_K_PATTERN.search(line)
+
+    if match:
+        try:
+            return k_values.index(match.group(1).decode()) / len(k_values)
+        except ValueError:
+            return None
+
+    return None
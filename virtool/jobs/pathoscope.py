@@ -5,15 +5,19 @@ Functions and job classes for sample analysis.
 import os
 import shlex
 
+import numpy as np
+
 import virtool.caches.db
 import virtool.db.sync
 import virtool.jobs.analysis
 import virtool.jobs.job
+import virtool.jobs.sam
 import virtool.jobs.utils
 import virtool.otus.utils
 import virtool.pathoscope
 import virtool.samples.db
 import virtool.samples.utils
+import virtool.vtb
 
 TRIMMING_PROGRAM = "skewer-0.2.2"
 
@@ -41,12 +45,15 @@ class Job(virtool.jobs.analysis.Job):
             self.build_isolate_index,
             self.map_isolates,
             self.map_subtraction,
-            self.subtract_mapping,
             self.pathoscope,
             self.import_results,
             self.cleanup_indexes
         ]
 
+        # No stage dependencies are declared, so the stages run in order. Each mapping uses the output of the one
+        # before it, and every step of the fused Pathoscope pass after loading the hits depends on the subtraction
+        # scores.
+
     def map_default_isolates(self):
         """
         Using ``bowtie2``, maps reads to the main otu reference. This mapping is used to identify candidate otus.
@@ -66,30 +73,16 @@ class Job(virtool.jobs.analysis.Job):
 
         to_otus = set()
 
-        def stdout_handler(line):
-            line = line.decode()
-
-            if line[0] == "#" or line[0] == "@":
-                return
-
-            fields = line.split("\t")
-
-            # Bitwise FLAG - 0x4: segment unmapped
-            if int(fields[1]) & 0x4 == 4:
-                return
-
-            ref_id = fields[2]
-
-            if ref_id == "*":
-                return
-
-            # Skip if the p_score does not meet the minimum cutoff.
-            if virtool.pathoscope.find_sam_align_score(fields) < 0.01:
-                return
-
-            to_otus.add(ref_id)
+        def stdout_handler(chunk):
+            batch = virtool.jobs.sam.parse_batch(chunk, ("rname",), min_score=0.01)
+            to_otus.update(batch["rname"])
 
-        self.run_subprocess(command, stdout_handler=stdout_handler)
+        self.run_subprocess(
+            command,
+            stdout_handler=stdout_handler,
+            buffered=True,
+            input_paths=self.params["read_paths"]
+        )
 
         self.intermediate["to_otus"] = to_otus
 
@@ -149,7 +142,7 @@ class Job(virtool.jobs.analysis.Job):
         """
         command = [
             "bowtie2",
-            "-p", str(self.proc - 1),
+            "-p", str(self.get_tool_threads()),
             "--no-unal",
             "--local",
             "--score-min", "L,20,1.0",
@@ -161,39 +154,22 @@ class Job(virtool.jobs.analysis.Job):
             "-U", ",".join(self.params["read_paths"])
         ]
 
-        with open(os.path.join(self.params["analysis_path"], "to_isolates.vta"), "w") as f:
-            def stdout_handler(line, p_score_cutoff=0.01):
-                line = line.decode()
-
-                if line[0] == "@" or line == "#":
-                    return
-
-                fields = line.split("\t")
-
-                # Bitwise FLAG - 0x4 : segment unmapped
-                if int(fields[1]) & 0x4 == 4:
-                    return
-
-                ref_id = fields[2]
-
-                if ref_id == "*":
-                    return
-
-                p_score = virtool.pathoscope.find_sam_align_score(fields)
-
-                # Skip if the p_score does not meet the minimum cutoff.
-                if p_score < p_score_cutoff:
-                    return
+        with virtool.vtb.Writer(os.path.join(self.params["analysis_path"], "to_isolates.vtb")) as writer:
+            def stdout_handler(chunk, p_score_cutoff=0.01):
+                batch = virtool.jobs.sam.parse_batch(
+                    chunk,
+                    ("qname", "rname", "pos", "length", "score"),
+                    min_score=p_score_cutoff
+                )
 
-                f.write(",".join([
-                    fields[0],  # read_id
-                    ref_id,
-                    fields[3],  # pos
-                    str(len(fields[9])),  # length
-                    str(p_score)
-                ]) + "\n")
+                writer.write_batch(batch["qname"], batch["rname"], batch["pos"], batch["length"], batch["score"])
 
-            self.run_subprocess(command, stdout_handler=stdout_handler)
+            self.run_subprocess(
+                command,
+                stdout_handler=stdout_handler,
+                buffered=True,
+                input_paths=self.params["read_paths"]
+            )
 
     def map_subtraction(self):
         """
@@ -205,91 +181,71 @@ class Job(virtool.jobs.analysis.Job):
             "bowtie2",
             "--local",
             "-N", "0",
-            "-p", str(self.proc - 1),
+            "-p", str(self.get_tool_threads()),
             "-x", shlex.quote(self.params["subtraction_path"]),
             "-U", os.path.join(self.params["analysis_path"], "mapped.fastq")
         ]
 
         to_subtraction = dict()
 
-        def stdout_handler(line):
-            line = line.decode()
+        def stdout_handler(chunk):
+            batch = virtool.jobs.sam.parse_batch(chunk, ("qname", "score"))
+            to_subtraction.update(zip(batch["qname"], batch["score"]))
 
-            if line[0] == "@" or line == "#":
-                return
-
-            fields = line.split("\t")
-
-            # Bitwise FLAG - 0x4 : segment unmapped
-            if int(fields[1]) & 0x4 == 4:
-                return
+        self.run_subprocess(
+            command,
+            stdout_handler=stdout_handler,
+            buffered=True,
+            input_paths=[os.path.join(self.params["analysis_path"], "mapped.fastq")]
+        )
 
-            # No ref_id assigned.
-            if fields[2] == "*":
-                return
+        self.intermediate["to_subtraction"] = to_subtraction
 
-            to_subtraction[fields[0]] = virtool.pathoscope.find_sam_align_score(fields)
+    def pathoscope(self):
+        """
+        Run host subtraction and the Pathoscope reassignment algorithm in a single pass over ``to_isolates.vtb`` using
+        :func:`virtool.pathoscope.run_fused`. Tab-separated output is written to ``report.tsv``. Results are also parsed
+        and saved to :attr:`intermediate`.
 
-        self.run_subprocess(command, stdout_handler=stdout_handler)
+        """
+        fused = virtool.pathoscope.run_fused(
+            virtool.vtb.ensure_vtb(self.params["analysis_path"], "to_isolates"),
+            self.intermediate.pop("to_subtraction"),
+            self.intermediate["ref_lengths"],
+            accelerate=self.settings.get("pathoscope_accelerate_em", False)
+        )
 
-        self.intermediate["to_subtraction"] = to_subtraction
+        em = fused["em"]
 
-    def subtract_mapping(self):
-        subtracted_count = virtool.pathoscope.subtract(
-            self.params["analysis_path"],
-            self.intermediate["to_subtraction"]
+        self.add_log(
+            f"EM finished after {em['iterations']} iterations ({em['evaluations']} EM steps) in {em['duration']:.3f}s "
+            f"with delta {em['delta']}"
         )
 
-        del self.intermediate["to_subtraction"]
-
-        self.results["subtracted_count"] = subtracted_count
+        self.results["subtracted_count"] = fused["subtracted_count"]
 
-    def pathoscope(self):
-        """
-        Run the Pathoscope reassignment algorithm. Tab-separated output is written to ``pathoscope.tsv``. Results are
-        also parsed and saved to :attr:`intermediate`.
+        # Convergence telemetry is stored on the analysis document by import_results.
+        self.results["em"] = em
 
-        """
-        vta_path = os.path.join(self.params["analysis_path"], "to_isolates.vta")
-        reassigned_path = os.path.join(self.params["analysis_path"], "reassigned.vta")
-
-        (
-            best_hit_initial_reads,
-            best_hit_initial,
-            level_1_initial,
-            level_2_initial,
-            best_hit_final_reads,
-            best_hit_final,
-            level_1_final,
-            level_2_final,
-            init_pi,
-            pi,
-            refs,
-            reads
-        ) = run_patho(vta_path, reassigned_path)
-
-        read_count = len(reads)
+        read_count = fused["read_count"]
 
         report = virtool.pathoscope.write_report(
             os.path.join(self.params["analysis_path"], "report.tsv"),
-            pi,
-            refs,
+            fused["pi"],
+            fused["refs"],
             read_count,
-            init_pi,
-            best_hit_initial,
-            best_hit_initial_reads,
-            best_hit_final,
-            best_hit_final_reads,
-            level_1_initial,
-            level_2_initial,
-            level_1_final,
-            level_2_final
+            fused["init_pi"],
+            fused["best_hit_initial"],
+            fused["best_hit_initial_reads"],
+            fused["best_hit_final"],
+            fused["best_hit_final_reads"],
+            fused["level_1_initial"],
+            fused["level_2_initial"],
+            fused["level_1_final"],
+            fused["level_2_final"]
         )
 
-        self.intermediate["coverage"] = virtool.pathoscope.calculate_coverage(
-            reassigned_path,
-            self.intermediate["ref_lengths"]
-        )
+        self.intermediate["coverage"] = fused["coverage"]
 
         self.results.update({
             "ready": True,
@@ -314,13 +270,13 @@ class Job(virtool.jobs.analysis.Job):
             hit_coverage = self.intermediate["coverage"][ref_id]
 
             # Attach coverage list to hit dict.
-            hit["align"] = hit_coverage
+            hit["align"] = hit_coverage.tolist()
 
             # Calculate coverage and attach to hit.
-            hit["coverage"] = round(1 - hit_coverage.count(0) / len(hit_coverage), 3)
+            hit["coverage"] = round(1 - (len(hit_coverage) - np.count_nonzero(hit_coverage)) / len(hit_coverage), 3)
 
             # Calculate depth and attach to hit.
-            hit["depth"] = round(sum(hit_coverage) / len(hit_coverage))
+            hit["depth"] = round(int(hit_coverage.sum()) / len(hit_coverage))
 
             self.results["results"].append(hit)
 
@@ -352,47 +308,13 @@ class Job(virtool.jobs.analysis.Job):
             results
         )
 
+        attached_ids = self.share_results()
+
         virtool.db.sync.recalculate_workflow_tags(self.db, sample_id)
 
-        self.dispatch("analyses", "update", [analysis_id])
+        self.dispatch("analyses", "update", [analysis_id, *attached_ids])
         self.dispatch("samples", "update", [sample_id])
 
     def cleanup_indexes(self):
         pass
 
-
-def run_patho(vta_path, reassigned_path):
-    u, nu, refs, reads = virtool.pathoscope.build_matrix(vta_path)
-
-    best_hit_initial_reads, best_hit_initial, level_1_initial, level_2_initial = virtool.pathoscope.compute_best_hit(
-        u,
-        nu,
-        refs,
-        reads
-    )
-
-    init_pi, pi, _, nu = virtool.pathoscope.em(u, nu, refs, 50, 1e-7, 0, 0)
-
-    best_hit_final_reads, best_hit_final, level_1_final, level_2_final = virtool.pathoscope.compute_best_hit(
-        u,
-        nu,
-        refs,
-        reads
-    )
-
-    virtool.pathoscope.rewrite_align(u, nu, vta_path, 0.01, reassigned_path)
-
-    return (
-        best_hit_initial_reads,
-        best_hit_initial,
-        level_1_initial,
-        level_2_initial,
-        best_hit_final_reads,
-        best_hit_final,
-        level_1_final,
-        level_2_final,
-        init_pi,
-        pi,
-        refs,
-        reads
-    )
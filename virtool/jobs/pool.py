@@ -0,0 +1,283 @@
+"""
+A pool of pre-forked worker processes for running jobs.
+
+Starting a new process for each job means paying for a fork, imports and a new database connection every time. This is
+a large share of the runtime of short jobs. A :class:`Worker` is started once and runs jobs one at a time in its own
+process, reusing its imported modules and database client.
+
+Each worker runs a single job at a time, so signals sent to a worker only affect its current job. ``SIGTERM`` cancels
+the job and ``SIGUSR1`` stops it for shutdown, the same as for a job running in its own process. Both are ignored while
+the worker is idle.
+
+"""
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Optional
+
+import virtool.jobs.channel
+import virtool.jobs.classes
+import virtool.jobs.job
+import virtool.utils
+
+logger = logging.getLogger(__name__)
+
+#: The number of jobs a worker runs before it exits and is replaced. This limits the effect of memory leaks.
+MAX_JOBS = 100
+
+
+class Worker(multiprocessing.Process):
+    """
+    A long-lived process that receives job IDs and settings over a pipe and runs the jobs one at a time.
+
+    The ID of each finished job is sent back over the pipe. Sending ``None`` stops the worker once its current job is
+    finished.
+
+    :param db_connection_string: the MongoDB connection string for the application database server
+    :param db_name: the name of the application MongoDB database
+    :param q: the queue jobs use to send dispatch instructions to the API server
+    :param max_jobs: the number of jobs to run before exiting
+
+    """
+
+    def __init__(self, db_connection_string: str, db_name: str, q, max_jobs: int = MAX_JOBS):
+        super().__init__()
+
+        self.db_connection_string = db_connection_string
+        self.db_name = db_name
+        self.q = q
+        self.max_jobs = max_jobs
+
+        #: The ID of the job the worker is running. Only tracked in the parent process. See :meth:`.poll`.
+        self.job_id = None
+
+        self._child_conn, self.conn = multiprocessing.Pipe()
+
+    def run(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+        db = virtool.jobs.job.get_db_client(self.db_connection_string)[self.db_name]
+
+        for _ in range(self.max_jobs):
+            try:
+                message = self._child_conn.recv()
+            except EOFError:
+                break
+
+            if message is None:
+                break
+
+            job_id, settings = message
+
+            try:
+                self.run_job(db, job_id, settings)
+            except Exception:
+                logger.exception(f"Could not run job {job_id}")
+
+            # The job ID is always sent back so the worker is not considered busy with a job that has ended.
+            self._child_conn.send(job_id)
+
+    def run_job(self, db, job_id: str, settings: dict):
+        """
+        Run a single job in the worker process. ``SIGTERM`` and ``SIGUSR1`` only stop the job while it is running.
+
+        :param db: the worker's database client
+        :param job_id: the ID of the job to run
+        :param settings: the application settings when the job was submitted
+
+        """
+        # Signals received before the job installs its own handlers still stop it.
+        signal.signal(signal.SIGTERM, virtool.jobs.job.handle_sigterm)
+        signal.signal(signal.SIGUSR1, virtool.jobs.job.handle_shutdown)
+
+        try:
+            try:
+                task_name = db.jobs.find_one(job_id, ["task"])["task"]
+
+                job = virtool.jobs.classes.TASK_CLASSES[task_name](
+                    self.db_connection_string,
+                    self.db_name,
+                    settings,
+                    job_id,
+                    self.q
+                )
+
+                job.run()
+            finally:
+                signal.signal(signal.SIGTERM, signal.SIG_IGN)
+                signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        except virtool.jobs.job.TerminationError:
+            cancel(db, job_id)
+            virtool.jobs.channel.send(self.q, "jobs", "update", [job_id])
+        except virtool.jobs.job.ShutdownError:
+            pass
+
+    def poll(self):
+        """
+        Check for finished jobs. Called in the parent process.
+
+        """
+        try:
+            while self.conn.poll():
+                if self.conn.recv() == self.job_id:
+                    self.job_id = None
+        except (EOFError, OSError):
+            self.job_id = None
+
+    def submit(self, job_id: str, settings: dict):
+        """
+        Send a job to the worker. Called in the parent process.
+
+        The settings are sent with each job, so changes made after the worker was started reach the job.
+
+        :param job_id: the ID of the job to run
+        :param settings: the current application settings
+
+        """
+        self.job_id = job_id
+        self.conn.send((job_id, dict(settings)))
+
+    def stop(self):
+        """
+        Stop the worker once its current job is finished. Called in the parent process.
+
+        """
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+
+class PooledJob:
+    """
+    A handle for a job run by a :class:`Worker`. Provides the parts of the :class:`multiprocessing.Process` interface
+    used by :class:`~virtool.jobs.manager.IntegratedManager`.
+
+    :param worker: the worker that will run the job
+    :param job_id: the job ID
+    :param settings: the application settings
+
+    """
+
+    def __init__(self, worker: Worker, job_id: str, settings: dict):
+        self.worker = worker
+        self.job_id = job_id
+        self.settings = settings
+
+    @property
+    def pid(self) -> int:
+        return self.worker.pid
+
+    @property
+    def sentinel(self) -> int:
+        """
+        A file descriptor that becomes readable when the worker finishes a job or exits. Like
+        :attr:`multiprocessing.Process.sentinel`, it can be waited on to find out when the job has ended.
+
+        """
+        return self.worker.conn.fileno()
+
+    def start(self):
+        self.worker.submit(self.job_id, self.settings)
+
+    def is_alive(self) -> bool:
+        self.worker.poll()
+        return self.worker.job_id == self.job_id and self.worker.is_alive()
+
+    def terminate(self):
+        """
+        Cancel the job by sending ``SIGTERM`` to the worker. Nothing happens if the worker has moved on from the job.
+
+        """
+        if self.is_alive():
+            os.kill(self.worker.pid, signal.SIGTERM)
+
+
+class WorkerPool:
+    """
+    A fixed number of :class:`Worker` processes. Workers that have exited are replaced as jobs are acquired.
+
+    :param size: the number of workers
+    :param db_connection_string: the MongoDB connection string for the application database server
+    :param db_name: the name of the application MongoDB database
+    :param settings: the application settings. Jobs get the settings as they are when the job is started.
+    :param q: the queue jobs use to send dispatch instructions to the API server
+
+    """
+
+    def __init__(self, size: int, db_connection_string: str, db_name: str, settings: dict, q):
+        self.size = size
+        self.db_connection_string = db_connection_string
+        self.db_name = db_name
+        self.settings = settings
+        self.q = q
+
+        self._workers = list()
+
+    def start(self):
+        self._workers = [self._create_worker() for _ in range(self.size)]
+
+    def acquire(self, job_id: str) -> Optional[PooledJob]:
+        """
+        Get a handle for running the job identified by ``job_id`` on an idle worker.
+
+        :param job_id: the job ID
+        :return: a job handle or ``None`` if all workers are busy
+
+        """
+        for index, worker in enumerate(self._workers):
+            worker.poll()
+
+            if not worker.is_alive():
+                worker = self._workers[index] = self._create_worker()
+
+            if worker.job_id is None:
+                return PooledJob(worker, job_id, self.settings)
+
+        return None
+
+    def close(self):
+        """
+        Stop all workers once their current jobs are finished.
+
+        """
+        for worker in self._workers:
+            worker.stop()
+
+    def _create_worker(self) -> Worker:
+        worker = Worker(self.db_connection_string, self.db_name, self.q)
+        worker.start()
+
+        return worker
+
+
+def cancel(db, job_id: str):
+    """
+    Put a job that was cancelled before it could handle the signal itself into the cancelled state. Jobs that have
+    already finished are not changed.
+
+    :param db: the application database client
+    :param job_id: the ID of the job
+
+    """
+    document = db.jobs.find_one(job_id, ["status"])
+
+    latest = document["status"][-1]
+
+    if latest["state"] not in ("waiting", "running"):
+        return
+
+    db.jobs.update_one({"_id": job_id}, {
+        "$push": {
+            "status": {
+                "state": "cancelled",
+                "stage": latest["stage"],
+                "error": None,
+                "progress": latest["progress"],
+                "timestamp": virtool.utils.timestamp()
+            }
+        }
+    })
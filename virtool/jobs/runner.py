@@ -0,0 +1,386 @@
+"""
+Running jobs on standalone runners instead of in the API server.
+
+A runner is started with ``python run.py runner``. Any number of runners can share a database, on one host or many, as
+long as they share the data path. The API server must be started with ``--job-runners`` so it leaves waiting jobs to
+the runners. In that mode, the server uses a :class:`RemoteManager` instead of the
+:class:`~virtool.jobs.manager.IntegratedManager`.
+
+Runners poll the ``jobs`` collection for waiting jobs that fit in their ``proc`` and ``mem`` limits. They claim a job
+by creating a lease document in the ``job_leases`` collection with the job ID as its ``_id``. Only one runner can
+insert the lease, so a job is never claimed twice. A runner renews the leases of its jobs every
+:data:`HEARTBEAT_INTERVAL` seconds. A lease that hasn't been renewed for :data:`LEASE_DURATION` seconds belongs to a
+runner that has died. Another runner can take it over and resume the job from its last checkpoint.
+
+Jobs send dispatch messages to the API server through the ``job_messages`` collection using a :class:`Transport`.
+
+Cancelling a job sets ``cancel`` on its lease. Runners check for cancelled jobs with each heartbeat.
+
+Job processes are not stopped if their runner is killed with ``SIGKILL``. Stop the runner's whole process group, as
+container runtimes and process supervisors do, so an orphaned job can't run alongside the runner that takes it over.
+
+"""
+import asyncio
+import datetime
+import logging
+import os
+import signal
+import socket
+import time
+
+import pymongo
+import pymongo.errors
+
+import virtool.jobs.channel
+import virtool.jobs.classes
+import virtool.jobs.db
+import virtool.jobs.manager
+import virtool.jobs.pool
+import virtool.utils
+
+logger = logging.getLogger(__name__)
+
+#: The number of seconds a lease stays valid without a heartbeat.
+LEASE_DURATION = 30
+
+#: The number of seconds between lease renewals.
+HEARTBEAT_INTERVAL = 5
+
+#: The number of seconds between checks for waiting jobs.
+POLL_INTERVAL = 1
+
+
+class Transport:
+    """
+    A replacement for the :class:`multiprocessing.Queue` passed to jobs as ``q``. Dispatch messages are inserted into
+    the ``job_messages`` collection, where the API server picks them up.
+
+    The database client is created the first time a message is sent in each process, so the transport can be created
+    before job processes are forked.
+
+    :param db_connection_string: the MongoDB connection string for the application database server
+    :param db_name: the name of the application MongoDB database
+
+    """
+
+    def __init__(self, db_connection_string: str, db_name: str):
+        self.db_connection_string = db_connection_string
+        self.db_name = db_name
+
+        self._collection = None
+        self._pid = None
+
+    def put(self, message: tuple):
+        if self._pid != os.getpid():
+            self._collection = pymongo.MongoClient(self.db_connection_string)[self.db_name].job_messages
+            self._pid = os.getpid()
+
+        interface, operation, id_list, sent_at = message
+
+        self._collection.insert_one({
+            "interface": interface,
+            "operation": operation,
+            "id_list": id_list,
+            "sent_at": sent_at
+        })
+
+
+def acquire_lease(db, job_id: str, runner_id: str):
+    """
+    Try to claim the job identified by ``job_id`` for the runner identified by ``runner_id``. Succeeds if the job has
+    no lease or its lease has expired.
+
+    :param db: the application database client
+    :param job_id: the job ID
+    :param runner_id: the runner ID
+    :return: the lease document or ``None`` if the job was claimed by another runner
+
+    """
+    now = virtool.utils.timestamp()
+    expires_at = now + datetime.timedelta(seconds=LEASE_DURATION)
+
+    try:
+        lease = {
+            "_id": job_id,
+            "runner": runner_id,
+            "expires_at": expires_at,
+            "cancel": False
+        }
+
+        db.job_leases.insert_one(lease)
+
+        return lease
+    except pymongo.errors.DuplicateKeyError:
+        return db.job_leases.find_one_and_update(
+            {"_id": job_id, "expires_at": {"$lte": now}},
+            {"$set": {"runner": runner_id, "expires_at": expires_at}},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+
+
+def find_claimable(db) -> list:
+    """
+    Find waiting jobs and running jobs whose runners have stopped renewing their leases. Jobs are returned in the order
+    they were created.
+
+    :param db: the application database client
+    :return: job documents with ``task``, ``proc``, and ``mem`` fields
+
+    """
+    leased = db.job_leases.distinct("_id", {"expires_at": {"$gt": virtool.utils.timestamp()}})
+
+    documents = db.jobs.find({
+        "_id": {"$nin": leased},
+        "$expr": {
+            "$in": [{"$arrayElemAt": ["$status.state", -1]}, ["waiting", "running"]]
+        }
+    }, ["task", "proc", "mem", "status"])
+
+    return sorted(documents, key=lambda d: d["status"][0]["timestamp"])
+
+
+class Runner:
+    """
+    Claims and runs jobs until it receives ``SIGTERM`` or ``SIGINT``.
+
+    When the runner stops, its jobs are stopped with ``SIGUSR1`` and their leases are released. They keep their
+    checkpoints and are resumed by the next runner to claim them.
+
+    :param config: the runner configuration. ``proc`` and ``mem`` limit the jobs run at the same time.
+
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+
+        #: Identifies the runner in lease documents.
+        self.id = f"{socket.gethostname()}-{os.getpid()}"
+
+        # The database client is not shared with job processes. See :func:`virtool.jobs.job.get_db_client`.
+        self.db = pymongo.MongoClient(config["db_connection_string"])[config["db_name"]]
+
+        self.q = Transport(config["db_connection_string"], config["db_name"])
+
+        #: The jobs running on this runner keyed by job ID.
+        self._jobs = dict()
+
+        self._stopping = False
+        self._heartbeat_time = 0
+
+    def run(self):
+        logger.info(f"Started job runner {self.id}")
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while not self._stopping:
+            self.reap()
+
+            if time.monotonic() - self._heartbeat_time >= HEARTBEAT_INTERVAL:
+                self.heartbeat()
+
+            self.claim()
+
+            time.sleep(POLL_INTERVAL)
+
+        self.shutdown()
+
+        logger.info(f"Stopped job runner {self.id}")
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def get_available_resources(self) -> dict:
+        return {key: self.config[key] - sum(job[key] for job in self._jobs.values()) for key in ("proc", "mem")}
+
+    def claim(self):
+        """
+        Claim and start waiting jobs in the order they were created as long as they fit in the available resources.
+
+        """
+        available = self.get_available_resources()
+
+        settings = None
+
+        for document in find_claimable(self.db):
+            if any(document[key] > available[key] for key in ("proc", "mem")):
+                continue
+
+            job_id = document["_id"]
+
+            lease = acquire_lease(self.db, job_id, self.id)
+
+            if lease is None:
+                continue
+
+            if lease["cancel"]:
+                virtool.jobs.pool.cancel(self.db, job_id)
+                self.q.put(("jobs", "update", [job_id], time.time()))
+                self.release(job_id)
+                continue
+
+            if settings is None:
+                settings = {**self.config, **(self.db.settings.find_one("settings", {"_id": False}) or dict())}
+
+            process = virtool.jobs.classes.TASK_CLASSES[document["task"]](
+                self.config["db_connection_string"],
+                self.config["db_name"],
+                settings,
+                job_id,
+                self.q
+            )
+
+            process.start()
+
+            logger.info(f"Started job {job_id}")
+
+            self._jobs[job_id] = {
+                "process": process,
+                "proc": document["proc"],
+                "mem": document["mem"]
+            }
+
+            for key in ("proc", "mem"):
+                available[key] -= document[key]
+
+    def heartbeat(self):
+        """
+        Renew the leases of running jobs. Jobs that have been cancelled are terminated. Jobs whose leases were taken
+        over by another runner are killed.
+
+        """
+        self._heartbeat_time = time.monotonic()
+
+        expires_at = virtool.utils.timestamp() + datetime.timedelta(seconds=LEASE_DURATION)
+
+        for job_id, job in list(self._jobs.items()):
+            lease = self.db.job_leases.find_one_and_update(
+                {"_id": job_id, "runner": self.id},
+                {"$set": {"expires_at": expires_at}}
+            )
+
+            if lease is None:
+                logger.warning(f"Lost lease for job {job_id}")
+                job["process"].kill()
+                job["process"].join()
+                del self._jobs[job_id]
+
+            elif lease["cancel"]:
+                job["process"].terminate()
+
+    def reap(self):
+        """
+        Release the leases of jobs that have finished.
+
+        """
+        for job_id, job in list(self._jobs.items()):
+            if not job["process"].is_alive():
+                job["process"].join()
+                self.release(job_id)
+                del self._jobs[job_id]
+
+    def release(self, job_id: str):
+        self.db.job_leases.delete_one({"_id": job_id, "runner": self.id})
+
+    def shutdown(self):
+        """
+        Stop all running jobs with ``SIGUSR1`` and release their leases.
+
+        """
+        for job in self._jobs.values():
+            if job["process"].is_alive():
+                os.kill(job["process"].pid, signal.SIGUSR1)
+
+        for job_id, job in self._jobs.items():
+            job["process"].join()
+            self.release(job_id)
+
+        self._jobs.clear()
+
+
+class RemoteManager:
+    """
+    Takes the place of :class:`~virtool.jobs.manager.IntegratedManager` in the API server when jobs are run by
+    standalone runners. It dispatches messages sent by jobs and cancels jobs.
+
+    """
+
+    def __init__(self, app):
+        self._dispatch = app["dispatcher"].dispatch
+
+        self.db = app["db"]
+
+        #: Merges messages and measures their latency. Messages are read from the ``job_messages`` collection.
+        self.channel = virtool.jobs.channel.Channel(None)
+
+    async def run(self):
+        logging.debug("Started remote job manager")
+
+        try:
+            while True:
+                await self.dispatch_pending()
+                await asyncio.sleep(virtool.jobs.manager.TICK)
+        except asyncio.CancelledError:
+            pass
+
+        logging.debug("Closed remote job manager")
+
+    async def dispatch_pending(self):
+        documents = await self.db.job_messages.find().sort("_id", 1).to_list(None)
+
+        if not documents:
+            return
+
+        await self.db.job_messages.delete_many({"_id": {"$in": [d["_id"] for d in documents]}})
+
+        messages = [(d["interface"], d["operation"], d["id_list"], d["sent_at"]) for d in documents]
+
+        await virtool.jobs.manager.dispatch_groups(self.db, self._dispatch, self.channel.receive(messages))
+
+    async def enqueue(self, job_id: str):
+        """
+        Jobs are found by runners polling the database, so nothing needs to be done.
+
+        """
+        pass
+
+    async def cancel(self, job_id: str):
+        """
+        Cancel a job. Waiting jobs are cancelled immediately. Running jobs are terminated by their runner on its next
+        heartbeat.
+
+        :param job_id: the ID of the job to cancel
+
+        """
+        result = await self.db.job_leases.update_one({"_id": job_id}, {"$set": {"cancel": True}})
+
+        if result.matched_count:
+            return
+
+        # A lease with no expiry stops runners from claiming the job before it is cancelled.
+        try:
+            await self.db.job_leases.insert_one({"_id": job_id, "cancel": True})
+        except pymongo.errors.DuplicateKeyError:
+            # A runner claimed the job in the meantime.
+            await self.db.job_leases.update_one({"_id": job_id}, {"$set": {"cancel": True}})
+            return
+
+        await virtool.jobs.db.cancel(self.db, job_id)
+        await self.db.job_leases.delete_one({"_id": job_id})
+
+    def get_queue(self) -> dict:
+        """
+        Queue positions are not estimated for jobs run by runners.
+
+        """
+        return dict()
+
+
+def run(config: dict):
+    """
+    Run a job runner until it is stopped with ``SIGTERM`` or ``SIGINT``.
+
+    :param config: the application configuration
+
+    """
+    Runner(config).run()
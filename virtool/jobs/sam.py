@@ -0,0 +1,136 @@
+"""
+Fast parsing of Bowtie2 SAM output for mapping stages.
+
+Output is parsed from :class:`bytes` chunks as produced by :meth:`.Job.run_subprocess` in buffered mode. Only the
+fields used by the mapping stages are extracted. Header lines, unmapped records and records without a reference are
+skipped.
+
+"""
+from typing import Iterable
+
+#: The fields that can be extracted from each SAM record.
+FIELDS = ("qname", "flag", "rname", "pos", "length", "score")
+
+#: The SAM flag bit set for unmapped segments.
+UNMAPPED = 0x4
+
+AS_TAG = b"AS:i:"
+
+
+def find_score(optional: bytes, length: int) -> float:
+    """
+    Find the Bowtie2 alignment score in the ``optional`` fields of a SAM record and add the read ``length`` to it. Gives
+    the same result as :func:`virtool.pathoscope.find_sam_align_score`.
+
+    Bowtie2 writes ``AS:i`` as the first optional field, so it is checked for before searching the rest of the fields.
+
+    :param optional: the tab-separated optional fields of a record
+    :param length: the length of the read
+    :return: the alignment score
+
+    """
+    if optional.startswith(AS_TAG):
+        start = 5
+    else:
+        start = optional.find(b"\t" + AS_TAG) + 6
+
+        if start == 5:
+            raise ValueError("Could not find alignment score")
+
+    end = optional.find(b"\t", start)
+
+    return int(optional[start:end] if end != -1 else optional[start:]) + float(length)
+
+
+def parse_batch(chunk: bytes, fields: Iterable[str] = FIELDS, min_score: float = None) -> dict:
+    """
+    Parse the mapped records in a ``chunk`` of SAM lines into a columnar batch.
+
+    The batch is a :class:`dict` with a list for each of the requested ``fields``:
+
+    - ``qname``: the read ID as a :class:`str`
+    - ``flag``: the bitwise flag
+    - ``rname``: the reference ID as a :class:`str`
+    - ``pos``: the 1-based leftmost mapping position
+    - ``length``: the length of the read sequence
+    - ``score``: the alignment score as calculated by :func:`find_score`
+
+    :param chunk: complete SAM lines
+    :param fields: the fields to extract
+    :param min_score: skip records with a score lower than this value
+    :return: the batch
+
+    """
+    fields = set(fields)
+
+    unknown = fields - set(FIELDS)
+
+    if unknown:
+        raise ValueError(f"Unknown SAM fields: {', '.join(sorted(unknown))}")
+
+    qnames = list()
+    flags = list()
+    rnames = list()
+    positions = list()
+    lengths = list()
+    scores = list()
+
+    want_qname = "qname" in fields
+    want_flag = "flag" in fields
+    want_rname = "rname" in fields
+    want_pos = "pos" in fields
+    want_length = "length" in fields
+    want_score = "score" in fields or min_score is not None
+
+    for line in chunk.split(b"\n"):
+        # Skip empty lines and header lines starting with "@".
+        if not line or line[0] == 64:
+            continue
+
+        record = line.split(b"\t", 11)
+
+        flag = int(record[1])
+
+        if flag & UNMAPPED:
+            continue
+
+        rname = record[2]
+
+        if rname == b"*":
+            continue
+
+        length = len(record[9])
+
+        if want_score:
+            score = find_score(record[11] if len(record) == 12 else b"", length)
+
+            if min_score is not None and score < min_score:
+                continue
+
+            scores.append(score)
+
+        if want_qname:
+            qnames.append(record[0].decode())
+
+        if want_flag:
+            flags.append(flag)
+
+        if want_rname:
+            rnames.append(rname.decode())
+
+        if want_pos:
+            positions.append(int(record[3]))
+
+        if want_length:
+            lengths.append(length)
+
+    columns = {
+        "qname": qnames,
+        "flag": flags,
+        "rname": rnames,
+        "pos": positions,
+        "length": lengths,
+        "score": scores
+    }
+
+    return {field: columns[field] for field in FIELDS if field in fields}
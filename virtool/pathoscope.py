@@ -1,9 +1,16 @@
+import array
 import collections
 import copy
 import csv
+import itertools
 import math
 import os
 import shutil
+import time
+
+import numpy as np
+
+import virtool.vtb
 
 
 def rescale_samscore(u, nu, max_score, min_score):
@@ -134,6 +141,250 @@ def build_matrix(vta_path, p_score_cutoff=0.01):
     return u, nu, refs, reads
 
 
+def build_matrix_arrays(vta_path, p_score_cutoff=0.01):
+    """
+    Build a compact, array-backed read x reference matrix from the VTA file at ``vta_path``.
+
+    This is a low-memory alternative to :func:`build_matrix`. Read and reference IDs are interned to integers while the
+    file is streamed and scores are collected in typed :mod:`array` buffers. Read ID strings are discarded once the
+    file has been read.
+
+    Every read is a row in a single CSR matrix. Rows follow read order (the order reads first appear in the file) and
+    entries within a row follow the order the references first appear for that read. Reads with one distinct reference
+    are the uniquely mapped reads (``u``); all other rows are multi-mapping reads (``nu``).
+
+    The returned :class:`dict` has the keys:
+
+    - ``refs``: reference IDs in index order
+    - ``read_count``: the number of reads that passed ``p_score_cutoff``
+    - ``p_score_cutoff``: the cutoff used to build the matrix
+    - ``indptr``: row offsets into the entry arrays (``int64``, ``read_count + 1``)
+    - ``indices``: the reference index of each entry (``int32``)
+    - ``scores``: the rescaled score of each entry (``float64``)
+    - ``x_norm``: the normalized assignment of each entry (``float64``), updated by :func:`em_matrix`
+    - ``line_entries``: the entry index of every VTA line that passed the cutoff (``int64``)
+
+    Memory budget per alignment (VTA line):
+
+    - 20 bytes while streaming (``int64`` read index, ``int32`` reference index, ``float64`` score), plus one string
+      and one dict slot per distinct read for the read ID interning table
+    - about 90 bytes at peak while duplicate read-reference pairs are collapsed and entries are ordered
+    - 28 bytes retained (``int32`` index, two ``float64`` values and the ``int64`` line entry), plus 8 bytes per read
+      for ``indptr``
+
+    :param vta_path: the path to the VTA file
+    :param p_score_cutoff: lines with a score below this value are ignored
+    :return: the matrix as a dict of arrays
+
+    """
+    read_ids = dict()
+    ref_ids = dict()
+
+    refs = list()
+
+    line_reads = array.array("q")
+    line_refs = array.array("i")
+    line_scores = array.array("d")
+
+    with open(vta_path, "r") as handle:
+        for line in handle:
+            read_id, ref_id, _, _, p_score = line.rstrip().split(",")
+
+            p_score = float(p_score)
+
+            if p_score < p_score_cutoff:
+                continue
+
+            ref_index = ref_ids.get(ref_id)
+
+            if ref_index is None:
+                ref_index = ref_ids[ref_id] = len(refs)
+                refs.append(ref_id)
+
+            read_index = read_ids.get(read_id)
+
+            if read_index is None:
+                read_index = read_ids[read_id] = len(read_ids)
+
+            line_reads.append(read_index)
+            line_refs.append(ref_index)
+            line_scores.append(p_score)
+
+    read_count = len(read_ids)
+
+    del read_ids
+
+    return matrix_from_alignments(
+        np.frombuffer(line_reads, dtype=np.int64),
+        np.frombuffer(line_refs, dtype=np.int32),
+        np.frombuffer(line_scores, dtype=np.float64),
+        read_count,
+        refs,
+        p_score_cutoff
+    )
+
+
+def build_matrix_vtb(vtb_path, p_score_cutoff=0.01):
+    """
+    Build a matrix like :func:`build_matrix_arrays` from the memory-mapped columns of the VTB at ``vtb_path``.
+
+    Reads and references are re-interned in the order they first appear among the alignments that pass
+    ``p_score_cutoff`` so the matrix is identical to one built from the equivalent VTA file.
+
+    :param vtb_path: the path to the VTB
+    :param p_score_cutoff: alignments with a score below this value are ignored
+    :return: the matrix as a dict of arrays
+
+    """
+    columns = virtool.vtb.read_columns(vtb_path)
+
+    lines = np.flatnonzero(columns["score"] >= p_score_cutoff)
+
+    return matrix_from_columns(columns, lines, virtool.vtb.read_ids(vtb_path, "refs"), p_score_cutoff)
+
+
+def matrix_from_columns(columns, lines, ref_names, p_score_cutoff):
+    """
+    Build a matrix from the VTB ``columns`` rows selected by the ``lines`` indexes.
+
+    :param columns: the VTB columns
+    :param lines: the indexes of the alignments to include
+    :param ref_names: the interned reference IDs of the VTB
+    :param p_score_cutoff: the score cutoff that was used to select ``lines``
+    :return: the matrix as a dict of arrays
+
+    """
+    line_reads, read_order = intern_first_seen(columns["read"][lines])
+    line_refs, ref_order = intern_first_seen(columns["ref"][lines])
+
+    return matrix_from_alignments(
+        line_reads,
+        line_refs.astype(np.int32),
+        np.asarray(columns["score"][lines], dtype=np.float64),
+        len(read_order),
+        [ref_names[i] for i in ref_order.tolist()],
+        p_score_cutoff
+    )
+
+
+def intern_first_seen(values):
+    """
+    Re-number the integers in ``values`` in the order they first appear.
+
+    :param values: an array of integers
+    :return: the re-numbered array and the original value for each new number
+
+    """
+    unique, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+
+    order = np.argsort(first, kind="stable")
+
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+
+    return ranks[inverse.ravel()], unique[order]
+
+
+def matrix_from_alignments(line_reads, line_refs, line_scores, read_count, refs, p_score_cutoff):
+    """
+    Assemble the matrix returned by :func:`build_matrix_arrays` from per-alignment read indexes, reference indexes
+    and raw scores.
+
+    """
+    # Collapse duplicate read-reference pairs, keeping the first line for each pair. Then order the entries by read and
+    # by first appearance within each read.
+    keys = line_reads * max(len(refs), 1) + line_refs
+
+    keys, first_lines, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    order = np.lexsort((first_lines, line_reads[first_lines]))
+
+    entry_lines = first_lines[order]
+
+    del keys, first_lines
+
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+
+    line_entries = positions[inverse.ravel()]
+
+    del inverse, positions, order
+
+    indices = line_refs[entry_lines].copy()
+    scores = line_scores[entry_lines]
+
+    indptr = np.zeros(read_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(line_reads[entry_lines], minlength=read_count), out=indptr[1:])
+
+    del entry_lines
+
+    if len(scores):
+        # Like :func:`build_matrix`, rescale by the extreme scores of all lines, including duplicate pairs.
+        scores = rescale_scores(scores, max(line_scores.max(), 0), min(line_scores.min(), 0))
+
+        row_sums = np.add.reduceat(scores, indptr[:-1])
+        x_norm = scores / np.repeat(row_sums, np.diff(indptr))
+    else:
+        x_norm = scores.copy()
+
+    return {
+        "refs": refs,
+        "read_count": read_count,
+        "p_score_cutoff": p_score_cutoff,
+        "indptr": indptr,
+        "indices": indices,
+        "scores": scores,
+        "x_norm": x_norm,
+        "line_entries": line_entries
+    }
+
+
+def rescale_scores(scores, max_score, min_score):
+    """
+    Rescale an array of raw alignment scores. This is the array equivalent of :func:`rescale_samscore`.
+
+    :param scores: the raw scores
+    :param max_score: the maximum raw score
+    :param min_score: the minimum raw score
+    :return: a new array of rescaled scores
+
+    """
+    if min_score < 0:
+        scaling_factor = 100.0 / max_score - min_score
+        scores = scores - min_score
+    else:
+        scaling_factor = 100.0 / max_score
+
+    return np.exp(scores * scaling_factor)
+
+
+def split_matrix(matrix):
+    """
+    Split a matrix built by :func:`build_matrix_arrays` into its uniquely mapped and multi-mapping reads.
+
+    :param matrix: the matrix
+    :return: the unique read reference indexes and weights, the multi-mapping entry mask, and the multi-mapping CSR
+             ``indptr``
+
+    """
+    indptr = matrix["indptr"]
+
+    row_lengths = np.diff(indptr)
+    multi = row_lengths > 1
+
+    unique_entries = indptr[:-1][~multi]
+
+    u_refs = matrix["indices"][unique_entries]
+    u_weights = matrix["scores"][unique_entries]
+
+    nu_mask = np.repeat(multi, row_lengths)
+
+    nu_indptr = np.zeros(np.count_nonzero(multi) + 1, dtype=np.int64)
+    np.cumsum(row_lengths[multi], out=nu_indptr[1:])
+
+    return u_refs, u_weights, nu_mask, nu_indptr
+
+
 def em(u, nu, genomes, max_iter, epsilon, pi_prior, theta_prior):
     genome_count = len(genomes)
 
@@ -237,6 +488,410 @@ def em(u, nu, genomes, max_iter, epsilon, pi_prior, theta_prior):
     return init_pi, pi, theta, nu
 
 
+def build_csr(nu):
+    """
+    Pack the multi-mapping read profiles in ``nu`` into a CSR (compressed sparse row) matrix of read x reference
+    weights.
+
+    Rows follow the iteration order of ``nu``. Row ``i`` spans ``indices[indptr[i]:indptr[i + 1]]`` and the
+    corresponding slice of ``scores``.
+
+    :param nu: the multi-mapping read dict produced by :func:`build_matrix`
+    :return: a tuple of the read indexes, indptr, indices, scores, and per-read weights
+
+    """
+    read_indexes = list(nu)
+    read_count = len(read_indexes)
+
+    row_lengths = np.fromiter((len(nu[j][0]) for j in read_indexes), dtype=np.int64, count=read_count)
+
+    indptr = np.zeros(read_count + 1, dtype=np.int64)
+    np.cumsum(row_lengths, out=indptr[1:])
+
+    nnz = int(indptr[-1])
+
+    indices = np.fromiter(
+        itertools.chain.from_iterable(nu[j][0] for j in read_indexes),
+        dtype=np.int64,
+        count=nnz
+    )
+
+    scores = np.fromiter(
+        itertools.chain.from_iterable(nu[j][1] for j in read_indexes),
+        dtype=np.float64,
+        count=nnz
+    )
+
+    weights = np.fromiter((nu[j][3] for j in read_indexes), dtype=np.float64, count=read_count)
+
+    return read_indexes, indptr, indices, scores, weights
+
+
+def em_csr(u_refs, u_weights, indptr, indices, scores, weights, genome_count, max_iter, epsilon, pi_prior,
+           theta_prior, counts=None, accelerate=False):
+    """
+    Run the Pathoscope EM algorithm on array inputs.
+
+    Uniquely mapped reads are given as parallel ``u_refs`` and ``u_weights`` arrays. Multi-mapping reads are given as
+    a CSR matrix (``indptr``, ``indices``, ``scores``) with one row per read and a per-row ``weights`` array.
+
+    If ``counts`` is given, each row is an equivalence class standing in for ``counts[row]`` reads with an identical
+    profile (see :func:`collapse_profiles`).
+
+    If ``accelerate`` is ``True``, SQUAREM extrapolation is used (see :func:`squarem`). ``max_iter`` limits the number
+    of EM steps in both modes.
+
+    Returns ``init_pi``, ``pi`` and ``theta`` as arrays, the normalized read x reference assignments (``x_norm``)
+    aligned with ``indices``, and a :class:`dict` of convergence statistics. ``x_norm`` is ``None`` if no iterations
+    were run.
+
+    """
+    started = time.perf_counter()
+
+    pi = np.full(genome_count, 1. / genome_count)
+    init_pi = pi
+    theta = pi.copy()
+
+    pi_sum_0 = np.bincount(u_refs, weights=u_weights, minlength=genome_count)
+
+    row_count = len(indptr) - 1
+    rows = np.repeat(np.arange(row_count), np.diff(indptr))
+
+    max_u_weights = u_weights.max() if len(u_weights) else 0
+    u_total = u_weights.sum() if len(u_weights) else 0
+
+    if counts is None:
+        read_weights = weights
+        nu_length = row_count or 1
+    else:
+        read_weights = weights * counts
+        nu_length = int(counts.sum()) or 1
+
+    max_nu_weights = weights.max() if row_count else 0
+    nu_total = read_weights.sum() if row_count else 0
+
+    prior_weight = max(max_u_weights, max_nu_weights)
+
+    pip = pi_prior * prior_weight
+    theta_p = theta_prior * prior_weight
+    nu_total_div = nu_total or 1
+
+    def step(pi, theta):
+        # E step
+        x = pi[indices] * theta[indices] * scores
+        x_sum = np.bincount(rows, weights=x, minlength=row_count)[rows]
+
+        # Avoid dividing by 0 at all times.
+        x_norm = np.divide(x, x_sum, out=np.zeros_like(x), where=x_sum != 0)
+
+        theta_sum = np.bincount(indices, weights=x_norm * read_weights[rows], minlength=genome_count)
+
+        # M step
+        pi = (theta_sum + pi_sum_0 + pip) / (u_total + nu_total + pip * genome_count)
+        theta = (theta_sum + theta_p) / (nu_total_div + theta_p * genome_count)
+
+        return pi, theta, x_norm
+
+    def objective(pi, theta):
+        # The penalized log-likelihood maximized by the EM updates.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_pi = np.log(pi)
+            log_theta = np.log(theta)
+
+            row_sums = np.bincount(rows, weights=pi[indices] * theta[indices] * scores, minlength=row_count)
+
+            value = np.sum(np.where(pi_sum_0 > 0, pi_sum_0 * log_pi, 0))
+            value += np.sum(np.where(read_weights > 0, read_weights * np.log(row_sums), 0))
+
+        if pip:
+            value += pip * log_pi.sum()
+
+        if theta_p:
+            value += theta_p * log_theta.sum()
+
+        return value
+
+    x_norm = None
+
+    iterations = 0
+    evaluations = 0
+    cutoff = None
+
+    if accelerate and nu_length > 1:
+        init_pi, pi, theta, x_norm, iterations, evaluations, cutoff = squarem(
+            step,
+            objective,
+            pi,
+            theta,
+            max_iter,
+            epsilon
+        )
+    else:
+        for i in range(max_iter):
+            pi_old = pi
+
+            pi, theta, x_norm = step(pi, theta)
+
+            if i == 0:
+                init_pi = pi
+
+            iterations = evaluations = i + 1
+
+            cutoff = np.abs(pi_old - pi).sum()
+
+            if cutoff <= epsilon or nu_length == 1:
+                break
+
+    stats = {
+        "accelerated": bool(accelerate and nu_length > 1),
+        "iterations": iterations,
+        "evaluations": evaluations,
+        "delta": None if cutoff is None else float(cutoff),
+        "converged": cutoff is not None and bool(cutoff <= epsilon),
+        "duration": time.perf_counter() - started
+    }
+
+    return init_pi, pi, theta, x_norm, stats
+
+
+def squarem(step, objective, pi, theta, max_iter, epsilon):
+    """
+    Accelerate the EM fixed-point ``step`` function using SQUAREM (Varadhan & Roland, 2008) with the SqS3 step length.
+
+    Each cycle takes two EM steps from the current parameters, extrapolates along the squared iteration and takes a
+    stabilizing EM step from the extrapolated point. The extrapolated parameters are projected back onto the simplex.
+    If the extrapolated result has a lower ``objective`` than the plain second EM step, the plain step is kept. This
+    makes each cycle at least as good as two EM iterations.
+
+    ``max_iter`` limits the total number of calls to ``step``. The first EM step gives ``init_pi``, as in the plain
+    algorithm.
+
+    :return: ``init_pi``, ``pi``, ``theta``, ``x_norm``, the number of cycles, the number of EM steps and the L1
+             change in ``pi`` over the last cycle
+
+    """
+    init_pi = pi
+    x_norm = None
+
+    cycles = 0
+    evaluations = 0
+    cutoff = None
+
+    while evaluations < max_iter:
+        pi_0 = pi
+        theta_0 = theta
+
+        pi_1, theta_1, x_norm_1 = step(pi_0, theta_0)
+        evaluations += 1
+
+        if evaluations == 1:
+            init_pi = pi_1
+
+        pi, theta, x_norm = pi_1, theta_1, x_norm_1
+
+        if evaluations < max_iter and np.abs(pi_1 - pi_0).sum() > epsilon:
+            pi_2, theta_2, x_norm_2 = step(pi_1, theta_1)
+            evaluations += 1
+
+            pi, theta, x_norm = pi_2, theta_2, x_norm_2
+
+            r_pi = pi_1 - pi_0
+            r_theta = theta_1 - theta_0
+
+            v_pi = pi_2 - pi_1 - r_pi
+            v_theta = theta_2 - theta_1 - r_theta
+
+            r_norm = np.sqrt(np.sum(r_pi ** 2) + np.sum(r_theta ** 2))
+            v_norm = np.sqrt(np.sum(v_pi ** 2) + np.sum(v_theta ** 2))
+
+            if v_norm > 0 and evaluations < max_iter:
+                alpha = min(-r_norm / v_norm, -1.0)
+
+                pi_e = project(pi_0 - 2 * alpha * r_pi + alpha ** 2 * v_pi, pi_2.sum())
+                theta_e = project(theta_0 - 2 * alpha * r_theta + alpha ** 2 * v_theta, theta_2.sum())
+
+                pi_s, theta_s, x_norm_s = step(pi_e, theta_e)
+                evaluations += 1
+
+                # Monotonicity safeguard.
+                if objective(pi_s, theta_s) >= objective(pi_2, theta_2):
+                    pi, theta, x_norm = pi_s, theta_s, x_norm_s
+
+        cycles += 1
+
+        cutoff = np.abs(pi_0 - pi).sum()
+
+        if cutoff <= epsilon:
+            break
+
+    return init_pi, pi, theta, x_norm, cycles, evaluations, cutoff
+
+
+def project(values, total):
+    """
+    Project extrapolated parameters back to non-negative values that sum to ``total``.
+
+    """
+    values = np.clip(values, 0, None)
+
+    value_sum = values.sum()
+
+    if value_sum == 0:
+        return values
+
+    return values * (total / value_sum)
+
+
+def em_sparse(u, nu, genomes, max_iter, epsilon, pi_prior, theta_prior):
+    """
+    A vectorized implementation of :func:`em`.
+
+    The ``nu`` read x reference weights are held as a CSR matrix (see :func:`build_csr`) and each E-step and M-step is
+    computed with array operations instead of per-read Python loops. Takes the same arguments and returns the same
+    ``init_pi``, ``pi``, ``theta`` and updated ``nu`` as :func:`em`, within floating point tolerance.
+
+    """
+    u_refs = np.fromiter((u[i][0] for i in u), dtype=np.int64, count=len(u))
+    u_weights = np.fromiter((u[i][1] for i in u), dtype=np.float64, count=len(u))
+
+    read_indexes, indptr, indices, scores, weights = build_csr(nu)
+
+    init_pi, pi, theta, x_norm, _ = em_csr(
+        u_refs,
+        u_weights,
+        indptr,
+        indices,
+        scores,
+        weights,
+        len(genomes),
+        max_iter,
+        epsilon,
+        pi_prior,
+        theta_prior
+    )
+
+    if x_norm is not None:
+        for read_index, row in zip(read_indexes, np.split(x_norm, indptr[1:-1])):
+            nu[read_index][2] = row.tolist()
+
+    return init_pi.tolist(), pi.tolist(), theta.tolist(), nu
+
+
+def collapse_profiles(indptr, indices, scores):
+    """
+    Group the rows of a CSR read matrix into equivalence classes of reads with identical mapping profiles (the same
+    references in the same order with the same scores).
+
+    :param indptr: the row offsets
+    :param indices: the reference index of each entry
+    :param scores: the score of each entry
+    :return: the class CSR matrix (``indptr``, ``indices``, ``scores``), the number of reads in each class, and the
+             class index of each row
+
+    """
+    row_count = len(indptr) - 1
+
+    index_bytes = indices.astype(np.int32).tobytes()
+    score_bytes = scores.tobytes()
+
+    classes = dict()
+
+    read_classes = np.empty(row_count, dtype=np.int64)
+    first_rows = list()
+
+    offsets = indptr.tolist()
+
+    for row in range(row_count):
+        start = offsets[row]
+        end = offsets[row + 1]
+
+        key = index_bytes[start * 4:end * 4] + score_bytes[start * 8:end * 8]
+
+        class_index = classes.get(key)
+
+        if class_index is None:
+            class_index = classes[key] = len(first_rows)
+            first_rows.append(row)
+
+        read_classes[row] = class_index
+
+    del classes
+
+    first_rows = np.array(first_rows, dtype=np.int64)
+
+    row_lengths = np.diff(indptr)
+    class_lengths = row_lengths[first_rows]
+
+    class_indptr = np.zeros(len(first_rows) + 1, dtype=np.int64)
+    np.cumsum(class_lengths, out=class_indptr[1:])
+
+    class_entries = np.repeat(indptr[first_rows], class_lengths) + entry_offsets(class_indptr)
+
+    counts = np.bincount(read_classes, minlength=len(first_rows))
+
+    return class_indptr, indices[class_entries], scores[class_entries], counts, read_classes
+
+
+def entry_offsets(indptr):
+    """
+    Return the offset of each entry of a CSR matrix within its row.
+
+    :param indptr: the row offsets
+    :return: an array of entry offsets
+
+    """
+    return np.arange(indptr[-1]) - np.repeat(indptr[:-1], np.diff(indptr))
+
+
+def em_matrix(matrix, max_iter, epsilon, pi_prior, theta_prior, accelerate=False):
+    """
+    Run the EM algorithm on a matrix built by :func:`build_matrix_arrays`.
+
+    Multi-mapping reads with identical profiles are collapsed into weighted equivalence classes with
+    :func:`collapse_profiles` so the cost of each iteration scales with the number of distinct profiles rather than the
+    number of reads. The class assignments are then expanded back to the ``x_norm`` entries of every read in place.
+
+    Pass ``accelerate=True`` to use SQUAREM extrapolation (see :func:`squarem`).
+
+    :return: ``init_pi``, ``pi`` and ``theta`` as lists and a dict of convergence statistics
+
+    """
+    u_refs, u_weights, nu_mask, nu_indptr = split_matrix(matrix)
+
+    class_indptr, class_indices, class_scores, counts, read_classes = collapse_profiles(
+        nu_indptr,
+        matrix["indices"][nu_mask],
+        matrix["scores"][nu_mask]
+    )
+
+    if len(class_scores):
+        class_weights = np.maximum.reduceat(class_scores, class_indptr[:-1])
+    else:
+        class_weights = class_scores
+
+    init_pi, pi, theta, x_norm, stats = em_csr(
+        u_refs,
+        u_weights,
+        class_indptr,
+        class_indices,
+        class_scores,
+        class_weights,
+        len(matrix["refs"]),
+        max_iter,
+        epsilon,
+        pi_prior,
+        theta_prior,
+        counts=counts,
+        accelerate=accelerate
+    )
+
+    if x_norm is not None:
+        class_starts = np.repeat(class_indptr[:-1][read_classes], np.diff(nu_indptr))
+        matrix["x_norm"][nu_mask] = x_norm[class_starts + entry_offsets(nu_indptr)]
+
+    return init_pi.tolist(), pi.tolist(), theta.tolist(), stats
+
+
 def find_updated_score(nu, read_index, ref_index):
     try:
         index = nu[read_index][0].index(ref_index)
@@ -296,50 +951,58 @@ def compute_best_hit(u, nu, refs, reads):
     return best_hit_reads, best_hit, level_1, level_2
 
 
-def write_report(path, pi, refs, read_count, init_pi, best_hit_initial, best_hit_initial_reads, best_hit_final,
-                 best_hit_final_reads, level_1_initial, level_2_initial, level_1_final, level_2_final):
-    tmp = zip(
-        pi,
-        refs,
-        init_pi,
-        best_hit_initial,
-        best_hit_initial_reads,
-        best_hit_final,
-        best_hit_final_reads,
-        level_1_initial,
-        level_2_initial,
-        level_1_final,
-        level_2_final
-    )
+def compute_best_hit_matrix(matrix):
+    """
+    Compute best hit statistics for a matrix built by :func:`build_matrix_arrays`. Gives the same result as
+    :func:`compute_best_hit`.
+
+    Uniquely mapped reads have an ``x_norm`` of ``1.0`` so they are counted as best and high confidence hits.
 
-    tmp = sorted(tmp, reverse=True)
+    """
+    ref_count = len(matrix["refs"])
+    read_count = matrix["read_count"]
 
-    x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11 = zip(*tmp)
+    indptr = matrix["indptr"]
+    indices = matrix["indices"]
+    x_norm = matrix["x_norm"]
 
-    no_cutoff = False
+    rows = np.repeat(np.arange(read_count), np.diff(indptr))
 
-    for i, _ in enumerate(x10):
-        if not no_cutoff and x1[i] < 0.01 and x10[i] <= 0 and x11[i] <= 0:
-            break
+    if len(x_norm):
+        best_ref = np.maximum.reduceat(x_norm, indptr[:-1])[rows]
+    else:
+        best_ref = x_norm
 
-        if i == (len(x10) - 1):
-            i += 1
-
-    # Changing the column order here
-    tmp = zip(
-        x2[:i],
-        x1[:i],
-        x6[:i],
-        x7[:i],
-        x10[:i],
-        x11[:i],
-        x3[:i],
-        x4[:i],
-        x5[:i],
-        x8[:i],
-        x9[:i]
+    is_best = x_norm == best_ref
+
+    num_best_ref = np.bincount(rows[is_best], minlength=read_count)
+    num_best_ref[num_best_ref == 0] = 1
+
+    best_hit_reads = np.bincount(
+        indices[is_best],
+        weights=1.0 / num_best_ref[rows[is_best]],
+        minlength=ref_count
     )
 
+    level_1_reads = np.bincount(indices[is_best & (x_norm >= 0.5)], minlength=ref_count)
+    level_2_reads = np.bincount(indices[is_best & (x_norm < 0.5) & (x_norm >= 0.01)], minlength=ref_count)
+
+    best_hit = best_hit_reads / read_count
+    level_1 = level_1_reads / read_count
+    level_2 = level_2_reads / read_count
+
+    return best_hit_reads.tolist(), best_hit.tolist(), level_1.tolist(), level_2.tolist()
+
+
+def write_report(path, pi, refs, read_count, init_pi, best_hit_initial, best_hit_initial_reads, best_hit_final,
+                 best_hit_final_reads, level_1_initial, level_2_initial, level_1_final, level_2_final):
+    """
+    Write a Pathoscope TSV report to ``path`` and return the reported hits.
+
+    Only the references selected by :func:`find_report_refs` are ordered. Their TSV rows and result hits are built
+    in one pass over the per-reference columns.
+
+    """
     with open(path, "w") as handle:
         csv_writer = csv.writer(handle, delimiter='\t')
 
@@ -361,34 +1024,79 @@ def write_report(path, pi, refs, read_count, init_pi, best_hit_initial, best_hit
 
         csv_writer.writerow(header1)
         csv_writer.writerow(header)
-        csv_writer.writerows(tmp)
 
-    results = dict()
+        results = dict()
+
+        for i in find_report_refs(pi, refs, level_1_final, level_2_final):
+            ref_id = refs[i]
+
+            csv_writer.writerow([
+                ref_id,
+                pi[i],
+                best_hit_final[i],
+                best_hit_final_reads[i],
+                level_1_final[i],
+                level_2_final[i],
+                init_pi[i],
+                best_hit_initial[i],
+                best_hit_initial_reads[i],
+                level_1_initial[i],
+                level_2_initial[i]
+            ])
 
-    for i, ref_id in enumerate(x2[:i]):
-        if x1[i] < 0.01 and x10[i] <= 0 and x11[i] <= 0:
-            pass
-        else:
             results[ref_id] = {
                 "final": {
-                    "pi": x1[i],
-                    "best": x6[i],
-                    "high": x10[i],
-                    "low": x11[i],
-                    "reads": int(x7[i])
+                    "pi": pi[i],
+                    "best": best_hit_final[i],
+                    "high": level_1_final[i],
+                    "low": level_2_final[i],
+                    "reads": int(best_hit_final_reads[i])
                 },
                 "initial": {
-                    "pi": x3[i],
-                    "best": x4[i],
-                    "high": x8[i],
-                    "low": x9[i],
-                    "reads": int(x5[i])
+                    "pi": init_pi[i],
+                    "best": best_hit_initial[i],
+                    "high": level_1_initial[i],
+                    "low": level_2_initial[i],
+                    "reads": int(best_hit_initial_reads[i])
                 }
             }
 
     return results
 
 
+def find_report_refs(pi, refs, level_1_final, level_2_final):
+    """
+    Find the indexes of the references to include in a Pathoscope report in report order.
+
+    References are reported in descending order of final ``pi``, with ties broken by descending reference ID. The report
+    stops at the first reference with a final ``pi`` below ``0.01`` and no high or low confidence hits.
+
+    Rather than sorting every reference, the stopping reference is found directly. Only the references ordered
+    before it are sorted.
+
+    :param pi: the final pi values
+    :param refs: the reference IDs
+    :param level_1_final: the final high confidence hits
+    :param level_2_final: the final low confidence hits
+    :return: an array of reference indexes
+
+    """
+    pi = np.asarray(pi, dtype=np.float64)
+    refs = np.asarray(refs, dtype=str)
+
+    is_empty = (pi < 0.01) & (np.asarray(level_1_final) <= 0) & (np.asarray(level_2_final) <= 0)
+
+    if is_empty.any():
+        cutoff_pi = pi[is_empty].max()
+        cutoff_ref = max(refs[is_empty & (pi == cutoff_pi)].tolist())
+
+        selected = np.flatnonzero((pi > cutoff_pi) | ((pi == cutoff_pi) & (refs > cutoff_ref)))
+    else:
+        selected = np.arange(len(pi))
+
+    return selected[np.lexsort((refs[selected], pi[selected]))[::-1]]
+
+
 def rewrite_align(u, nu, vta_path, p_score_cutoff, path):
     with open(path, 'w') as of:
         with open(vta_path, 'r') as in1:
@@ -435,30 +1143,189 @@ def rewrite_align(u, nu, vta_path, p_score_cutoff, path):
                     of.write(line)
 
 
+def find_reassigned_lines(matrix, p_score_cutoff):
+    """
+    Decide which of the alignments used to build ``matrix`` are kept after reassignment. Gives the same selection as
+    :func:`rewrite_align`.
+
+    :param matrix: a matrix built by :func:`build_matrix_arrays` or :func:`build_matrix_vtb`
+    :param p_score_cutoff: multi-mapping alignments with an updated score below this value are dropped
+    :return: a boolean array with one value per alignment that passed the matrix cutoff
+
+    """
+    indptr = matrix["indptr"]
+    line_entries = matrix["line_entries"]
+
+    rows = np.searchsorted(indptr, line_entries, side="right") - 1
+    multi = (np.diff(indptr) > 1)[rows]
+
+    # Uniquely mapped reads are only written for the first line they appear on.
+    first = np.zeros(len(line_entries), dtype=bool)
+    first[np.unique(rows, return_index=True)[1]] = True
+
+    return np.where(multi, matrix["x_norm"][line_entries] >= p_score_cutoff, first)
+
+
+def rewrite_align_matrix(matrix, vta_path, p_score_cutoff, path):
+    """
+    Write the reassigned alignments for a matrix built by :func:`build_matrix_arrays` from ``vta_path``. Gives the same
+    output as :func:`rewrite_align`.
+
+    Which lines to keep is decided for all lines at once by :func:`find_reassigned_lines`. The VTA file is then
+    streamed once to copy those lines.
+
+    """
+    keep = find_reassigned_lines(matrix, p_score_cutoff)
+
+    matrix_cutoff = matrix["p_score_cutoff"]
+
+    with open(path, "w") as of:
+        with open(vta_path, "r") as handle:
+            line_index = 0
+
+            for line in handle:
+                if float(line[line.rindex(",") + 1:]) < matrix_cutoff:
+                    continue
+
+                if keep[line_index]:
+                    of.write(line)
+
+                line_index += 1
+
+
+def rewrite_align_vtb(matrix, vtb_path, p_score_cutoff, path):
+    """
+    Write a new VTB at ``path`` containing the reassigned alignments for a matrix built by :func:`build_matrix_vtb`.
+
+    """
+    columns = virtool.vtb.read_columns(vtb_path)
+
+    lines = np.flatnonzero(columns["score"] >= matrix["p_score_cutoff"])
+
+    mask = np.zeros(len(columns["score"]), dtype=bool)
+    mask[lines[find_reassigned_lines(matrix, p_score_cutoff)]] = True
+
+    virtool.vtb.write_subset(vtb_path, path, mask)
+
+
 def calculate_coverage(vta_path, ref_lengths):
-    coverage_dict = dict()
-    pos_length_list = list()
+    """
+    Calculate coverage for the alignments in the VTA file at ``vta_path``.
+
+    Alignments are streamed into typed arrays and passed to :func:`calculate_pileups`.
+
+    :param vta_path: the path to the VTA file
+    :param ref_lengths: the length of each reference sequence
+    :return: a dict of coverage arrays keyed by reference ID
+
+    """
+    ref_ids = dict()
+    ref_names = list()
+
+    ref_indexes = array.array("i")
+    positions = array.array("i")
+    lengths = array.array("i")
 
-    with open(vta_path, "r") as old_handle:
-        for line in old_handle:
+    with open(vta_path, "r") as handle:
+        for line in handle:
             _, ref_id, pos, length, _ = line.split(",")
 
-            coverage_dict[ref_id] = None
-            pos_length_list.append((ref_id, int(pos), int(length)))
+            ref_index = ref_ids.get(ref_id)
+
+            if ref_index is None:
+                ref_index = ref_ids[ref_id] = len(ref_names)
+                ref_names.append(ref_id)
+
+            ref_indexes.append(ref_index)
+            positions.append(int(pos))
+            lengths.append(int(length))
+
+    return calculate_pileups(
+        np.frombuffer(ref_indexes, dtype=np.int32),
+        np.frombuffer(positions, dtype=np.int32),
+        np.frombuffer(lengths, dtype=np.int32),
+        ref_names,
+        ref_lengths
+    )
+
+
+def calculate_pileups(ref_indexes, positions, lengths, ref_names, ref_lengths):
+    """
+    Calculate per-base coverage for each reference with at least one alignment.
+
+    Each alignment adds ``+1`` at its start and ``-1`` one past its end in a difference array covering all of the
+    references end to end. A cumulative sum of the difference array gives the depth at every base. This costs
+    O(alignments + total reference length) instead of O(alignments x read length). Alignments that run past the end of
+    a reference are clipped.
+
+    :param ref_indexes: the reference index of each alignment
+    :param positions: the 1-based leftmost mapping position of each alignment
+    :param lengths: the length of each alignment
+    :param ref_names: the reference IDs in index order
+    :param ref_lengths: the length of each reference sequence keyed by reference ID
+    :return: a dict of ``int32`` coverage arrays keyed by reference ID
+
+    """
+    present = np.unique(ref_indexes)
+
+    sizes = np.array([ref_lengths[ref_names[i]] for i in present.tolist()], dtype=np.int64)
+
+    offsets = np.zeros(len(present) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+
+    total = int(offsets[-1])
+
+    slots = np.searchsorted(present, ref_indexes)
+
+    slot_sizes = sizes[slots]
+    slot_offsets = offsets[slots]
 
-    for key in coverage_dict:
-        coverage_dict[key] = [0] * ref_lengths[key]
+    starts = np.clip(np.asarray(positions, dtype=np.int64) - 1, 0, slot_sizes)
+    ends = np.minimum(starts + lengths, slot_sizes)
 
-    for ref_id, pos, length in pos_length_list:
-        start_index = pos - 1
+    diff = np.bincount(slot_offsets + starts, minlength=total + 1)
+    diff -= np.bincount(slot_offsets + ends, minlength=total + 1)
 
-        for i in range(start_index, start_index + length):
-            try:
-                coverage_dict[ref_id][i] += 1
-            except IndexError:
-                pass
+    depths = np.cumsum(diff[:-1]).astype(np.int32)
 
-    return coverage_dict
+    return {ref_names[ref_index]: depths[offsets[i]:offsets[i + 1]] for i, ref_index in enumerate(present.tolist())}
+
+
+def calculate_coverage_vtb(vtb_path, ref_lengths):
+    """
+    Calculate coverage for the alignments in the VTB at ``vtb_path``. Gives the same result as
+    :func:`calculate_coverage`.
+
+    """
+    columns = virtool.vtb.read_columns(vtb_path)
+
+    return coverage_from_columns(
+        columns,
+        np.arange(len(columns["ref"])),
+        virtool.vtb.read_ids(vtb_path, "refs"),
+        ref_lengths
+    )
+
+
+def coverage_from_columns(columns, lines, ref_names, ref_lengths):
+    """
+    Calculate coverage for the VTB ``columns`` rows selected by the ``lines`` indexes using
+    :func:`calculate_pileups`.
+
+    :param columns: the VTB columns
+    :param lines: the indexes of the alignments to include
+    :param ref_names: the interned reference IDs of the VTB
+    :param ref_lengths: the length of each reference sequence
+    :return: a dict of coverage arrays keyed by reference ID
+
+    """
+    return calculate_pileups(
+        columns["ref"][lines],
+        columns["pos"][lines],
+        columns["length"][lines],
+        ref_names,
+        ref_lengths
+    )
 
 
 def subtract(analysis_path, host_scores):
@@ -491,3 +1358,127 @@ def subtract(analysis_path, host_scores):
     shutil.move(out_path, vta_path)
 
     return len(subtracted_read_ids)
+
+
+def subtract_vtb(analysis_path, host_scores):
+    """
+    Remove alignments for reads that map better to the subtraction host from ``to_isolates.vtb``. Gives the same result
+    as :func:`subtract`.
+
+    A legacy ``to_isolates.vta`` file is converted to a VTB first.
+
+    :param analysis_path: the analysis directory
+    :param host_scores: the best subtraction alignment score for each read ID
+    :return: the number of subtracted reads
+
+    """
+    vtb_path = virtool.vtb.ensure_vtb(analysis_path, "to_isolates")
+
+    columns = virtool.vtb.read_columns(vtb_path)
+
+    keep, subtracted_count = find_unsubtracted(columns, virtool.vtb.read_ids(vtb_path, "reads"), host_scores)
+
+    out_path = os.path.join(analysis_path, "subtracted.vtb")
+
+    virtool.vtb.write_subset(vtb_path, out_path, keep)
+
+    del columns
+
+    shutil.rmtree(vtb_path)
+    shutil.move(out_path, vtb_path)
+
+    return subtracted_count
+
+
+def find_unsubtracted(columns, read_names, host_scores):
+    """
+    Find the VTB alignments whose reads map better to the isolates than to the subtraction host.
+
+    :param columns: the VTB columns
+    :param read_names: the interned read IDs of the VTB
+    :param host_scores: the best subtraction alignment score for each read ID
+    :return: a boolean array selecting the alignments to keep and the number of subtracted reads
+
+    """
+    reads = columns["read"]
+
+    isolates_high_scores = np.zeros(len(read_names))
+    np.maximum.at(isolates_high_scores, reads, columns["score"])
+
+    host_high_scores = np.fromiter(
+        (host_scores.get(read_id, 0) for read_id in read_names),
+        dtype=np.float64,
+        count=len(read_names)
+    )
+
+    keep = (isolates_high_scores > host_high_scores)[reads]
+
+    return keep, len(np.unique(reads[~keep]))
+
+
+def run_fused(vtb_path, host_scores, ref_lengths, p_score_cutoff=0.01, max_iter=50, epsilon=1e-7, accelerate=False):
+    """
+    Run host subtraction, matrix building, EM reassignment and coverage calculation for the VTB at ``vtb_path`` in a
+    single pass over its columns.
+
+    Unlike running :func:`subtract_vtb`, :func:`build_matrix_vtb`, :func:`rewrite_align_vtb` and
+    :func:`calculate_coverage_vtb` in turn, no intermediate VTBs are written. Subtraction and reassignment are applied
+    as index selections on the memory-mapped columns. The results are the same.
+
+    The returned ``estimated_bytes`` dict gives the column bytes this function reads and writes, calculated from the
+    number of rows and the column types. Columns are memory-mapped, so the bytes actually read from disk depend on the
+    page cache.
+
+    :param vtb_path: the path to the unsubtracted VTB
+    :param host_scores: the best subtraction alignment score for each read ID
+    :param ref_lengths: the length of each reference sequence
+    :param p_score_cutoff: the minimum alignment and reassigned score
+    :param max_iter: the maximum number of EM iterations
+    :param epsilon: the EM convergence cutoff
+    :param accelerate: use SQUAREM accelerated EM
+    :return: a dict of results
+
+    """
+    columns = virtool.vtb.read_columns(vtb_path)
+    ref_names = virtool.vtb.read_ids(vtb_path, "refs")
+
+    keep, subtracted_count = find_unsubtracted(columns, virtool.vtb.read_ids(vtb_path, "reads"), host_scores)
+
+    kept = np.flatnonzero(keep)
+    lines = kept[columns["score"][kept] >= p_score_cutoff]
+
+    matrix = matrix_from_columns(columns, lines, ref_names, p_score_cutoff)
+
+    best_hit_initial_reads, best_hit_initial, level_1_initial, level_2_initial = compute_best_hit_matrix(matrix)
+
+    init_pi, pi, _, em_stats = em_matrix(matrix, max_iter, epsilon, 0, 0, accelerate=accelerate)
+
+    best_hit_final_reads, best_hit_final, level_1_final, level_2_final = compute_best_hit_matrix(matrix)
+
+    reassigned = lines[find_reassigned_lines(matrix, p_score_cutoff)]
+
+    coverage = coverage_from_columns(columns, reassigned, ref_names, ref_lengths)
+
+    row_size = sum(np.dtype(dtype).itemsize for dtype in virtool.vtb.COLUMNS.values())
+
+    return {
+        "subtracted_count": subtracted_count,
+        "refs": matrix["refs"],
+        "read_count": matrix["read_count"],
+        "init_pi": init_pi,
+        "pi": pi,
+        "best_hit_initial_reads": best_hit_initial_reads,
+        "best_hit_initial": best_hit_initial,
+        "level_1_initial": level_1_initial,
+        "level_2_initial": level_2_initial,
+        "best_hit_final_reads": best_hit_final_reads,
+        "best_hit_final": best_hit_final,
+        "level_1_final": level_1_final,
+        "level_2_final": level_2_final,
+        "coverage": coverage,
+        "em": em_stats,
+        "estimated_bytes": {
+            "read": len(keep) * row_size,
+            "written": 0
+        }
+    }
@@ -16,7 +16,9 @@ CONFIG_PROJECTION = (
     "lg_proc",
     "lg_mem",
     "sm_proc",
-    "sm_mem"
+    "sm_mem",
+    "job_policy",
+    "job_backfill_wait"
 )
 
 
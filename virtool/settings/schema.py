@@ -65,6 +65,46 @@ SCHEMA = {
         "default": 8
     },
 
+    # Analysis
+    "pathoscope_accelerate_em": {
+        "type": "boolean",
+        "default": False
+    },
+
+    # Job scheduling with the fair job policy. Weights default to 1 for users and tasks that are not listed.
+    "job_user_weights": {
+        "type": "dict",
+        "default": {},
+        "keysrules": {
+            "type": "string"
+        },
+        "valuesrules": {
+            "type": "number",
+            "min": 0
+        }
+    },
+    "job_task_weights": {
+        "type": "dict",
+        "default": {},
+        "keysrules": {
+            "type": "string"
+        },
+        "valuesrules": {
+            "type": "number",
+            "min": 0
+        }
+    },
+    "job_user_limit": {
+        "type": "integer",
+        "default": 0,
+        "min": 0
+    },
+    "job_aging_rate": {
+        "type": "number",
+        "default": 0.01,
+        "min": 0
+    },
+
     # Reference settings
     "default_source_types": {
         "type": "list",
@@ -1,6 +1,7 @@
 import logging
 
 import virtool.db.migrate
+import virtool.jobs.db
 
 logger = logging.getLogger("migrate")
 
@@ -20,7 +21,7 @@ async def migrate_subtractions(app):
     db = app["db"]
 
     logger.info(" • subtraction")
-    await virtool.db.migrate.delete_unready(db.subtraction)
+    await virtool.db.migrate.delete_unready(db.subtraction, await virtool.jobs.db.get_waiting_and_running_ids(db))
 
     await add_name_field(db)
     await add_deleted_field(db)
@@ -0,0 +1,300 @@
+"""
+A binary, memory-mappable columnar format for Pathoscope alignments (VTB).
+
+VTB replaces the comma-separated VTA intermediate. A VTB is a directory containing:
+
+- ``meta.json``: the format version and the number of alignments, reads and references
+- one raw little-endian file per column in :data:`COLUMNS`
+- ``reads.txt`` and ``refs.txt``: the interned read and reference IDs, one per line in index order
+
+Columns are read with :func:`read_columns`, which returns :class:`numpy.memmap` arrays without copying any data.
+
+"""
+import array
+import json
+import os
+import shutil
+
+import numpy as np
+
+VERSION = 1
+
+#: The columns stored for each alignment and their dtypes.
+COLUMNS = {
+    "read": "<i4",
+    "ref": "<i4",
+    "pos": "<i4",
+    "length": "<i4",
+    "score": "<f8"
+}
+
+TYPECODES = {
+    "<i4": "i",
+    "<f8": "d"
+}
+
+#: The number of alignments buffered in memory before they are written to the column files.
+CHUNK_SIZE = 65536
+
+
+class Writer:
+    """
+    Streams alignments into a new VTB at ``path``. Read and reference IDs are interned as they are first seen.
+
+    Use as a context manager:
+
+    .. code-block:: python
+
+        with virtool.vtb.Writer(path) as writer:
+            writer.write("read_1", "NC_001836", 12, 100, 187.0)
+
+    :param path: the path to create the VTB directory at
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        #: The number of alignments written.
+        self.count = 0
+
+        self._read_ids = dict()
+        self._ref_ids = dict()
+
+        self._buffers = {name: array.array(TYPECODES[dtype]) for name, dtype in COLUMNS.items()}
+        self._handles = dict()
+        self._reads_handle = None
+        self._refs_handle = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        os.makedirs(self.path)
+
+        self._handles = {name: open(os.path.join(self.path, f"{name}.bin"), "wb") for name in COLUMNS}
+
+        self._reads_handle = open(os.path.join(self.path, "reads.txt"), "w")
+        self._refs_handle = open(os.path.join(self.path, "refs.txt"), "w")
+
+    def write(self, read_id: str, ref_id: str, pos: int, length: int, score: float):
+        """
+        Write a single alignment.
+
+        :param read_id: the read ID
+        :param ref_id: the reference ID
+        :param pos: the 1-based leftmost mapping position
+        :param length: the length of the read
+        :param score: the alignment score
+
+        """
+        read_index = self._read_ids.get(read_id)
+
+        if read_index is None:
+            read_index = self._read_ids[read_id] = len(self._read_ids)
+            self._reads_handle.write(read_id + "\n")
+
+        ref_index = self._ref_ids.get(ref_id)
+
+        if ref_index is None:
+            ref_index = self._ref_ids[ref_id] = len(self._ref_ids)
+            self._refs_handle.write(ref_id + "\n")
+
+        buffers = self._buffers
+
+        buffers["read"].append(read_index)
+        buffers["ref"].append(ref_index)
+        buffers["pos"].append(pos)
+        buffers["length"].append(length)
+        buffers["score"].append(score)
+
+        self.count += 1
+
+        if len(buffers["read"]) == CHUNK_SIZE:
+            self.flush()
+
+    def write_batch(self, read_ids: list, ref_ids: list, positions: list, lengths: list, scores: list):
+        """
+        Write a columnar batch of alignments, such as one produced by :func:`virtool.jobs.sam.parse_batch`.
+
+        :param read_ids: the read IDs
+        :param ref_ids: the reference IDs
+        :param positions: the 1-based leftmost mapping positions
+        :param lengths: the lengths of the reads
+        :param scores: the alignment scores
+
+        """
+        buffers = self._buffers
+
+        buffers["read"].extend(self._intern(read_ids, self._read_ids, self._reads_handle))
+        buffers["ref"].extend(self._intern(ref_ids, self._ref_ids, self._refs_handle))
+        buffers["pos"].extend(positions)
+        buffers["length"].extend(lengths)
+        buffers["score"].extend(scores)
+
+        self.count += len(read_ids)
+
+        if len(buffers["read"]) >= CHUNK_SIZE:
+            self.flush()
+
+    @staticmethod
+    def _intern(ids: list, indexes: dict, handle) -> list:
+        interned = list()
+
+        for id_ in ids:
+            index = indexes.get(id_)
+
+            if index is None:
+                index = indexes[id_] = len(indexes)
+                handle.write(id_ + "\n")
+
+            interned.append(index)
+
+        return interned
+
+    def flush(self):
+        for name, buffer in self._buffers.items():
+            buffer.tofile(self._handles[name])
+            del buffer[:]
+
+    def close(self):
+        self.flush()
+
+        for handle in self._handles.values():
+            handle.close()
+
+        self._reads_handle.close()
+        self._refs_handle.close()
+
+        write_meta(self.path, self.count, len(self._read_ids), len(self._ref_ids))
+
+
+def write_meta(path: str, count: int, read_count: int, ref_count: int):
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({
+            "version": VERSION,
+            "count": count,
+            "reads": read_count,
+            "refs": ref_count
+        }, f)
+
+
+def read_meta(path: str) -> dict:
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        return json.load(f)
+
+
+def read_columns(path: str) -> dict:
+    """
+    Memory-map the columns of the VTB at ``path``. No alignment data is copied.
+
+    :param path: the VTB path
+    :return: a dict of column names and read-only arrays
+
+    """
+    count = read_meta(path)["count"]
+
+    columns = dict()
+
+    for name, dtype in COLUMNS.items():
+        if count:
+            columns[name] = np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=(count,))
+        else:
+            columns[name] = np.empty(0, dtype=dtype)
+
+    return columns
+
+
+def read_ids(path: str, name: str) -> list:
+    """
+    Read the interned ``reads`` or ``refs`` IDs of the VTB at ``path`` in index order.
+
+    :param path: the VTB path
+    :param name: ``reads`` or ``refs``
+    :return: a list of IDs
+
+    """
+    with open(os.path.join(path, f"{name}.txt"), "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def write_subset(path: str, target: str, mask: np.ndarray):
+    """
+    Write a new VTB at ``target`` containing the alignments in the VTB at ``path`` that are selected by the boolean
+    ``mask``. Interned IDs and their indexes are unchanged.
+
+    :param path: the source VTB path
+    :param target: the path for the new VTB
+    :param mask: a boolean array with one value per alignment
+
+    """
+    meta = read_meta(path)
+    columns = read_columns(path)
+
+    os.makedirs(target)
+
+    for name, column in columns.items():
+        column[mask].tofile(os.path.join(target, f"{name}.bin"))
+
+    for name in ["reads", "refs"]:
+        shutil.copyfile(os.path.join(path, f"{name}.txt"), os.path.join(target, f"{name}.txt"))
+
+    write_meta(target, int(np.count_nonzero(mask)), meta["reads"], meta["refs"])
+
+
+def convert_vta(vta_path: str, path: str):
+    """
+    Convert the legacy comma-separated VTA file at ``vta_path`` to a VTB at ``path``.
+
+    :param vta_path: the VTA path
+    :param path: the path for the new VTB
+
+    """
+    with Writer(path) as writer:
+        with open(vta_path, "r") as handle:
+            for line in handle:
+                read_id, ref_id, pos, length, score = line.rstrip().split(",")
+                writer.write(read_id, ref_id, int(pos), int(length), float(score))
+
+
+def write_vta(path: str, vta_path: str):
+    """
+    Write the alignments in the VTB at ``path`` to a legacy VTA file at ``vta_path``.
+
+    :param path: the VTB path
+    :param vta_path: the path for the VTA file
+
+    """
+    columns = read_columns(path)
+
+    read_names = read_ids(path, "reads")
+    ref_names = read_ids(path, "refs")
+
+    with open(vta_path, "w") as handle:
+        for read_index, ref_index, pos, length, score in zip(*(columns[name].tolist() for name in COLUMNS)):
+            handle.write(f"{read_names[read_index]},{ref_names[ref_index]},{pos},{length},{score}\n")
+
+
+def ensure_vtb(analysis_path: str, name: str) -> str:
+    """
+    Return the path to the VTB called ``name`` in ``analysis_path``.
+
+    Older analysis directories contain a legacy ``<name>.vta`` file. It is converted to a VTB the first time it is
+    requested.
+
+    :param analysis_path: the analysis directory
+    :param name: the alignment file name without an extension (eg. `to_isolates`)
+    :return: the VTB path
+
+    """
+    path = os.path.join(analysis_path, f"{name}.vtb")
+    vta_path = os.path.join(analysis_path, f"{name}.vta")
+
+    if not os.path.isdir(path) and os.path.isfile(vta_path):
+        convert_vta(vta_path, path)
+
+    return path